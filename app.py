@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, abort, send_file, send_from_directory, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_socketio import SocketIO, emit, join_room, leave_room
@@ -6,11 +6,29 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
 import re
-from cryptography.fernet import Fernet
+import atexit
 import json
 import uuid
-from werkzeug.utils import secure_filename
+import mimetypes
+from urllib.parse import quote
 from functools import wraps
+from socket_queue import socketio_queue_options
+from group_commit import GroupCommitWriter
+from sqlite_profile import is_sqlite_file, sqlite_engine_options, apply_pragmas, WriterQueue
+from db_pool import PoolMetrics, is_postgresql, pool_settings, postgres_engine_options, timed_pool_class
+from presence import PresenceRegistry, EXPIRY_INTERVALS
+from typing_state import TypingRegistry
+from ban_registry import BanRegistry
+from attachments import AttachmentStore, DEFAULT_CHUNK_SIZE, safe_filename
+from avatars import AvatarStore, AvatarError, avatar_key, avatar_path, sniff_image_type, AVATAR_SIZES, FILE_PATTERN as AVATAR_FILE_PATTERN
+from compression import CompressionMiddleware, websocket_deflate, DEFAULT_MIN_SIZE, DEFAULT_LEVEL
+from static_assets import AssetManifest, IMMUTABLE_MAX_AGE, is_compressible
+from user_index import UserSearchIndex
+from encryption import KeyRing
+from migrations import run_migrations
+from message_search import ensure_search_index, drop_search_index, search_messages, search_encrypted
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'nexa-messenger-secret-key-2024'
@@ -18,6 +36,9 @@ app.config['SECRET_KEY'] = 'nexa-messenger-secret-key-2024'
 database_url = os.environ.get('DATABASE_URL')
 if database_url and database_url.startswith('postgres://'):
     database_url = database_url.replace('postgres://', 'postgresql://', 1)
+# Драйвер из requirements.txt (SQLAlchemy 2.1 по умолчанию выбирает psycopg 3)
+if database_url and database_url.startswith('postgresql://'):
+    database_url = database_url.replace('postgresql://', 'postgresql+psycopg2://', 1)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'sqlite:///nexa_messenger.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -32,13 +53,117 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB максимум
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+app.config['AVATAR_MAX_BYTES'] = int(os.environ.get('AVATAR_MAX_BYTES', 8 * 1024 * 1024))
+
+# Вложения сообщений (см. attachments.py): хранятся вне static и отдаются только участникам
+app.config['ATTACHMENT_FOLDER'] = os.environ.get('ATTACHMENT_FOLDER', os.path.join(app.instance_path, 'attachments'))
+app.config['ATTACHMENT_MAX_BYTES'] = int(os.environ.get('ATTACHMENT_MAX_BYTES', 100 * 1024 * 1024))
+app.config['ATTACHMENT_CHUNK_SIZE'] = min(
+    int(os.environ.get('ATTACHMENT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)), app.config['MAX_CONTENT_LENGTH']
+)
+app.config['ATTACHMENT_EXTENSIONS'] = app.config['ALLOWED_EXTENSIONS'] | {
+    'pdf', 'txt', 'zip', '7z', 'rar', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'mp3', 'ogg', 'mp4', 'webm'
+}
+app.config['ATTACHMENT_UPLOAD_TTL'] = int(os.environ.get('ATTACHMENT_UPLOAD_TTL', 24 * 3600))  # с
+# Префикс internal-location nginx: файл отдает nginx (sendfile, Range), а не воркер
+app.config['ATTACHMENT_ACCEL_REDIRECT'] = os.environ.get('ATTACHMENT_ACCEL_REDIRECT')
+
+# Общая шина Socket.IO для нескольких воркеров (см. socket_queue.py и gunicorn.conf.py)
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+# Время ожидания соединений из пула (/api/admin/db_pool)
+pool_metrics = PoolMetrics()
+
+# Профиль SQLite для файловой базы: WAL, прагмы и очередь записи (см. sqlite_profile.py)
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', '1').lower() not in ('0', 'false', 'no', 'off')
+use_sqlite_profile = app.config['SQLITE_PROFILE'] and is_sqlite_file(app.config['SQLALCHEMY_DATABASE_URI'])
+if use_sqlite_profile:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['poolclass'] = timed_pool_class(pool_metrics)
+
+# Пул соединений PostgreSQL по модели воркеров gunicorn (см. db_pool.py)
+if is_postgresql(app.config['SQLALCHEMY_DATABASE_URI']):
+    app.config['DB_POOL'] = pool_settings()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = postgres_engine_options(app.config['DB_POOL'], pool_metrics)
 
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+if use_sqlite_profile:
+    with app.app_context():
+        apply_pragmas(db.engine)
+# Сжатие ответов (см. compression.py): JSON истории и админки, long-polling и permessage-deflate Socket.IO
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1').lower() not in ('0', 'false', 'no', 'off')
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', DEFAULT_LEVEL))
+app.config['SOCKETIO_WEBSOCKET_DEFLATE'] = os.environ.get('SOCKETIO_WEBSOCKET_DEFLATE', 'on')
+websocket_deflate(app.config['SOCKETIO_WEBSOCKET_DEFLATE'])
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    http_compression=app.config['COMPRESS_RESPONSES'],
+                    compression_threshold=app.config['COMPRESS_MIN_SIZE'],
+                    **socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
+if app.config['COMPRESS_RESPONSES']:
+    # Снаружи middleware Socket.IO: пути /socket.io пропускаются, их сжимает engine.io
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app, min_size=app.config['COMPRESS_MIN_SIZE'], level=app.config['COMPRESS_LEVEL']
+    )
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Отправка сообщений через один поток записи. По умолчанию выключено: очередь выполняет
+# задания по одному, без пачек, и на замерах медленнее прямой записи с busy_timeout;
+# правки, реакции и отметки прочтения через нее не идут
+app.config['SQLITE_WRITER_QUEUE'] = os.environ.get('SQLITE_WRITER_QUEUE', '').lower() in ('1', 'true', 'yes', 'on')
+message_writer = WriterQueue(wrap=app.app_context) if use_sqlite_profile and app.config['SQLITE_WRITER_QUEUE'] else None
+
+def write(func, *args, **kwargs):
+    """Выполняет запись через очередь записи SQLite (если она включена) и возвращает результат"""
+    if message_writer is None:
+        return func(*args, **kwargs)
+    return message_writer.run(func, *args, **kwargs)
+
+# Статические файлы: отпечатки в адресах, сжатые варианты и долгое кеширование (см. static_assets.py)
+asset_manifest = AssetManifest(app.static_folder)
+asset_manifest.check(strict=os.environ.get('STATIC_MANIFEST_STRICT', '').lower() in ('1', 'true', 'yes'))
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    """url_for('static', ...) получает ?v=<хеш файла>"""
+    if endpoint == 'static' and 'v' not in values:
+        version = asset_manifest.version(values.get('filename'))
+        if version:
+            values['v'] = version
+
+def serve_static(filename):
+    """Отдает статический файл (сжатый вариант - по Accept-Encoding) с заголовками кеширования"""
+    variant = asset_manifest.variant(filename, request.headers.get('Accept-Encoding', ''))
+    if variant:
+        response = send_from_directory(app.static_folder, variant[0],
+                                       mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+        response.headers['Content-Encoding'] = variant[1]
+    else:
+        response = send_from_directory(app.static_folder, filename, conditional=True)
+    if is_compressible(filename):
+        response.vary.add('Accept-Encoding')
+    
+    # Адрес с актуальным хешем и аватары (имя - хеш содержимого) не меняются никогда
+    version = request.args.get('v')
+    fingerprinted = version is not None and version == asset_manifest.version(filename)
+    if fingerprinted or (filename.startswith('avatars/') and AVATAR_FILE_PATTERN.match(filename[len('avatars/'):])):
+        response.cache_control.no_cache = None  # send_file ставит no-cache по умолчанию
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+# Реестр присутствия: подключения воркера в памяти, общая таблица подключений и last_seen пишутся пачками
+app.config['PRESENCE_FLUSH_INTERVAL'] = int(os.environ.get('PRESENCE_FLUSH_INTERVAL', 30))
+presence = PresenceRegistry(flush_interval=app.config['PRESENCE_FLUSH_INTERVAL'])
+
 # Модели базы данных
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -75,11 +200,18 @@ class User(UserMixin, db.Model):
             db.session.add(self.settings)
             db.session.commit()
         return self.settings
+    
+    # Индексы частых запросов (см. migrations.py)
+    __table_args__ = (
+        db.Index('ix_user_online', 'is_online', 'last_seen'),
+        db.Index('ix_user_last_seen', 'last_seen'),
+        db.Index('ix_user_created', 'created_at'),
+    )
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Пусто для сообщений канала
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=True)  # Для каналов
     content = db.Column(db.Text, nullable=False)
     encrypted_content = db.Column(db.Text, nullable=False)  # Зашифрованное содержимое
@@ -90,12 +222,35 @@ class Message(db.Model):
     reply_to_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)  # Ответ на сообщение
     is_deleted = db.Column(db.Boolean, default=False)
     deleted_for_all = db.Column(db.Boolean, default=False)  # Удалено для всех
+    channel_seq = db.Column(db.Integer, nullable=True)  # Номер последнего изменения в канале (для синхронизации)
+    version = db.Column(db.Integer, default=1, nullable=False)  # Растет при каждой правке и удалении
     
     # Отношения
     sender = db.relationship('User', foreign_keys=[sender_id])
     receiver = db.relationship('User', foreign_keys=[receiver_id])
     reply_to = db.relationship('Message', remote_side=[id])
     reactions = db.relationship('MessageReaction', backref='message', cascade='all, delete-orphan')
+    reaction_counts = db.relationship('MessageReactionCount', cascade='all, delete-orphan')
+    attachments = db.relationship('Attachment', cascade='all, delete-orphan')
+    
+    # Индекс для курсорной пагинации истории диалога
+    __table_args__ = (
+        db.Index('ix_message_conversation', 'sender_id', 'receiver_id', 'id'),
+        # Индекс для выборки изменений канала по номеру
+        db.Index('ix_message_channel', 'channel_id', 'id'),
+        db.Index('ix_message_channel_seq', 'channel_id', 'channel_seq'),
+        db.Index('ix_message_receiver', 'receiver_id', 'id'),
+        db.Index('ix_message_timestamp', 'timestamp'),
+    )
+
+# Полнотекстовый индекс создается вместе с таблицей сообщений
+@event.listens_for(Message.__table__, 'after_create')
+def create_message_search_index(target, connection, **kw):
+    ensure_search_index(connection)
+
+@event.listens_for(Message.__table__, 'after_drop')
+def drop_message_search_index(target, connection, **kw):
+    drop_search_index(connection)
 
 class Channel(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -106,6 +261,7 @@ class Channel(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     topic = db.Column(db.String(200), default='')
     member_count = db.Column(db.Integer, default=0)
+    seq = db.Column(db.Integer, default=0, nullable=False)  # Последний выданный номер изменения в канале
     
     # Отношения
     creator = db.relationship('User', foreign_keys=[created_by])
@@ -121,6 +277,11 @@ class ChannelMember(db.Model):
     
     # Отношения
     user = db.relationship('User')
+    
+    __table_args__ = (
+        db.Index('uq_channel_member', 'channel_id', 'user_id', unique=True),
+        db.Index('ix_channel_member_user', 'user_id', 'channel_id'),
+    )
 
 class MessageReaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -131,6 +292,38 @@ class MessageReaction(db.Model):
     
     # Отношения
     user = db.relationship('User')
+    
+    # Одна реакция пользователя на сообщение
+    __table_args__ = (db.Index('uq_message_reaction', 'message_id', 'user_id', unique=True),)
+
+class MessageReactionCount(db.Model):
+    """Число реакций каждого эмодзи на сообщение (обновляется при переключении реакции)"""
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    emoji = db.Column(db.String(10), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (db.Index('uq_message_reaction_count', 'message_id', 'emoji', unique=True),)
+
+class Attachment(db.Model):
+    """Вложение: загрузка по частям, затем файл в хранилище по sha256 (см. attachments.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(32), nullable=False)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)  # Пусто, пока не отправлено
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, default=0, nullable=False)  # Подтвержденное смещение загрузки
+    sha256 = db.Column(db.String(64), nullable=True)  # Заполняется по завершении загрузки
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('uq_attachment_upload', 'upload_id', unique=True),
+        db.Index('ix_attachment_message', 'message_id'),
+        db.Index('ix_attachment_sha256', 'sha256'),
+    )
 
 class UserSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -164,6 +357,12 @@ class Report(db.Model):
     reporter = db.relationship('User', foreign_keys=[reporter_id])
     reported_user = db.relationship('User', foreign_keys=[reported_user_id])
     reviewer = db.relationship('User', foreign_keys=[reviewed_by])
+    
+    __table_args__ = (
+        db.Index('ix_report_status_created', 'status', 'created_at'),
+        db.Index('ix_report_created', 'created_at'),
+        db.Index('ix_report_reporter', 'reporter_id', 'reported_user_id', 'status'),
+    )
 
 class ModerationAction(db.Model):
     """Модель для действий модерации"""
@@ -209,10 +408,202 @@ class UserRating(db.Model):
     # Уникальное ограничение - один пользователь может оценить другого только один раз
     __table_args__ = (db.UniqueConstraint('user_id', 'rater_id', name='unique_user_rating'),)
 
+class PresenceConnection(db.Model):
+    """Подключения пользователя к воркеру: общий статус "в сети" для всех воркеров (см. presence.py)"""
+    worker = db.Column(db.String(128), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)  # Без внешнего ключа: строка живет не дольше пульса
+    connections = db.Column(db.Integer, nullable=False)
+    seen_at = db.Column(db.DateTime, nullable=False)  # Пульс воркера; старые строки истекают
+    
+    __table_args__ = (
+        db.Index('ix_presence_user', 'user_id'),
+        db.Index('ix_presence_seen', 'seen_at'),
+    )
+
+class DailyStat(db.Model):
+    """Суточные счетчики для админ-панели (только завершенные дни)"""
+    day = db.Column(db.Date, primary_key=True)
+    new_users = db.Column(db.Integer, default=0, nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+    reports = db.Column(db.Integer, default=0, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Conversation(db.Model):
+    """Разговор пользователя (диалог или канал): последнее сообщение и состояние прочтения
+    
+    Строки поддерживаются при отправке, поэтому список разговоров и значки
+    непрочитанных читаются по индексу без агрегации по сообщениям.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # dm, channel
+    target_id = db.Column(db.Integer, nullable=False)  # id собеседника или канала
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_activity = db.Column(db.DateTime, nullable=True)
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        # Уникальный индекс одновременно служит для выборки всех счетчиков пользователя
+        db.UniqueConstraint('user_id', 'kind', 'target_id', name='uq_conversation'),
+        # Список разговоров по последней активности
+        db.Index('ix_conversation_recent', 'user_id', 'last_activity', 'id'),
+    )
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+def flush_presence(registry=None):
+    """Записывает пачкой last_seen и подключения воркера, перечитывает подключения других воркеров
+    
+    user.is_online пересчитывается по общей таблице подключений, поэтому
+    воркер не сбрасывает статус пользователя, открытого у другого воркера.
+    """
+    registry = registry or presence
+    rows, connections = registry.drain()
+    worker = registry.worker
+    now = datetime.utcnow()
+    users = User.__table__
+    table = PresenceConnection.__table__
+    with app.app_context():
+        try:
+            if rows:
+                # executemany без проверки числа строк: удаленные пользователи просто пропускаются
+                db.session.execute(
+                    users.update().where(users.c.id == db.bindparam('user_id')).values(last_seen=db.bindparam('seen')),
+                    [{'user_id': row['id'], 'seen': row['last_seen']} for row in rows]
+                )
+            gone = [user_id for user_id, count in connections.items() if not count]
+            if gone:
+                db.session.execute(table.delete().where(table.c.worker == worker, table.c.user_id.in_(gone)))
+            live = [{'worker': worker, 'user_id': user_id, 'connections': count, 'seen_at': now}
+                    for user_id, count in connections.items() if count]
+            if live:
+                statement = dialect_insert(PresenceConnection)
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['worker', 'user_id'], set_={'connections': statement.excluded.connections}
+                ), live)
+            # Пульс воркера; строки остановившихся воркеров истекают
+            db.session.execute(table.update().where(table.c.worker == worker).values(seen_at=now))
+            expired = db.session.execute(
+                table.delete().where(table.c.seen_at < now - timedelta(seconds=registry.flush_interval * EXPIRY_INTERVALS))
+                .returning(table.c.user_id)
+            ).scalars().all()
+            
+            changed = set(connections) | set(expired)
+            if changed:
+                online = db.exists().where(table.c.user_id == users.c.id)
+                db.session.execute(users.update().where(users.c.id.in_(changed)).values(is_online=online))
+            remote = db.session.execute(
+                db.select(table.c.user_id).where(table.c.worker != worker).distinct()
+            ).scalars().all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            registry.restore(rows, connections)
+            print(f'Ошибка записи присутствия: {e}')
+            return
+    registry.set_remote(remote)
+
+def start_presence_flusher():
+    """Запускает фоновую запись присутствия в текущем процессе
+
+    При выходе такого процесса его подключения убираются из общей таблицы.
+    """
+    presence.start_flusher(flush_presence, socketio.start_background_task)
+
+# Кто печатает: события печати уходят только при смене состояния (см. typing_state.py)
+typing_registry = TypingRegistry(
+    ttl=int(os.environ.get('TYPING_TTL', 6)),
+    rate_limit=int(os.environ.get('TYPING_RATE_LIMIT', 20)),
+    rate_window=int(os.environ.get('TYPING_RATE_WINDOW', 10))
+)
+
+# Реестр блокировок: проверка без запросов к базе, истекшие блокировки снимает планировщик
+ban_registry = BanRegistry(refresh_interval=int(os.environ.get('BAN_REFRESH_INTERVAL', 30)))
+app.config['BAN_SWEEP_INTERVAL'] = int(os.environ.get('BAN_SWEEP_INTERVAL', 5))
+
+def reload_ban_registry():
+    ban_registry.load(
+        db.session.query(User.id, User.ban_until, User.ban_reason).filter(User.is_banned == True).all()
+    )
+
+def active_ban(user_id):
+    """(ban_until, причина) действующей блокировки пользователя или None"""
+    # Реестр загружается при первой проверке и подхватывает блокировки других воркеров
+    if ban_registry.needs_reload():
+        reload_ban_registry()
+        ban_registry.start_scheduler(lift_expired_bans, socketio.start_background_task,
+                                     interval=app.config['BAN_SWEEP_INTERVAL'])
+    return ban_registry.get(user_id)
+
+def lift_expired_bans():
+    """Снимает истекшие блокировки одной пачкой и сообщает пользователям; возвращает их id"""
+    with app.app_context():
+        if ban_registry.needs_reload():
+            reload_ban_registry()
+        expired = ban_registry.due()
+        if not expired:
+            return []
+        
+        # Условие на ban_until: блокировку могли продлить в другом воркере
+        now = datetime.utcnow()
+        table = User.__table__
+        try:
+            lifted = db.session.execute(
+                table.update().where(
+                    table.c.id.in_([user_id for user_id, _, _ in expired]),
+                    table.c.is_banned == True,
+                    table.c.ban_until <= now
+                ).values(is_banned=False, ban_reason='', ban_until=None).returning(table.c.id)
+            ).scalars().all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            ban_registry.restore(expired)
+            print(f'Ошибка снятия блокировок: {e}')
+            return []
+        
+        # due() уже убрал их из реестра: не снятые блокировки (продленные в другом
+        # воркере) возвращаются с актуальным сроком из базы
+        remaining = {user_id for user_id, _, _ in expired} - set(lifted)
+        if remaining:
+            ban_registry.restore(db.session.query(User.id, User.ban_until, User.ban_reason).filter(
+                User.id.in_(remaining), User.is_banned == True
+            ).all())
+        
+        for user_id in lifted:
+            socketio.emit('user_unbanned', {
+                'message': 'Срок блокировки истек. Добро пожаловать обратно!'
+            }, room=user_room(user_id))
+        return lifted
+
+# Индекс поиска пользователей (в памяти процесса)
+user_search_index = UserSearchIndex(refresh_interval=int(os.environ.get('USER_INDEX_REFRESH_INTERVAL', 300)))
+
+def sync_user_search_index():
+    """Загружает индекс при первом поиске и подхватывает пользователей, созданных другими воркерами"""
+    if user_search_index.needs_reload():
+        user_search_index.load(db.session.query(User.id, User.username, User.display_name).all())
+        return
+    for user_id, username, display_name in db.session.query(
+        User.id, User.username, User.display_name
+    ).filter(User.id > user_search_index.max_user_id).all():
+        user_search_index.add(user_id, username, display_name)
+
+@app.template_global()
+def user_online(user_id):
+    """Статус "в сети" из реестра присутствия для шаблонов"""
+    return presence.is_online(user_id)
+
+@app.template_global()
+def avatar_url(picture, size=128):
+    """URL миниатюры аватара (см. avatars.py) или None для аватара по умолчанию"""
+    path = avatar_path(picture, size)
+    # Без url_for: URL нужен и в потоке обработки, вне запроса
+    return f'{app.static_url_path}/{path}' if path else None
+
 # Роуты
 @app.route('/')
 def index():
@@ -249,6 +640,7 @@ def register():
         )
         db.session.add(user)
         db.session.commit()
+        user_search_index.add(user.id, user.username, user.display_name)
         
         flash('Регистрация успешна! Теперь войдите в систему.')
         return redirect(url_for('login'))
@@ -335,26 +727,111 @@ def get_connection_info(request):
     
     return info
 
-# Функции шифрования
-def generate_encryption_key():
-    """Генерирует ключ шифрования для сообщений"""
-    return Fernet.generate_key()
-
-def encrypt_message(content, key):
-    """Шифрует сообщение"""
-    f = Fernet(key)
-    return f.encrypt(content.encode()).decode()
-
-def decrypt_message(encrypted_content, key):
-    """Расшифровывает сообщение"""
-    try:
-        f = Fernet(key)
-        return f.decrypt(encrypted_content.encode()).decode()
-    except:
-        return "Сообщение повреждено"
-
-# Генерируем ключ шифрования для приложения
-ENCRYPTION_KEY = generate_encryption_key()
+# Шифрование сообщений: набор ключей загружается один раз на процесс
+# (MESSAGE_ENCRYPTION_KEYS или файл instance/message_keys, см. encryption.py)
+os.makedirs(app.instance_path, exist_ok=True)
+# В режиме хранения "только шифротекст" колонка content остается пустой,
+# а текст расшифровывается при чтении (с LRU-кэшем на процесс)
+app.config['MESSAGE_ENCRYPTION_AT_REST'] = os.environ.get('MESSAGE_ENCRYPTION_AT_REST', '').lower() in ('1', 'true', 'yes')
+app.config['MESSAGE_DECRYPT_CACHE_SIZE'] = int(os.environ.get('MESSAGE_DECRYPT_CACHE_SIZE', 10000))
+message_keys = KeyRing.from_config(
+    os.environ.get('MESSAGE_ENCRYPTION_KEYS'),
+    key_file=os.path.join(app.instance_path, 'message_keys'),
+    cache_size=app.config['MESSAGE_DECRYPT_CACHE_SIZE']
+)
+
+def encrypt_message(content):
+    """Шифрует сообщение основным ключом"""
+    return message_keys.encrypt(content)
+
+def decrypt_message(encrypted_content):
+    """Расшифровывает сообщение любым ключом из набора"""
+    return message_keys.decrypt(encrypted_content)
+
+def stored_content(content):
+    """Значение колонки content для нового или отредактированного сообщения"""
+    return '' if app.config['MESSAGE_ENCRYPTION_AT_REST'] else content
+
+def message_text(content, encrypted_content):
+    """Текст сообщения: открытый, если он хранится, иначе расшифрованный"""
+    return content if content else decrypt_message(encrypted_content)
+
+def message_texts(rows):
+    """Тексты для пачки пар (content, encrypted_content)"""
+    return [message_text(content, encrypted_content) for content, encrypted_content in rows]
+
+def reencrypt_messages(batch_size=500, progress=None):
+    """Перешифровывает основным ключом все сообщения, зашифрованные другими ключами
+
+    Таблица обходится порциями по id, каждая порция - отдельная транзакция,
+    поэтому задачу можно прервать и запустить снова.
+    """
+    table = Message.__table__
+    statement = table.update().where(table.c.id == db.bindparam('message_id')).values(
+        encrypted_content=db.bindparam('ciphertext')
+    )
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.session.query(Message.id, Message.content, Message.encrypted_content).filter(
+            Message.id > last_id
+        ).order_by(Message.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        
+        changes = []
+        for message_id, content, ciphertext in rows:
+            if not message_keys.needs_rotation(ciphertext):
+                continue
+            plaintext = message_keys.decrypt(ciphertext, default=None) if ciphertext else None
+            if plaintext is None:
+                # Ключ утерян (раньше он генерировался при каждом запуске) - берем открытый текст;
+                # в режиме хранения только шифротекста его нет, и сообщение не восстановить
+                plaintext = content or None
+            if plaintext is None:
+                continue
+            changes.append({'message_id': message_id, 'ciphertext': message_keys.encrypt(plaintext)})
+        
+        if changes:
+            db.session.execute(statement, changes)
+        db.session.commit()
+        updated += len(changes)
+        if progress:
+            progress(last_id, updated)
+    return updated
+
+def drop_plaintext_messages(batch_size=500, progress=None):
+    """Переводит историю в хранение только шифротекста
+    
+    Для сообщений с открытым текстом шифротекст пересоздается основным ключом
+    (открытый текст считается истиной), а колонка content очищается.
+    Порции по id, каждая - отдельная транзакция: задачу можно прерывать.
+    """
+    table = Message.__table__
+    statement = table.update().where(table.c.id == db.bindparam('message_id')).values(
+        content='', encrypted_content=db.bindparam('ciphertext')
+    )
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.session.query(Message.id, Message.content).filter(
+            Message.id > last_id, Message.content != ''
+        ).order_by(Message.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        
+        ciphertexts = message_keys.encrypt_many([content for _, content in rows])
+        db.session.execute(statement, [
+            {'message_id': message_id, 'ciphertext': ciphertext}
+            for (message_id, _), ciphertext in zip(rows, ciphertexts)
+        ])
+        db.session.commit()
+        updated += len(rows)
+        if progress:
+            progress(last_id, updated)
+    return updated
 
 # Функция для автоматического резервного копирования
 def auto_backup_data():
@@ -398,27 +875,20 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password_hash, password):
-            # Проверяем, не заблокирован ли пользователь
-            if user.is_banned:
-                if user.ban_until and user.ban_until < datetime.utcnow():
-                    # Блокировка истекла, разблокируем
-                    user.is_banned = False
-                    user.ban_reason = ''
-                    user.ban_until = None
-                    db.session.commit()
+            # Проверяем, не заблокирован ли пользователь (истекшие блокировки не мешают входу)
+            ban = active_ban(user.id)
+            if ban:
+                ban_until, ban_reason = ban
+                if ban_until:
+                    ban_time = ban_until.strftime('%d.%m.%Y %H:%M')
+                    flash(f'Ваш аккаунт заблокирован до {ban_time}. Причина: {ban_reason}')
                 else:
-                    # Пользователь заблокирован
-                    if user.ban_until:
-                        ban_time = user.ban_until.strftime('%d.%m.%Y %H:%M')
-                        flash(f'Ваш аккаунт заблокирован до {ban_time}. Причина: {user.ban_reason}')
-                    else:
-                        flash(f'Ваш аккаунт заблокирован навсегда. Причина: {user.ban_reason}')
-                    return render_template('login.html', device_type=device_type)
+                    flash(f'Ваш аккаунт заблокирован навсегда. Причина: {ban_reason}')
+                return render_template('login.html', device_type=device_type)
             
             login_user(user)
-            user.is_online = True
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
+            start_presence_flusher()
+            presence.touch(user.id)
             return redirect(url_for('chat'))
         else:
             flash('Неверное имя пользователя или пароль!')
@@ -428,9 +898,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
-    current_user.is_online = False
-    current_user.last_seen = datetime.utcnow()
-    db.session.commit()
+    presence.touch(current_user.id)
     logout_user()
     return redirect(url_for('index'))
 
@@ -438,86 +906,39 @@ def logout():
 @login_required
 def chat():
     device_type = detect_device_type(request.headers.get('User-Agent'))
-    users = User.query.filter(User.id != current_user.id).all()
-    return render_template('chat.html', users=users, device_type=device_type)
+    # Боковая панель - первая страница диалогов пользователя, остальные догружаются
+    # через /api/conversations, новых собеседников находит поиск
+    conversations, has_more = get_conversations(current_user.id, kind='dm')
+    return render_template('chat.html', conversations=serialize_conversations(conversations),
+                           next_cursor=encode_conversation_cursor(conversations[-1]) if has_more else None,
+                           device_type=device_type)
 
 @app.route('/search_users')
 @login_required
 def search_users():
     query = request.args.get('q', '').strip()
     if query:
-        # Улучшенный поиск: ищем по username и display_name
-        exact_match = User.query.filter(
-            User.id != current_user.id,
-            (User.username == query) | (User.display_name == query)
-        ).first()
-        
-        starts_with = User.query.filter(
-            User.id != current_user.id,
-            (User.username.ilike(f'{query}%')) | (User.display_name.ilike(f'{query}%'))
-        ).limit(10).all()
-        
-        contains = User.query.filter(
-            User.id != current_user.id,
-            (User.username.ilike(f'%{query}%')) | (User.display_name.ilike(f'%{query}%'))
-        ).limit(10).all()
-        
-        # Объединяем результаты, убирая дубликаты
-        all_users = []
-        seen_ids = set()
-        
-        # Сначала точные совпадения
-        if exact_match and exact_match.id not in seen_ids:
-            all_users.append(exact_match)
-            seen_ids.add(exact_match.id)
-        
-        # Затем начинающиеся с запроса
-        for user in starts_with:
-            if user.id not in seen_ids:
-                all_users.append(user)
-                seen_ids.add(user.id)
-        
-        # Затем содержащие запрос
-        for user in contains:
-            if user.id not in seen_ids:
-                all_users.append(user)
-                seen_ids.add(user.id)
-        
-        users = all_users[:20]  # Максимум 20 результатов
+        # Один проход по индексу: точные совпадения, затем префиксы, затем вхождения
+        sync_user_search_index()
+        matches = user_search_index.search(query, limit=20, exclude=current_user.id)
+        found = {user.id: user for user in User.query.filter(User.id.in_([user_id for user_id, _ in matches])).all()} if matches else {}
+        users = [found[user_id] for user_id, _ in matches if user_id in found]
+        match_types = dict(matches)
     else:
-        # Если запрос пустой, показываем онлайн пользователей
-        online_users = User.query.filter(
-            User.id != current_user.id,
-            User.is_online == True
-        ).limit(10).all()
-        
-        recent_users = User.query.filter(
-            User.id != current_user.id
-        ).order_by(User.last_seen.desc()).limit(10).all()
-        
-        # Объединяем, убирая дубликаты
-        all_users = []
-        seen_ids = set()
-        
-        for user in online_users:
-            if user.id not in seen_ids:
-                all_users.append(user)
-                seen_ids.add(user.id)
-        
-        for user in recent_users:
-            if user.id not in seen_ids and len(all_users) < 20:
-                all_users.append(user)
-                seen_ids.add(user.id)
-        
-        users = all_users
+        # Если запрос пустой, показываем сначала онлайн, затем недавно заходивших
+        online_ids = list(presence.online_ids() - {current_user.id})
+        users = User.query.filter(User.id != current_user.id).order_by(
+            User.id.in_(online_ids).desc(), User.last_seen.desc()
+        ).limit(20).all()
+        match_types = {}
     
     return jsonify([{
         'id': user.id,
         'username': user.username,
         'display_name': user.display_name,
-        'is_online': user.is_online,
+        'is_online': presence.is_online(user.id),
         'last_seen': user.last_seen.strftime('%d.%m.%Y в %H:%M') if user.last_seen else 'Неизвестно',
-        'match_type': 'exact' if query and user.username == query else 'partial'
+        'match_type': match_types.get(user.id, 'partial')
     } for user in users])
 
 @app.route('/profile')
@@ -547,6 +968,7 @@ def edit_profile():
         current_user.display_name = request.form['display_name']
         current_user.bio = request.form['bio']
         db.session.commit()
+        user_search_index.add(current_user.id, current_user.username, current_user.display_name)
         flash('Профиль обновлен!')
         return redirect(url_for('profile'))
     
@@ -648,26 +1070,409 @@ def api_backup():
     else:
         return jsonify({'status': 'error', 'message': 'Ошибка создания резервной копии'}), 500
 
+# Размер страницы истории сообщений
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+
+def get_conversation_page(user_a, user_b, before_id=None, after_id=None, limit=MESSAGES_PAGE_SIZE):
+    """Возвращает страницу диалога (по возрастанию id) и флаг наличия следующих сообщений"""
+    # Каждое направление переписки читается отдельным диапазоном по индексу
+    # (sender_id, receiver_id, id), после чего две упорядоченные выборки сливаются
+    pages = []
+    for sender_id, receiver_id in ((user_a, user_b), (user_b, user_a)):
+        query = Message.query.filter(
+            Message.sender_id == sender_id,
+            Message.receiver_id == receiver_id,
+            Message.is_deleted == False
+        )
+        if after_id is not None:
+            query = query.filter(Message.id > after_id).order_by(Message.id.asc())
+        else:
+            if before_id is not None:
+                query = query.filter(Message.id < before_id)
+            query = query.order_by(Message.id.desc())
+        pages.extend(query.limit(limit + 1).all())
+    
+    # Новые сообщения (after_id) идут вперед, старые (before_id) - назад
+    pages.sort(key=lambda msg: msg.id, reverse=after_id is None)
+    has_more = len(pages) > limit
+    messages = pages[:limit]
+    messages.sort(key=lambda msg: msg.id)
+    return messages, has_more
+
+def serialize_messages(messages):
+    """Сериализует страницу сообщений фиксированным числом запросов"""
+    if not messages:
+        return []
+    
+    message_ids = [msg.id for msg in messages]
+    
+    # Реакции: готовые счетчики всей страницы одним запросом
+    reactions = {}
+    reaction_rows = db.session.query(
+        MessageReactionCount.message_id, MessageReactionCount.emoji, MessageReactionCount.count
+    ).filter(
+        MessageReactionCount.message_id.in_(message_ids)
+    ).order_by(MessageReactionCount.id).all()
+    for message_id, emoji, count in reaction_rows:
+        reactions.setdefault(message_id, []).append({'emoji': emoji, 'count': count})
+    
+    # Вложения всей страницы одним запросом
+    attachments = {}
+    for attachment in Attachment.query.filter(Attachment.message_id.in_(message_ids)).order_by(Attachment.id):
+        attachments.setdefault(attachment.message_id, []).append(attachment_info(attachment))
+    
+    # Цитаты ответов одним запросом
+    reply_ids = {msg.reply_to_id for msg in messages if msg.reply_to_id}
+    replies = {}
+    if reply_ids:
+        replies = {
+            message_id: message_text(content, encrypted_content)
+            for message_id, content, encrypted_content in db.session.query(
+                Message.id, Message.content, Message.encrypted_content
+            ).filter(Message.id.in_(reply_ids)).all()
+        }
+    
+    # Отправители одним запросом
+    sender_ids = {msg.sender_id for msg in messages}
+    senders = {
+        user_id: (username, display_name)
+        for user_id, username, display_name in db.session.query(
+            User.id, User.username, User.display_name
+        ).filter(User.id.in_(sender_ids)).all()
+    }
+    
+    # Тексты расшифровываются только для сообщений страницы
+    texts = message_texts((msg.content, msg.encrypted_content) for msg in messages)
+    
+    result = []
+    for msg, text in zip(messages, texts):
+        username, display_name = senders.get(msg.sender_id, (None, None))
+        reply_content = replies.get(msg.reply_to_id)
+        result.append({
+            'id': msg.id,
+            'sender_id': msg.sender_id,
+            'receiver_id': msg.receiver_id,
+            'channel_id': msg.channel_id,
+            'sender_name': display_name,
+            'sender_username': username,
+            'content': text,
+            'timestamp': msg.timestamp.strftime('%H:%M'),
+            'is_own': msg.sender_id == current_user.id,
+            'is_edited': msg.is_edited,
+            'edited_at': msg.edited_at.strftime('%H:%M') if msg.edited_at else None,
+            'version': msg.version,
+            'reply_to_id': msg.reply_to_id,
+            'reply_to_content': reply_content[:50] + '...' if reply_content is not None else None,
+            'reactions': reactions.get(msg.id, []),
+            'attachments': attachments.get(msg.id, [])
+        })
+    return result
+
 @app.route('/api/messages/<int:user_id>')
 @login_required
 def get_messages(user_id):
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.receiver_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.receiver_id == current_user.id))
-    ).order_by(Message.timestamp).all()
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    if before_id is not None and after_id is not None:
+        return jsonify({'status': 'error', 'message': 'Укажите before_id или after_id, но не оба'}), 400
+    limit = request.args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    
+    messages, has_more = get_conversation_page(
+        current_user.id, user_id, before_id=before_id, after_id=after_id, limit=limit
+    )
     
-    return jsonify([{
-        'id': msg.id,
-        'sender_id': msg.sender_id,
-        'content': msg.content,
-        'timestamp': msg.timestamp.strftime('%H:%M'),
-        'is_own': msg.sender_id == current_user.id,
-        'is_edited': msg.is_edited,
-        'edited_at': msg.edited_at.strftime('%H:%M') if msg.edited_at else None,
-        'reply_to_id': msg.reply_to_id,
-        'reply_to_content': msg.reply_to.content[:50] + '...' if msg.reply_to else None,
-        'reactions': [{'emoji': r.emoji, 'count': len([re for re in msg.reactions if re.emoji == r.emoji])} for r in set(r.emoji for r in msg.reactions)]
-    } for msg in messages])
+    return jsonify({
+        'messages': serialize_messages(messages),
+        'has_more': has_more,
+        'oldest_id': messages[0].id if messages else None,
+        'newest_id': messages[-1].id if messages else None
+    })
+
+# Разговоры и счетчики непрочитанных: хранятся готовыми в Conversation и обновляются
+# при отправке, поэтому значки и список диалогов читаются без COUNT по сообщениям
+CONVERSATION_KEY = ['user_id', 'kind', 'target_id']
+CONVERSATIONS_PAGE_SIZE = 30
+CONVERSATIONS_PAGE_MAX = 100
+
+def dialect_insert(model):
+    """INSERT ... ON CONFLICT для текущей СУБД (у SQLite и PostgreSQL одинаковый синтаксис)"""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+def conversation_insert():
+    return dialect_insert(Conversation)
+
+def update_conversations(message):
+    """Обновляет разговоры участников после отправки сообщения
+    
+    Получатели получают +1 к непрочитанным, отправитель прочитал разговор
+    до своего сообщения. У всех сдвигаются последнее сообщение и время активности.
+    """
+    table = Conversation.__table__
+    last = {'last_message_id': message.id, 'last_activity': message.timestamp}
+    counter = dict(last, unread_count=table.c.unread_count + 1)
+    if message.channel_id:
+        kind, target_id = 'channel', message.channel_id
+        # Все участники канала, кроме отправителя, одним INSERT ... SELECT
+        recipients = db.select(
+            ChannelMember.user_id, db.literal(kind), db.literal(target_id),
+            db.literal(message.id), db.literal(message.timestamp), db.literal(0), db.literal(1)
+        ).where(ChannelMember.channel_id == target_id, ChannelMember.user_id != message.sender_id)
+        statement = conversation_insert().from_select(
+            CONVERSATION_KEY + ['last_message_id', 'last_activity', 'last_read_message_id', 'unread_count'],
+            recipients
+        )
+        db.session.execute(statement.on_conflict_do_update(index_elements=CONVERSATION_KEY, set_=counter))
+    else:
+        kind, target_id = 'dm', message.receiver_id
+        if message.receiver_id != message.sender_id:
+            statement = conversation_insert().values(
+                user_id=message.receiver_id, kind=kind, target_id=message.sender_id,
+                last_read_message_id=0, unread_count=1, **last
+            )
+            db.session.execute(statement.on_conflict_do_update(index_elements=CONVERSATION_KEY, set_=counter))
+    
+    statement = conversation_insert().values(
+        user_id=message.sender_id, kind=kind, target_id=target_id,
+        last_read_message_id=message.id, unread_count=0, **last
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=CONVERSATION_KEY,
+        set_=dict(last, last_read_message_id=message.id, unread_count=0)
+    ))
+
+def unread_messages_filter(user_id, kind, target_id, after_id):
+    """Условие для непрочитанных сообщений разговора после after_id (диапазон по индексу)"""
+    if kind == 'channel':
+        return db.and_(Message.channel_id == target_id, Message.id > after_id,
+                       Message.sender_id != user_id, Message.is_deleted == False)
+    return db.and_(Message.sender_id == target_id, Message.receiver_id == user_id,
+                   Message.id > after_id, Message.is_deleted == False)
+
+def conversation_messages_filter(user_id, kind, target_id):
+    """Условие для всех сообщений разговора пользователя (в обе стороны для диалога)"""
+    if kind == 'channel':
+        return Message.channel_id == target_id
+    return db.or_(db.and_(Message.sender_id == target_id, Message.receiver_id == user_id),
+                  db.and_(Message.sender_id == user_id, Message.receiver_id == target_id))
+
+def mark_read(user_id, kind, target_id, message_id=None):
+    """Сдвигает отметку прочтения (по умолчанию - до последнего сообщения) и пересчитывает счетчик
+    
+    Пересчитываются только сообщения после отметки, поэтому стоимость
+    пропорциональна числу оставшихся непрочитанных, а не длине истории.
+    """
+    state = Conversation.query.filter_by(user_id=user_id, kind=kind, target_id=target_id).first()
+    last_read = state.last_read_message_id if state else 0
+    if message_id is None:
+        message_id = db.session.query(db.func.max(Message.id)).filter(
+            unread_messages_filter(user_id, kind, target_id, last_read)
+        ).scalar() or last_read
+    else:
+        # Отметка не уходит дальше последнего сообщения разговора, иначе новые
+        # сообщения никогда не станут непрочитанными; чужие id не учитываются
+        conversation = conversation_messages_filter(user_id, kind, target_id)
+        newest = db.session.query(db.func.max(Message.id)).filter(conversation).scalar() or 0
+        if message_id >= newest:
+            message_id = newest
+        elif message_id <= 0 or not db.session.query(Message.id).filter(Message.id == message_id, conversation).first():
+            message_id = last_read
+    last_read = max(last_read, message_id)
+    
+    unread = db.select(db.func.count(Message.id)).where(
+        unread_messages_filter(user_id, kind, target_id, last_read)
+    ).scalar_subquery()
+    statement = conversation_insert().values(
+        user_id=user_id, kind=kind, target_id=target_id,
+        last_read_message_id=last_read, unread_count=unread
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=CONVERSATION_KEY,
+        set_={'last_read_message_id': statement.excluded.last_read_message_id,
+              'unread_count': statement.excluded.unread_count}
+    ))
+    db.session.commit()
+    
+    return db.session.query(Conversation.last_read_message_id, Conversation.unread_count).filter_by(
+        user_id=user_id, kind=kind, target_id=target_id
+    ).one()
+
+@app.route('/api/unread')
+@login_required
+def get_unread_counts():
+    """Все значки непрочитанных пользователя одним запросом по индексу"""
+    rows = db.session.query(Conversation.kind, Conversation.target_id, Conversation.unread_count).filter(
+        Conversation.user_id == current_user.id, Conversation.unread_count > 0
+    ).all()
+    
+    dialogs = {str(target_id): count for kind, target_id, count in rows if kind == 'dm'}
+    channels = {str(target_id): count for kind, target_id, count in rows if kind == 'channel'}
+    return jsonify({'dialogs': dialogs, 'channels': channels, 'total': sum(count for _, _, count in rows)})
+
+@app.route('/api/read', methods=['POST'])
+@login_required
+def mark_conversation_read():
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('channel_id'):
+            kind, target_id = 'channel', int(data['channel_id'])
+        elif data.get('user_id'):
+            kind, target_id = 'dm', int(data['user_id'])
+        else:
+            return jsonify({'status': 'error', 'message': 'Не указан диалог'}), 400
+        message_id = data.get('message_id')
+        message_id = int(message_id) if message_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Неверный идентификатор'}), 400
+    
+    if kind == 'channel' and not can_access_channel(target_id, current_user.id):
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    if kind == 'dm' and not db.session.get(User, target_id):
+        return jsonify({'status': 'error', 'message': 'Пользователь не найден'}), 404
+    
+    last_read, unread = mark_read(current_user.id, kind, target_id, message_id)
+    
+    # Остальные вкладки пользователя обновляют значок
+    update = {'kind': kind, 'target_id': target_id, 'last_read_message_id': last_read, 'unread_count': unread}
+    socketio.emit('read_state', update, room=user_room(current_user.id))
+    return jsonify({'status': 'success', **update})
+
+def get_conversations(user_id, kind=None, cursor=None, limit=CONVERSATIONS_PAGE_SIZE):
+    """Страница разговоров по убыванию активности (курсор - (last_activity, id) последней строки)"""
+    query = Conversation.query.filter(
+        Conversation.user_id == user_id,
+        Conversation.last_activity.isnot(None)
+    )
+    if kind:
+        query = query.filter(Conversation.kind == kind)
+    if cursor:
+        query = query.filter(db.tuple_(Conversation.last_activity, Conversation.id) < cursor)
+    rows = query.order_by(Conversation.last_activity.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+def encode_conversation_cursor(conversation):
+    return '%s_%d' % (conversation.last_activity.isoformat(), conversation.id)
+
+def decode_conversation_cursor(value):
+    activity, _, conversation_id = value.rpartition('_')
+    return datetime.fromisoformat(activity), int(conversation_id)
+
+def serialize_conversations(conversations):
+    """Сериализует страницу разговоров фиксированным числом запросов"""
+    if not conversations:
+        return []
+    
+    peer_ids = {c.target_id for c in conversations if c.kind == 'dm'}
+    channel_ids = {c.target_id for c in conversations if c.kind == 'channel'}
+    message_ids = {c.last_message_id for c in conversations if c.last_message_id}
+    
+    peers = {user.id: user for user in User.query.filter(User.id.in_(peer_ids)).all()} if peer_ids else {}
+    channels = dict(db.session.query(Channel.id, Channel.name).filter(Channel.id.in_(channel_ids)).all()) if channel_ids else {}
+    messages = {
+        row.id: row for row in db.session.query(
+            Message.id, Message.sender_id, Message.content, Message.encrypted_content, Message.is_deleted
+        ).filter(Message.id.in_(message_ids)).all()
+    } if message_ids else {}
+    
+    result = []
+    for conversation in conversations:
+        item = {
+            'kind': conversation.kind,
+            'id': conversation.target_id,
+            'last_activity': conversation.last_activity.isoformat(),
+            'unread_count': conversation.unread_count,
+            'last_message': None
+        }
+        if conversation.kind == 'dm':
+            peer = peers.get(conversation.target_id)
+            if peer is None:
+                continue
+            item.update({
+                'name': peer.display_name,
+                'username': peer.username,
+                'is_online': presence.is_online(peer.id)
+            })
+        else:
+            item['name'] = channels.get(conversation.target_id)
+        
+        message = messages.get(conversation.last_message_id)
+        if message is not None:
+            text = 'Сообщение удалено' if message.is_deleted else message_text(message.content, message.encrypted_content)
+            item['last_message'] = {
+                'id': message.id,
+                'sender_id': message.sender_id,
+                'content': text[:50] + '...' if len(text) > 50 else text,
+                'timestamp': conversation.last_activity.strftime('%H:%M')
+            }
+        result.append(item)
+    return result
+
+@app.route('/api/conversations')
+@login_required
+def api_conversations():
+    """Список разговоров пользователя по последней активности с курсорной пагинацией"""
+    kind = request.args.get('kind')
+    if kind not in (None, 'dm', 'channel'):
+        return jsonify({'status': 'error', 'message': 'Неверный тип разговора'}), 400
+    limit = max(1, min(request.args.get('limit', CONVERSATIONS_PAGE_SIZE, type=int), CONVERSATIONS_PAGE_MAX))
+    try:
+        cursor = decode_conversation_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Неверный курсор'}), 400
+    
+    conversations, has_more = get_conversations(current_user.id, kind=kind, cursor=cursor, limit=limit)
+    return jsonify({
+        'conversations': serialize_conversations(conversations),
+        'has_more': has_more,
+        'next_cursor': encode_conversation_cursor(conversations[-1]) if has_more else None
+    })
+
+# Поиск по сообщениям
+SEARCH_PAGE_SIZE = 20
+search_index_checked = False
+
+@app.route('/api/search/messages')
+@login_required
+def api_search_messages():
+    global search_index_checked
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 50))
+    
+    if not query:
+        return jsonify({'results': [], 'page': page, 'per_page': per_page, 'has_more': False, 'next_cursor': None})
+    
+    next_cursor = None
+    if app.config['MESSAGE_ENCRYPTION_AT_REST']:
+        # Открытый текст не хранится - ищем по расшифрованным последним сообщениям.
+        # Просмотр ограничен SCAN_LIMIT сообщениями; next_cursor продолжает его с более старых
+        hits, next_cursor = search_encrypted(db.session, current_user.id, query, message_texts,
+                                             limit=per_page, offset=(page - 1) * per_page,
+                                             before_id=request.args.get('cursor', type=int))
+        has_more = next_cursor is not None
+    else:
+        # Базы, созданные до появления поиска, получают индекс при первом запросе
+        if not search_index_checked:
+            with db.engine.begin() as connection:
+                ensure_search_index(connection)
+            search_index_checked = True
+        
+        hits = search_messages(db.session, current_user.id, query,
+                               limit=per_page + 1, offset=(page - 1) * per_page)
+        has_more = len(hits) > per_page
+        hits = hits[:per_page]
+    
+    messages = {msg.id: msg for msg in Message.query.filter(Message.id.in_([hit[0] for hit in hits])).all()} if hits else {}
+    ordered = [messages[message_id] for message_id, _, _ in hits if message_id in messages]
+    results = serialize_messages(ordered)
+    snippets = {message_id: snippet for message_id, snippet, _ in hits}
+    for result in results:
+        result['snippet'] = snippets[result['id']]
+    
+    return jsonify({'results': results, 'page': page, 'per_page': per_page, 'has_more': has_more,
+                    'next_cursor': next_cursor})
 
 # Новые роуты для каналов
 @app.route('/channels')
@@ -740,6 +1545,48 @@ def join_channel(channel_id):
     
     return jsonify({'status': 'success'})
 
+# Сколько изменений канала отдается за один запрос синхронизации
+CHANNEL_SYNC_MAX = 500
+
+def next_channel_seq(channel_id):
+    """Выдает следующий номер изменения канала в текущей транзакции
+    
+    UPDATE блокирует строку канала до коммита, поэтому изменения одного
+    канала становятся видны строго в порядке номеров.
+    """
+    return db.session.execute(
+        db.update(Channel).where(Channel.id == channel_id).values(seq=Channel.seq + 1).returning(Channel.seq)
+    ).scalar_one()
+
+def mark_channel_change(message):
+    """Отмечает изменение сообщения канала (правка, удаление, реакция) для синхронизации"""
+    if message.channel_id:
+        message.channel_seq = next_channel_seq(message.channel_id)
+
+def get_channel_seq(channel_id):
+    return db.session.query(Channel.seq).filter(Channel.id == channel_id).scalar() or 0
+
+def get_channel_changes(channel_id, since):
+    """Изменения канала после номера since: O(изменений), а не O(истории)"""
+    # Номер читается до выборки: все, что изменится позже, попадет в следующую синхронизацию
+    seq = get_channel_seq(channel_id)
+    changed = Message.query.filter(
+        Message.channel_id == channel_id,
+        Message.channel_seq > since
+    ).order_by(Message.channel_seq).limit(CHANNEL_SYNC_MAX + 1).all()
+    
+    has_more = len(changed) > CHANNEL_SYNC_MAX
+    changed = changed[:CHANNEL_SYNC_MAX]
+    if changed:
+        seq = changed[-1].channel_seq if has_more else max(seq, changed[-1].channel_seq)
+    
+    return {
+        'messages': serialize_messages([msg for msg in changed if not msg.is_deleted]),
+        'deleted': [msg.id for msg in changed if msg.is_deleted],
+        'seq': max(seq, since),
+        'has_more': has_more
+    }
+
 @app.route('/api/channel/<int:channel_id>/messages')
 @login_required
 def get_channel_messages(channel_id):
@@ -747,22 +1594,100 @@ def get_channel_messages(channel_id):
     if not member:
         return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
     
-    messages = Message.query.filter_by(channel_id=channel_id).order_by(Message.timestamp).all()
-    return jsonify([{
-        'id': msg.id,
-        'sender_id': msg.sender_id,
-        'sender_name': msg.sender.display_name,
-        'content': msg.content,
-        'timestamp': msg.timestamp.strftime('%H:%M'),
-        'is_own': msg.sender_id == current_user.id,
-        'is_edited': msg.is_edited,
-        'edited_at': msg.edited_at.strftime('%H:%M') if msg.edited_at else None,
-        'reply_to_id': msg.reply_to_id,
-        'reply_to_content': msg.reply_to.content[:50] + 'chat.html' if msg.reply_to else None,
-        'reactions': [{'emoji': r.emoji, 'count': len([re for re in msg.reactions if re.emoji == r.emoji])} for r in set(r.emoji for r in msg.reactions)]
-    } for msg in messages])
+    # Клиент с курсором получает только изменения
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return jsonify(get_channel_changes(channel_id, since))
+    
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    
+    seq = get_channel_seq(channel_id)
+    query = Message.query.filter(Message.channel_id == channel_id, Message.is_deleted == False)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit][::-1]
+    
+    return jsonify({
+        'messages': serialize_messages(messages),
+        'deleted': [],
+        'seq': seq,
+        'has_more': has_more,
+        'oldest_id': messages[0].id if messages else None
+    })
 
 # Роуты для реакций
+REACTION_KEY = ['message_id', 'user_id']
+
+def can_access_message(message, user_id):
+    """Участник диалога или канала, где находится сообщение"""
+    if message.channel_id:
+        return can_access_channel(message.channel_id, user_id)
+    return user_id in (message.sender_id, message.receiver_id)
+
+def toggle_reaction(message_id, user_id, emoji):
+    """Переключает реакцию пользователя; возвращает его текущую реакцию (None - снята)
+    
+    DELETE ... RETURNING забирает прежнюю реакцию, INSERT ... ON CONFLICT DO NOTHING
+    ставит новую, и счетчики меняются ровно на их разницу. Если между ними
+    параллельный запрос того же пользователя успел поставить свою реакцию,
+    шаг повторяется.
+    """
+    table = MessageReaction.__table__
+    deltas = {}
+    for _ in range(3):
+        removed = db.session.execute(
+            table.delete().where(table.c.message_id == message_id, table.c.user_id == user_id)
+            .returning(table.c.emoji)
+        ).scalars().all()
+        for old in removed:
+            deltas[old] = deltas.get(old, 0) - 1
+        if emoji in removed:
+            current = None
+            break
+        
+        inserted = db.session.execute(
+            dialect_insert(MessageReaction).values(
+                message_id=message_id, user_id=user_id, emoji=emoji, created_at=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=REACTION_KEY).returning(table.c.id)
+        ).first()
+        if inserted:
+            deltas[emoji] = deltas.get(emoji, 0) + 1
+            current = emoji
+            break
+    else:
+        raise RuntimeError('Не удалось переключить реакцию')
+    
+    update_reaction_counts(message_id, deltas)
+    return current
+
+def update_reaction_counts(message_id, deltas):
+    """Применяет изменения {эмодзи: +-n} к счетчикам реакций сообщения"""
+    table = MessageReactionCount.__table__
+    for emoji, delta in deltas.items():
+        if delta:
+            db.session.execute(
+                dialect_insert(MessageReactionCount).values(message_id=message_id, emoji=emoji, count=delta)
+                .on_conflict_do_update(index_elements=['message_id', 'emoji'], set_={'count': table.c.count + delta})
+            )
+    db.session.execute(table.delete().where(table.c.message_id == message_id, table.c.count <= 0))
+
+def get_reaction_counts(message_id):
+    return [
+        {'emoji': emoji, 'count': count}
+        for emoji, count in db.session.query(MessageReactionCount.emoji, MessageReactionCount.count)
+        .filter(MessageReactionCount.message_id == message_id).order_by(MessageReactionCount.id)
+    ]
+
+def message_rooms(message):
+    """Комнаты Socket.IO участников диалога или канала сообщения"""
+    if message.channel_id:
+        return [channel_room(message.channel_id)]
+    return list(dict.fromkeys([user_room(message.sender_id), user_room(message.receiver_id)]))
+
 @app.route('/api/message/<int:message_id>/react', methods=['POST'])
 @login_required
 def react_to_message(message_id):
@@ -772,32 +1697,43 @@ def react_to_message(message_id):
     if not emoji:
         return jsonify({'status': 'error', 'message': 'Эмодзи не указан'}), 400
     
-    # Убираем существующую реакцию пользователя
-    existing_reaction = MessageReaction.query.filter_by(
-        message_id=message_id, 
-        user_id=current_user.id
-    ).first()
-    
-    if existing_reaction:
-        if existing_reaction.emoji == emoji:
-            # Убираем реакцию
-            db.session.delete(existing_reaction)
-        else:
-            # Меняем реакцию
-            existing_reaction.emoji = emoji
-    else:
-        # Добавляем новую реакцию
-        reaction = MessageReaction(
-            message_id=message_id,
-            user_id=current_user.id,
-            emoji=emoji
-        )
-        db.session.add(reaction)
+    message = db.session.get(Message, message_id)
+    if not message or not can_access_message(message, current_user.id):
+        return jsonify({'status': 'error', 'message': 'Сообщение не найдено'}), 404
     
+    current = toggle_reaction(message_id, current_user.id, emoji)
+    mark_channel_change(message)
     db.session.commit()
-    return jsonify({'status': 'success'})
+    
+    # Клиенты обновляют счетчики на месте, без перезагрузки истории
+    update = {
+        'message_id': message_id,
+        'channel_id': message.channel_id,
+        'channel_seq': message.channel_seq,
+        'user_id': current_user.id,
+        'emoji': current,
+        'reactions': get_reaction_counts(message_id)
+    }
+    for room in message_rooms(message):
+        socketio.emit('reaction_update', update, room=room)
+    
+    return jsonify({'status': 'success', 'emoji': current, 'reactions': update['reactions']})
 
 # Роуты для редактирования и удаления сообщений
+def next_message_version(message):
+    """Увеличивает версию сообщения; клиенты игнорируют события со старой версией"""
+    message.version = db.session.execute(
+        db.update(Message).where(Message.id == message.id).values(version=Message.version + 1)
+        .returning(Message.version)
+    ).scalar_one()
+
+def emit_message_change(event_name, message, data):
+    """Отправляет изменение сообщения в комнаты диалога или канала, чтобы клиенты обновили его на месте"""
+    data = dict(data, message_id=message.id, channel_id=message.channel_id,
+                channel_seq=message.channel_seq, version=message.version)
+    for room in message_rooms(message):
+        socketio.emit(event_name, data, room=room)
+
 @app.route('/api/message/<int:message_id>/edit', methods=['PUT'])
 @login_required
 def edit_message(message_id):
@@ -812,31 +1748,44 @@ def edit_message(message_id):
     if not new_content:
         return jsonify({'status': 'error', 'message': 'Содержимое не может быть пустым'}), 400
     
-    message.content = new_content
+    message.content = stored_content(new_content)
+    message.encrypted_content = encrypt_message(new_content)
     message.is_edited = True
     message.edited_at = datetime.utcnow()
+    next_message_version(message)
+    mark_channel_change(message)
     db.session.commit()
     
-    return jsonify({'status': 'success', 'content': new_content})
+    emit_message_change('message_edited', message, {
+        'content': new_content,
+        'is_edited': True,
+        'edited_at': message.edited_at.strftime('%H:%M')
+    })
+    return jsonify({'status': 'success', 'content': new_content, 'version': message.version})
 
 @app.route('/api/message/<int:message_id>/delete', methods=['DELETE'])
 @login_required
 def delete_message(message_id):
     message = Message.query.get_or_404(message_id)
-    data = request.get_json()
+    if not current_user.is_admin and not can_access_message(message, current_user.id):
+        return jsonify({'status': 'error', 'message': 'Сообщение не найдено'}), 404
+    data = request.get_json() or {}
     delete_for_all = data.get('delete_for_all', False)
     
-    if message.sender_id != current_user.id and not delete_for_all:
+    # Удаление в любом режиме видно всем участникам - только автору или администратору
+    if message.sender_id != current_user.id and not current_user.is_admin:
         return jsonify({'status': 'error', 'message': 'Вы можете удалять только свои сообщения'}), 403
     
-    if delete_for_all and message.sender_id == current_user.id:
-        message.is_deleted = True
+    message.is_deleted = True
+    if delete_for_all:
         message.deleted_for_all = True
-    else:
-        message.is_deleted = True
     
+    next_message_version(message)
+    mark_channel_change(message)
     db.session.commit()
-    return jsonify({'status': 'success'})
+    
+    emit_message_change('message_deleted', message, {'deleted_for_all': bool(message.deleted_for_all)})
+    return jsonify({'status': 'success', 'version': message.version})
 
 # Роуты для статусов пользователя
 @app.route('/api/user/status', methods=['PUT'])
@@ -862,6 +1811,49 @@ def update_user_status():
     
     return jsonify({'status': 'success'})
 
+# Аватары: проверка, миниатюры и хранение по содержимому (см. avatars.py)
+avatar_store = AvatarStore(
+    os.path.join(app.static_folder, 'avatars'),
+    workers=int(os.environ.get('AVATAR_WORKERS', 2)),
+    min_age=int(os.environ.get('AVATAR_GC_MIN_AGE', 600))
+)
+
+def avatar_urls(picture):
+    return {size: avatar_url(picture, size) for size in AVATAR_SIZES}
+
+def set_avatar(user_id, key):
+    """Ставит аватар в профиль, освобождает прежний и сообщает пользователю"""
+    user = db.session.get(User, user_id)
+    previous = user.profile_picture
+    user.profile_picture = key
+    db.session.commit()
+    
+    if previous != key and not User.query.filter_by(profile_picture=previous).first():
+        avatar_store.release(previous)
+    
+    socketio.emit('avatar_updated', {
+        'user_id': user_id,
+        'profile_picture': key,
+        'avatar_urls': avatar_urls(key)
+    }, room=user_room(user_id))
+
+def finish_avatar(user_id, key, future):
+    """Запись результата обработки в профиль и событие пользователю
+
+    Идет фоновой задачей Socket.IO (под gevent - гринлетом), а не в потоке
+    пула: сессия базы и emit не рассчитаны на настоящие потоки gevent.
+    """
+    with app.app_context():
+        try:
+            future.result()
+            set_avatar(user_id, key)
+        except AvatarError as e:
+            socketio.emit('avatar_failed', {'message': str(e)}, room=user_room(user_id))
+        except Exception as e:
+            db.session.rollback()
+            print(f'Ошибка обработки аватара пользователя {user_id}: {e}')
+            socketio.emit('avatar_failed', {'message': 'Не удалось обработать аватар'}, room=user_room(user_id))
+
 # Роут для загрузки аватара
 @app.route('/api/user/avatar', methods=['POST'])
 @login_required
@@ -873,30 +1865,223 @@ def upload_avatar():
     if file.filename == '':
         return jsonify({'status': 'error', 'message': 'Файл не выбран'}), 400
     
-    if file:
-        # Простая проверка типа файла
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
-        if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
-            return jsonify({'status': 'error', 'message': 'Неподдерживаемый тип файла'}), 400
-        
-        # Генерируем уникальное имя файла
-        filename = f"avatar_{current_user.id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}"
-        
-        # Сохраняем файл
-        upload_folder = os.path.join(app.static_folder, 'avatars')
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
-        
-        # Обновляем профиль пользователя
-        current_user.profile_picture = filename
-        db.session.commit()
-        
-        return jsonify({'status': 'success', 'filename': filename})
+    data = file.read(app.config['AVATAR_MAX_BYTES'] + 1)
+    if len(data) > app.config['AVATAR_MAX_BYTES']:
+        return jsonify({'status': 'error', 'message': 'Файл слишком большой'}), 413
+    
+    # Тип определяется по содержимому файла, а не по расширению
+    if sniff_image_type(data) is None:
+        return jsonify({'status': 'error', 'message': 'Неподдерживаемый тип файла'}), 400
+    
+    key = avatar_key(data)
+    if avatar_store.exists(key):
+        # Такой файл уже загружали: миниатюры готовы
+        set_avatar(current_user.id, key)
+        return jsonify({'status': 'success', 'filename': key, 'avatar_urls': avatar_urls(key)})
+    
+    # Миниатюры строятся вне потока запроса; результат придет событием avatar_updated
+    user_id = current_user.id
+    future = avatar_store.submit(avatar_store.process, data, key)
+    future.add_done_callback(lambda done: socketio.start_background_task(finish_avatar, user_id, key, done))
+    return jsonify({'status': 'processing', 'filename': key}), 202
+
+# Вложения: загрузка частями с продолжением и отдача с поддержкой Range (см. attachments.py)
+attachment_store = AttachmentStore(app.config['ATTACHMENT_FOLDER'], min_age=app.config['ATTACHMENT_UPLOAD_TTL'])
+
+def attachment_info(attachment):
+    """Поля вложения для клиента"""
+    # Без url_for: вызывается и в потоке групповой записи, вне запроса
+    return {
+        'id': attachment.upload_id,
+        'filename': attachment.filename,
+        'size': attachment.size,
+        'content_type': attachment.content_type,
+        'url': f'/attachments/{attachment.upload_id}/{quote(attachment.filename)}'
+    }
+
+def attach_uploads(message, upload_ids):
+    """Привязывает завершенные загрузки отправителя к сообщению; возвращает их поля"""
+    if not upload_ids:
+        return []
+    table = Attachment.__table__
+    db.session.execute(
+        table.update().where(
+            table.c.upload_id.in_(upload_ids),
+            table.c.uploader_id == message.sender_id,
+            table.c.message_id.is_(None),
+            table.c.completed_at.isnot(None)
+        ).values(message_id=message.id)
+    )
+    return [attachment_info(attachment) for attachment in
+            Attachment.query.filter_by(message_id=message.id).order_by(Attachment.id)]
+
+def pending_uploads_ready(upload_ids, user_id):
+    """True, если все загрузки завершены, принадлежат пользователю и еще не отправлены"""
+    return db.session.query(Attachment.id).filter(
+        Attachment.upload_id.in_(upload_ids),
+        Attachment.uploader_id == user_id,
+        Attachment.message_id.is_(None),
+        Attachment.completed_at.isnot(None)
+    ).count() == len(set(upload_ids))
+
+def upload_status(attachment):
+    response = jsonify({
+        'upload_id': attachment.upload_id,
+        'offset': attachment.received,
+        'size': attachment.size,
+        'complete': attachment.completed_at is not None,
+        'chunk_size': app.config['ATTACHMENT_CHUNK_SIZE']
+    })
+    response.headers['Upload-Offset'] = str(attachment.received)
+    response.headers['Upload-Length'] = str(attachment.size)
+    return response
+
+@app.route('/api/attachments', methods=['POST'])
+@login_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = safe_filename(data.get('filename', ''))
+    size = data.get('size')
+    
+    if not filename or '.' not in filename or filename.rsplit('.', 1)[1].lower() not in app.config['ATTACHMENT_EXTENSIONS']:
+        return jsonify({'status': 'error', 'message': 'Неподдерживаемый тип файла'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'status': 'error', 'message': 'Не указан размер файла'}), 400
+    if size > app.config['ATTACHMENT_MAX_BYTES']:
+        return jsonify({'status': 'error', 'message': 'Файл слишком большой'}), 413
+    
+    attachment = Attachment(
+        upload_id=uuid.uuid4().hex,
+        uploader_id=current_user.id,
+        filename=filename,
+        content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        size=size
+    )
+    attachment_store.create(attachment.upload_id)
+    db.session.add(attachment)
+    db.session.commit()
     
-    return jsonify({'status': 'error', 'message': 'Ошибка загрузки файла'}), 500
+    response = upload_status(attachment)
+    response.status_code = 201
+    return response
+
+def own_upload_or_404(upload_id):
+    attachment = Attachment.query.filter_by(upload_id=upload_id).first()
+    if not attachment or attachment.uploader_id != current_user.id:
+        abort(404)
+    return attachment
+
+@app.route('/api/attachments/<upload_id>', methods=['GET'])
+@login_required
+def get_upload(upload_id):
+    """Подтвержденное смещение: с него клиент продолжает прерванную загрузку"""
+    return upload_status(own_upload_or_404(upload_id))
+
+@app.route('/api/attachments/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Принимает часть файла (тело - байты) со смещения из заголовка Upload-Offset"""
+    attachment = own_upload_or_404(upload_id)
+    offset = request.headers.get('Upload-Offset', type=int)
+    
+    if attachment.completed_at is not None or offset != attachment.received:
+        # Клиент должен продолжить с подтвержденного смещения
+        response = upload_status(attachment)
+        response.status_code = 409
+        return response
+    
+    length = request.content_length
+    if length is None:
+        return jsonify({'status': 'error', 'message': 'Не указан Content-Length'}), 411
+    if length > attachment.size - offset:
+        return jsonify({'status': 'error', 'message': 'Часть выходит за размер файла'}), 413
+    
+    updated = 0
+    with attachment_store.writing(upload_id) as claimed:
+        # Смещение перечитывается под захватом: параллельный запрос мог успеть его сдвинуть
+        db.session.refresh(attachment)
+        if claimed and attachment.completed_at is None and offset == attachment.received:
+            # Тело читается потоком и пишется на диск блоками, целиком в памяти не держится
+            received = attachment_store.append(upload_id, offset, request.stream, length)
+            
+            table = Attachment.__table__
+            values = {'received': received}
+            if received == attachment.size:
+                values['sha256'] = attachment_store.finish(upload_id, received)
+                values['completed_at'] = datetime.utcnow()
+            updated = db.session.execute(
+                table.update().where(table.c.id == attachment.id, table.c.received == offset).values(**values)
+            ).rowcount
+            db.session.commit()
+            db.session.refresh(attachment)
+    
+    # Часть уже пишет другой запрос или смещение устарело: клиент продолжит с подтвержденного
+    response = upload_status(attachment)
+    if not updated:
+        response.status_code = 409
+    return response
+
+@app.route('/attachments/<upload_id>/<path:filename>')
+@login_required
+def download_attachment(upload_id, filename):
+    """Отдает вложение с поддержкой Range и условных запросов"""
+    attachment = Attachment.query.filter_by(upload_id=upload_id).first()
+    if not attachment or attachment.completed_at is None:
+        abort(404)
+    if attachment.uploader_id != current_user.id:
+        message = db.session.get(Message, attachment.message_id) if attachment.message_id else None
+        if not message or not can_access_message(message, current_user.id):
+            abort(404)
+    
+    # Изображения показываем в чате, остальное - только скачивание
+    inline = attachment.content_type in ('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+    
+    if app.config['ATTACHMENT_ACCEL_REDIRECT']:
+        # Права проверены; файл и диапазоны отдает nginx
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = app.config['ATTACHMENT_ACCEL_REDIRECT'].rstrip('/') + '/' + \
+            attachment_store.relative_object_path(attachment.sha256)
+        response.headers['Content-Type'] = attachment.content_type
+        response.headers['Content-Disposition'] = (
+            f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(attachment.filename)}"
+        )
+    else:
+        # send_file отдает файл через wsgi.file_wrapper (в gunicorn - sendfile), Range - conditional=True
+        response = send_file(
+            attachment_store.object_path(attachment.sha256),
+            mimetype=attachment.content_type,
+            as_attachment=not inline,
+            download_name=attachment.filename,
+            conditional=True,
+            etag=attachment.sha256,
+            max_age=86400
+        )
+    # Содержимое по upload_id не меняется, но доступно только участникам
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/api/admin/attachments/gc', methods=['POST'])
+@login_required
+def admin_collect_attachments():
+    """Удаляет брошенные загрузки и файлы, на которые не ссылается ни одно вложение"""
+    if not current_user.is_admin:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    
+    # Незавершенные и неотправленные загрузки старше ATTACHMENT_UPLOAD_TTL
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['ATTACHMENT_UPLOAD_TTL'])
+    abandoned = Attachment.query.filter(Attachment.message_id.is_(None), Attachment.created_at < cutoff).all()
+    for attachment in abandoned:
+        attachment_store.discard(attachment.upload_id)
+        db.session.delete(attachment)
+    db.session.commit()
+    
+    referenced = [sha256 for (sha256,) in db.session.query(Attachment.sha256).filter(Attachment.sha256.isnot(None)).distinct()]
+    return jsonify({
+        'status': 'success',
+        'uploads': len(abandoned),
+        'removed': attachment_store.collect_garbage(referenced)
+    })
 
 # Роут для обновления цветового акцента
 @app.route('/api/user/color', methods=['PUT'])
@@ -927,12 +2112,7 @@ def admin_panel():
     device_type = detect_device_type(request.headers.get('User-Agent'))
     
     # Получаем статистику
-    total_users = User.query.count()
-    online_users = User.query.filter_by(is_online=True).count()
-    total_channels = Channel.query.count()
-    total_messages = Message.query.count()
-    banned_users = User.query.filter_by(is_banned=True).count()
-    pending_reports = Report.query.filter_by(status='pending').count()
+    totals = admin_totals()
     
     # Получаем последних пользователей
     recent_users = User.query.order_by(User.created_at.desc()).limit(10).all()
@@ -944,16 +2124,11 @@ def admin_panel():
     recent_reports = Report.query.order_by(Report.created_at.desc()).limit(5).all()
     
     return render_template('admin.html', 
-                         total_users=total_users,
-                         online_users=online_users,
-                         total_channels=total_channels,
-                         total_messages=total_messages,
-                         banned_users=banned_users,
-                         pending_reports=pending_reports,
                          recent_users=recent_users,
                          active_channels=active_channels,
                          recent_reports=recent_reports,
-                         device_type=device_type)
+                         device_type=device_type,
+                         **totals)
 
 @app.route('/admin/users')
 @login_required
@@ -982,12 +2157,13 @@ def admin_users():
             'username': user.username,
             'display_name': user.display_name,
             'email': user.email,
-            'is_online': user.is_online,
+            'is_online': presence.is_online(user.id),
             'status': user.status,
             'custom_status': user.custom_status,
             'created_at': user.created_at.strftime('%d.%m.%Y %H:%M'),
             'last_seen': user.last_seen.strftime('%d.%m.%Y %H:%M') if user.last_seen else 'Неизвестно',
             'profile_picture': user.profile_picture,
+            'avatar_url': avatar_url(user.profile_picture, 48),
             'is_admin': user.is_admin,
             'is_banned': user.is_banned,
             'ban_reason': user.ban_reason if user.is_banned else '',
@@ -999,64 +2175,126 @@ def admin_users():
         'current_page': page
     })
 
+# Допустимые периоды статистики (в днях)
+STATISTICS_RANGES = (7, 30, 365)
+
+def count_by_day(column, start, end):
+    """Считает записи по дням одной агрегирующей выборкой: {'YYYY-MM-DD': count}"""
+    day = db.func.date(column)
+    rows = db.session.query(day, db.func.count()).filter(
+        column >= start, column < end
+    ).group_by(day).all()
+    return {str(bucket): count for bucket, count in rows}
+
+def count_all_by_day(start, end):
+    """Суточные счетчики по всем таблицам статистики (по запросу на таблицу)"""
+    return {
+        'new_users': count_by_day(User.created_at, start, end),
+        'messages': count_by_day(Message.timestamp, start, end),
+        'reports': count_by_day(Report.created_at, start, end)
+    }
+
+def daily_statistics(days):
+    """Возвращает счетчики за последние days дней, дополняя кэш DailyStat недостающими днями"""
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    
+    def midnight(day):
+        return datetime.combine(day, datetime.min.time())
+    
+    stats = {stat.day: stat for stat in DailyStat.query.filter(DailyStat.day >= start, DailyStat.day < today)}
+    
+    # Завершенные дни считаются один раз и сохраняются
+    missing = [start + timedelta(days=i) for i in range(days - 1) if start + timedelta(days=i) not in stats]
+    if missing:
+        counts = count_all_by_day(midnight(missing[0]), midnight(today))
+        for day in missing:
+            key = day.isoformat()
+            stat = DailyStat(day=day, **{name: counts[name].get(key, 0) for name in counts})
+            db.session.add(stat)
+            stats[day] = stat
+        try:
+            db.session.commit()
+        except Exception:
+            # Параллельный запрос уже сохранил эти дни
+            db.session.rollback()
+    
+    # Текущий день всегда считается заново
+    counts = count_all_by_day(midnight(today), midnight(today + timedelta(days=1)))
+    stats[today] = DailyStat(day=today, **{name: counts[name].get(today.isoformat(), 0) for name in counts})
+    
+    return [stats[start + timedelta(days=i)] for i in range(days)]
+
+def admin_totals():
+    """Общие счетчики админ-панели одним запросом"""
+    def count(column, *criteria):
+        return db.session.query(db.func.count(column)).filter(*criteria).scalar_subquery()
+    
+    row = db.session.query(
+        count(User.id),
+        count(Channel.id),
+        count(Message.id),
+        count(User.id, User.is_banned == True),
+        count(Report.id, Report.status == 'pending')
+    ).one()
+    return {
+        'total_users': row[0],
+        'online_users': presence.online_count(),
+        'total_channels': row[1],
+        'total_messages': row[2],
+        'banned_users': row[3],
+        'pending_reports': row[4]
+    }
+
 @app.route('/admin/statistics')
 @login_required
 def admin_statistics():
     if not current_user.is_admin:
         return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
     
-    # Статистика по дням (последние 30 дней)
-    from datetime import datetime, timedelta
-    
-    dates = []
-    user_counts = []
-    message_counts = []
-    report_counts = []
+    days = request.args.get('days', 30, type=int)
+    if days not in STATISTICS_RANGES:
+        return jsonify({'status': 'error', 'message': 'Неверный период статистики'}), 400
     
-    for i in range(30):
-        date = datetime.now() - timedelta(days=i)
-        dates.append(date.strftime('%d.%m'))
-        
-        # Количество новых пользователей за день
-        user_count = User.query.filter(
-            User.created_at >= date.replace(hour=0, minute=0, second=0, microsecond=0),
-            User.created_at < date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        ).count()
-        user_counts.append(user_count)
-        
-        # Количество сообщений за день
-        message_count = Message.query.filter(
-            Message.timestamp >= date.replace(hour=0, minute=0, second=0, microsecond=0),
-            Message.timestamp < date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        ).count()
-        message_counts.append(message_count)
-        
-        # Количество жалоб за день
-        report_count = Report.query.filter(
-            Report.created_at >= date.replace(hour=0, minute=0, second=0, microsecond=0),
-            Report.created_at < date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        ).count()
-        report_counts.append(report_count)
-    
-    # Переворачиваем массивы для правильного порядка
-    dates.reverse()
-    user_counts.reverse()
-    message_counts.reverse()
-    report_counts.reverse()
+    stats = daily_statistics(days)
     
     return jsonify({
-        'dates': dates,
-        'user_counts': user_counts,
-        'message_counts': message_counts,
-        'report_counts': report_counts,
-        'total_users': User.query.count(),
-        'online_users': User.query.filter_by(is_online=True).count(),
-        'total_channels': Channel.query.count(),
-        'total_messages': Message.query.count(),
-        'banned_users': User.query.filter_by(is_banned=True).count(),
-        'pending_reports': Report.query.filter_by(status='pending').count()
+        'days': days,
+        'dates': [stat.day.strftime('%d.%m') for stat in stats],
+        'user_counts': [stat.new_users for stat in stats],
+        'message_counts': [stat.messages for stat in stats],
+        'report_counts': [stat.reports for stat in stats],
+        **admin_totals()
     })
 
+@app.route('/api/admin/db_pool')
+@login_required
+def admin_db_pool():
+    """Ожидание соединений из пула и его текущая заполненность"""
+    if not current_user.is_admin:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    
+    return jsonify(pool_metrics.snapshot(db.engine.pool))
+
+@app.route('/api/admin/typing')
+@login_required
+def admin_typing_metrics():
+    """Сколько событий печати получено, разослано, схлопнуто и отброшено лимитом"""
+    if not current_user.is_admin:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    
+    return jsonify(typing_registry.snapshot())
+
+@app.route('/api/admin/avatars/gc', methods=['POST'])
+@login_required
+def admin_collect_avatars():
+    """Удаляет файлы аватаров, на которые не ссылается ни один профиль"""
+    if not current_user.is_admin:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    
+    referenced = [picture for (picture,) in db.session.query(User.profile_picture).distinct()]
+    return jsonify({'status': 'success', 'removed': avatar_store.collect_garbage(referenced)})
+
 # Функция для проверки админских прав
 def admin_required(f):
     @wraps(f)
@@ -1122,6 +2360,7 @@ def delete_user(user_id):
     # Удаляем пользователя
     db.session.delete(target_user)
     db.session.commit()
+    user_search_index.remove(user_id)
     
     return jsonify({'status': 'success', 'message': 'Пользователь удален'})
 
@@ -1244,6 +2483,7 @@ def ban_user(user_id):
     db.session.add(action)
     
     db.session.commit()
+    ban_registry.ban(target_user.id, ban_until, reason)
     
     # Отправляем уведомление пользователю через WebSocket
     if duration > 0:
@@ -1284,6 +2524,7 @@ def unban_user(user_id):
     db.session.add(action)
     
     db.session.commit()
+    ban_registry.unban(target_user.id)
     
     # Отправляем уведомление пользователю через WebSocket
     socketio.emit('user_unbanned', {
@@ -1436,15 +2677,8 @@ def get_user_profile(user_id):
     user = User.query.get_or_404(user_id)
     
     # Проверяем, заблокирован ли пользователь
-    if user.is_banned:
-        if user.ban_until and user.ban_until < datetime.utcnow():
-            # Блокировка истекла, разблокируем
-            user.is_banned = False
-            user.ban_reason = ''
-            user.ban_until = None
-            db.session.commit()
-        else:
-            return jsonify({'status': 'error', 'message': 'Пользователь заблокирован'}), 403
+    if active_ban(user.id):
+        return jsonify({'status': 'error', 'message': 'Пользователь заблокирован'}), 403
     
     return jsonify({
         'id': user.id,
@@ -1452,123 +2686,311 @@ def get_user_profile(user_id):
         'display_name': user.display_name,
         'email': user.email if current_user.is_admin else None,
         'profile_picture': user.profile_picture,
+        'avatar_url': avatar_url(user.profile_picture, 256),
         'bio': user.bio,
         'status': user.status,
         'custom_status': user.custom_status,
         'color_accent': user.color_accent,
-        'is_online': user.is_online,
+        'is_online': presence.is_online(user.id),
         'created_at': user.created_at.strftime('%d.%m.%Y %H:%M'),
         'last_seen': user.last_seen.strftime('%d.%m.%Y %H:%M') if user.last_seen else None,
         'is_admin': user.is_admin,
-        'is_banned': user.is_banned,
-        'ban_reason': user.ban_reason if current_user.is_admin else None,
-        'ban_until': user.ban_until.strftime('%d.%m.%Y %H:%M') if user.ban_until and current_user.is_admin else None,
+        'is_banned': False,  # заблокированному выше отвечаем 403
+        'ban_reason': None,
+        'ban_until': None,
         'ban_count': user.ban_count if current_user.is_admin else None
     })
 
 # WebSocket события
+def user_room(user_id):
+    """Имя персональной комнаты пользователя"""
+    return f'user_{user_id}'
+
+def channel_room(channel_id):
+    """Имя комнаты канала"""
+    return f'channel_{channel_id}'
+
+def can_access_channel(channel_id, user_id):
+    """Проверяет, может ли пользователь читать канал"""
+    channel = Channel.query.get(channel_id)
+    if not channel:
+        return False
+    if channel.is_public:
+        return True
+    return ChannelMember.query.filter_by(channel_id=channel_id, user_id=user_id).first() is not None
+
 @socketio.on('connect')
 def handle_connect():
     if current_user.is_authenticated:
-        current_user.is_online = True
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
-        emit('user_status', {'user_id': current_user.id, 'status': 'online'}, broadcast=True)
+        # Персональная комната и комнаты всех каналов пользователя
+        join_room(user_room(current_user.id))
+        channel_ids = db.session.query(ChannelMember.channel_id).filter_by(user_id=current_user.id).all()
+        for (channel_id,) in channel_ids:
+            join_room(channel_room(channel_id))
+        
+        start_presence_flusher()
+        if presence.connect(current_user.id):
+            emit('user_status', {'user_id': current_user.id, 'status': 'online'}, broadcast=True)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     if current_user.is_authenticated:
-        current_user.is_online = False
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
-        emit('user_status', {'user_id': current_user.id, 'status': 'offline'}, broadcast=True)
-
-@socketio.on('send_message')
-def handle_message(data):
-    # Проверяем, что сообщение не пустое
-    if not data.get('content', '').strip():
-        return
-    
-    content = data['content'].strip()
-    
-    # Шифруем сообщение
-    encrypted_content = encrypt_message(content, ENCRYPTION_KEY)
-    
+        if presence.disconnect(current_user.id):
+            emit('user_status', {'user_id': current_user.id, 'status': 'offline'}, broadcast=True)
+        # Печатать могли в закрытой вкладке
+        for target in typing_registry.stop_all(current_user.id):
+            emit_typing('typing_stop', typing_user(), target)
+
+def new_message(sender_id, receiver_id, channel_id, content, reply_to_id=None):
+    """Создает сообщение с номером изменения канала и добавляет его в сессию"""
     message = Message(
-        sender_id=current_user.id,
-        receiver_id=data.get('receiver_id'),
-        channel_id=data.get('channel_id'),
-        content=content,  # Оригинальное сообщение для отображения
-        encrypted_content=encrypted_content,  # Зашифрованное для хранения
-        reply_to_id=data.get('reply_to_id')
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        channel_id=channel_id,
+        content=stored_content(content),  # Открытый текст (пусто в режиме хранения только шифротекста)
+        encrypted_content=encrypt_message(content),  # Зашифрованное для хранения
+        reply_to_id=reply_to_id,
+        channel_seq=next_channel_seq(channel_id) if channel_id else None
     )
     db.session.add(message)
-    db.session.commit()
-    
-    # Отправляем сообщение всем подключенным пользователям
-    emit('new_message', {
+    return message
+
+def message_payload(message, content, attachments=None):
+    """Поля события new_message (без имени отправителя)"""
+    reply_to = message.reply_to
+    return {
         'id': message.id,
         'sender_id': message.sender_id,
         'receiver_id': message.receiver_id,
         'channel_id': message.channel_id,
+        'channel_seq': message.channel_seq,
+        'version': message.version,
         'content': content,  # Отправляем оригинальное сообщение
         'timestamp': message.timestamp.strftime('%H:%M'),
-        'sender_name': current_user.display_name,
         'reply_to_id': message.reply_to_id,
-        'reply_to_content': message.reply_to.content[:50] + '...' if message.reply_to else None
-    }, broadcast=True)
+        'reply_to_content': message_text(reply_to.content, reply_to.encrypted_content)[:50] + '...' if reply_to else None,
+        'attachments': attachments or []
+    }
+
+def store_message(sender_id, receiver_id, channel_id, content, reply_to_id=None, attachment_ids=None):
+    """Сохраняет сообщение вместе с разговорами участников и вложениями
     
-    # Отправляем уведомление получателю
-    if message.receiver_id:
-        emit('message_notification', {
-            'sender_name': current_user.display_name,
-            'content': content[:50] + '...' if len(content) > 50 else content
-        }, room=message.receiver_id)
-    elif message.channel_id:
-        # Уведомление для канала
-        emit('channel_message_notification', {
-            'channel_id': message.channel_id,
+    Возвращает поля события new_message, поэтому может выполняться
+    в потоке очереди записи.
+    """
+    message = new_message(sender_id, receiver_id, channel_id, content, reply_to_id)
+    db.session.flush()
+    update_conversations(message)
+    attachments = attach_uploads(message, attachment_ids)
+    db.session.commit()
+    return message_payload(message, content, attachments)
+
+def store_messages(pending):
+    """Сохраняет пачку сообщений одной транзакцией в порядке постановки"""
+    messages = [
+        new_message(item['sender_id'], item['receiver_id'], item['channel_id'], item['content'], item['reply_to_id'])
+        for item in pending
+    ]
+    db.session.flush()
+    attachments = []
+    for message, item in zip(messages, pending):
+        update_conversations(message)
+        attachments.append(attach_uploads(message, item.get('attachment_ids')))
+    db.session.commit()
+    return [message_payload(message, item['content'], message_attachments)
+            for message, item, message_attachments in zip(messages, pending, attachments)]
+
+def deliver_message(payload, skip_sid=None):
+    """Рассылает сохраненное сообщение участникам диалога или канала"""
+    preview = payload['content'][:50] + '...' if len(payload['content']) > 50 else payload['content']
+    if payload['channel_id']:
+        room = channel_room(payload['channel_id'])
+        socketio.emit('new_message', payload, room=room)
+        socketio.emit('channel_message_notification', {
+            'channel_id': payload['channel_id'],
+            'sender_name': payload['sender_name'],
+            'content': preview
+        }, room=room, skip_sid=skip_sid)
+    else:
+        socketio.emit('new_message', payload, room=user_room(payload['receiver_id']))
+        if payload['receiver_id'] != payload['sender_id']:
+            socketio.emit('new_message', payload, room=user_room(payload['sender_id']))
+        socketio.emit('message_notification', {
+            'sender_id': payload['sender_id'],
+            'sender_name': payload['sender_name'],
+            'content': preview
+        }, room=user_room(payload['receiver_id']))
+
+def flush_message_batch(pending):
+    """Фиксирует пачку из очереди групповой записи и рассылает сообщения"""
+    try:
+        payloads = store_messages(pending)
+    except Exception:
+        db.session.rollback()
+        # Одно сообщение с ошибкой (например, удаленный канал) не должно терять всю пачку
+        payloads = []
+        for item in pending:
+            try:
+                payloads.append(store_message(
+                    item['sender_id'], item['receiver_id'], item['channel_id'], item['content'], item['reply_to_id'],
+                    item.get('attachment_ids')
+                ))
+            except Exception:
+                db.session.rollback()
+                payloads.append(None)
+    
+    for item, payload in zip(pending, payloads):
+        if payload is None:
+            socketio.emit('message_failed', {'provisional_id': item['provisional_id']}, to=item['sid'])
+            continue
+        payload.update(
+            provisional_id=item['provisional_id'],
+            sender_name=item['sender_name'],
+            sender_username=item['sender_username']
+        )
+        deliver_message(payload, skip_sid=item['sid'])
+
+# Групповая фиксация: сообщения пишутся пачками из отдельного потока (см. group_commit.py)
+app.config['MESSAGE_GROUP_COMMIT'] = os.environ.get('MESSAGE_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+message_batches = GroupCommitWriter(
+    flush_message_batch,
+    interval=int(os.environ.get('MESSAGE_GROUP_COMMIT_INTERVAL_MS', 5)) / 1000,
+    max_batch=int(os.environ.get('MESSAGE_GROUP_COMMIT_MAX', 64)),
+    wrap=app.app_context
+)
+atexit.register(message_batches.drain)
+
+MESSAGE_ATTACHMENTS_MAX = 10
+
+@socketio.on('send_message')
+def handle_message(data):
+    if not current_user.is_authenticated:
+        return
+    
+    # Проверяем, что сообщение не пустое (сообщение из одних вложений допустимо)
+    content = (data.get('content') or '').strip()
+    attachment_ids = data.get('attachment_ids') or []
+    if not content and not attachment_ids:
+        return
+    
+    receiver_id = data.get('receiver_id')
+    channel_id = data.get('channel_id')
+    
+    if channel_id:
+        if not can_access_channel(channel_id, current_user.id):
+            return
+        receiver_id = None
+    elif not receiver_id:
+        return
+    
+    if attachment_ids:
+        if (not isinstance(attachment_ids, list) or len(attachment_ids) > MESSAGE_ATTACHMENTS_MAX
+                or not pending_uploads_ready([str(upload_id) for upload_id in attachment_ids], current_user.id)):
+            return {'status': 'error', 'message': 'Вложения не загружены'}
+        attachment_ids = [str(upload_id) for upload_id in attachment_ids]
+    
+    if app.config['MESSAGE_GROUP_COMMIT']:
+        # Подтверждаем сразу временным id; new_message с настоящим id придет после фиксации пачки
+        provisional_id = uuid.uuid4().hex
+        message_batches.submit({
+            'provisional_id': provisional_id,
+            'sid': request.sid,
+            'sender_id': current_user.id,
             'sender_name': current_user.display_name,
-            'content': content[:50] + '...' if len(content) > 50 else content
-        }, broadcast=True)
+            'sender_username': current_user.username,
+            'receiver_id': receiver_id,
+            'channel_id': channel_id,
+            'content': content,
+            'reply_to_id': data.get('reply_to_id'),
+            'attachment_ids': attachment_ids
+        })
+        return {'status': 'queued', 'provisional_id': provisional_id}
+    
+    payload = write(store_message, current_user.id, receiver_id, channel_id, content, data.get('reply_to_id'),
+                    attachment_ids)
+    payload['sender_name'] = current_user.display_name
+    payload['sender_username'] = current_user.username
+    deliver_message(payload, skip_sid=request.sid)
+    return {'status': 'sent', 'id': payload['id']}
 
 @socketio.on('join_channel')
 def handle_join_channel(data):
     channel_id = data.get('channel_id')
-    if channel_id:
-        join_room(f'channel_{channel_id}')
+    if channel_id and current_user.is_authenticated and can_access_channel(channel_id, current_user.id):
+        join_room(channel_room(channel_id))
         emit('user_joined_channel', {
             'user_id': current_user.id,
             'username': current_user.username,
             'display_name': current_user.display_name
-        }, room=f'channel_{channel_id}')
+        }, room=channel_room(channel_id))
 
 @socketio.on('leave_channel')
 def handle_leave_channel(data):
     channel_id = data.get('channel_id')
-    if channel_id:
-        leave_room(f'channel_{channel_id}')
+    if channel_id and current_user.is_authenticated:
+        leave_room(channel_room(channel_id))
         emit('user_left_channel', {
             'user_id': current_user.id,
             'username': current_user.username,
             'display_name': current_user.display_name
-        }, room=f'channel_{channel_id}')
+        }, room=channel_room(channel_id))
+
+def typing_target(data):
+    """Цель события печати: ('dm', id собеседника) или ('channel', id канала); None - нет доступа"""
+    try:
+        if data.get('channel_id'):
+            channel_id = int(data['channel_id'])
+            return ('channel', channel_id) if can_access_channel(channel_id, current_user.id) else None
+        receiver_id = int(data.get('receiver_id'))
+    except (TypeError, ValueError):
+        return None
+    return ('dm', receiver_id) if receiver_id != current_user.id else None
+
+def emit_typing(event_name, user, target, skip_sid=None):
+    """Отправляет событие печати только собеседнику или участникам канала"""
+    kind, target_id = target
+    payload = {
+        'user_id': user['id'],
+        'username': user['username'],
+        'display_name': user['display_name'],
+        'channel_id': target_id if kind == 'channel' else None
+    }
+    room = channel_room(target_id) if kind == 'channel' else user_room(target_id)
+    socketio.emit(event_name, payload, room=room, skip_sid=skip_sid)
+
+def typing_user():
+    return {'id': current_user.id, 'username': current_user.username, 'display_name': current_user.display_name}
+
+def emit_expired_typing(user_id, target):
+    """typing_stop за клиента, который не сообщил о конце печати"""
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        if user:
+            emit_typing('typing_stop', {'id': user.id, 'username': user.username, 'display_name': user.display_name},
+                        target)
+
+def start_typing_expirer():
+    typing_registry.start_expirer(emit_expired_typing, socketio.start_background_task)
 
 @socketio.on('typing_start')
 def handle_typing_start(data):
-    emit('typing_start', {
-        'user_id': current_user.id,
-        'username': current_user.username,
-        'display_name': current_user.display_name
-    }, broadcast=True)
+    if not current_user.is_authenticated or not typing_registry.allow(current_user.id):
+        return
+    target = typing_target(data or {})
+    # Повторный typing_start только продлевает срок и никуда не рассылается
+    if target and typing_registry.start(current_user.id, target):
+        start_typing_expirer()
+        emit_typing('typing_start', typing_user(), target, skip_sid=request.sid)
 
 @socketio.on('typing_stop')
 def handle_typing_stop(data):
-    emit('typing_stop', {
-        'user_id': current_user.id,
-        'username': current_user.username,
-        'display_name': current_user.display_name
-    }, broadcast=True)
+    # Конец печати не ограничивается лимитом, иначе индикатор завис бы до истечения
+    if not current_user.is_authenticated:
+        return
+    typing_registry.count_received()
+    target = typing_target(data or {})
+    if target and typing_registry.stop(current_user.id, target):
+        emit_typing('typing_stop', typing_user(), target, skip_sid=request.sid)
 
 if __name__ == '__main__':
     try:
@@ -1578,8 +3000,8 @@ if __name__ == '__main__':
         print(f"🌐 PORT: {os.environ.get('PORT', '8080')}")
         
         with app.app_context():
-            print("📁 Создание базы данных...")
-            db.create_all()
+            print("📁 Создание и миграция базы данных...")
+            run_migrations(db.engine, db.metadata)
             print("✅ База данных готова")
         
         # Получаем порт из переменной окружения (для Render) или используем 8080
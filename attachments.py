@@ -0,0 +1,198 @@
+"""
+Вложения сообщений Nexa Messenger
+
+Файл загружается частями (PUT с заголовком Upload-Offset), каждая часть
+читается из потока запроса блоками READ_SIZE и сразу пишется на диск,
+поэтому память на загрузку не зависит от размера файла. SHA-256
+считается по ходу записи; состояние хеша хранится в памяти процесса,
+а если часть пришла в другой воркер или после перезапуска, хеш
+пересчитывается по уже записанной на диск части файла.
+
+Загрузку можно продолжить с подтвержденного смещения: незавершенный
+файл лежит в partial/<id загрузки>.part, а подтвержденное смещение -
+в базе. Перед записью части файл обрезается до подтвержденного
+смещения, так что оборванная на середине часть просто пишется заново.
+Часть пишется только под захватом загрузки (writing): два параллельных
+запроса с одним смещением не пишут в файл и хеш одновременно.
+
+Готовый файл переносится в objects/<sha256[:2]>/<sha256>: одинаковые
+файлы хранятся один раз. Папка хранилища не должна быть внутри static -
+вложения отдаются только участникам переписки.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: захват действует только внутри процесса
+    fcntl = None
+
+READ_SIZE = 64 * 1024
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+OBJECT_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+UNSAFE_NAME_CHARS = re.compile(r'[\x00-\x1f\x7f"<>:|?*]')
+
+
+def safe_filename(filename, max_length=255):
+    """Имя файла для показа и Content-Disposition: без пути и служебных символов
+    
+    В отличие от werkzeug.secure_filename сохраняет кириллицу - имя
+    только показывается, на диске файл лежит под своим хешем.
+    """
+    name = str(filename).replace('\\', '/').rsplit('/', 1)[-1]
+    name = UNSAFE_NAME_CHARS.sub('_', name).strip(' .')
+    if len(name) > max_length:
+        stem, dot, extension = name.rpartition('.')
+        name = stem[:max_length - len(extension) - 1] + dot + extension if dot else name[:max_length]
+    return name
+
+
+class AttachmentStore:
+    def __init__(self, folder, min_age=3600):
+        self.folder = folder
+        self.min_age = min_age      # с, моложе - не трогает сборка мусора
+        self.lock = threading.Lock()
+        self.hashers = {}           # id загрузки -> (смещение, sha256 до этого смещения)
+        self.writers = set()        # id загрузок, в которые сейчас пишет этот процесс
+
+    def partial_path(self, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise ValueError(f'Некорректный id загрузки: {upload_id!r}')
+        return os.path.join(self.folder, 'partial', f'{upload_id}.part')
+
+    def object_path(self, sha256):
+        if not OBJECT_PATTERN.match(sha256):
+            raise ValueError(f'Некорректный хеш: {sha256!r}')
+        return os.path.join(self.folder, 'objects', sha256[:2], sha256)
+
+    def relative_object_path(self, sha256):
+        return f'objects/{sha256[:2]}/{sha256}'
+
+    def create(self, upload_id):
+        path = self.partial_path(upload_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        with self.lock:
+            self.hashers[upload_id] = (0, hashlib.sha256())
+
+    def hasher_at(self, upload_id, offset):
+        """sha256 первых offset байт загрузки (из памяти или по файлу)"""
+        with self.lock:
+            state = self.hashers.pop(upload_id, None)
+        if state is not None and state[0] == offset:
+            return state[1]
+        hasher = hashlib.sha256()
+        remaining = offset
+        with open(self.partial_path(upload_id), 'rb') as source:
+            while remaining:
+                block = source.read(min(READ_SIZE, remaining))
+                if not block:
+                    raise ValueError('Файл загрузки короче подтвержденного смещения')
+                hasher.update(block)
+                remaining -= len(block)
+        return hasher
+
+    @contextmanager
+    def writing(self, upload_id):
+        """Захват загрузки для записи части; дает False, если часть уже пишет другой запрос
+        
+        Между потоками процесса захват держит writers, между воркерами -
+        flock на файле загрузки. Не дожидается освобождения: повтор части
+        получит ответ сразу и продолжит с подтвержденного смещения.
+        """
+        with self.lock:
+            busy = upload_id in self.writers
+            if not busy:
+                self.writers.add(upload_id)
+        if busy:
+            yield False
+            return
+        handle = None
+        try:
+            if fcntl is not None:
+                try:
+                    handle = open(self.partial_path(upload_id), 'rb')
+                except FileNotFoundError:
+                    # Загрузка уже завершена или отменена
+                    yield False
+                    return
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+        finally:
+            if handle is not None:
+                handle.close()  # снимает flock
+            with self.lock:
+                self.writers.discard(upload_id)
+
+    def append(self, upload_id, offset, stream, limit):
+        """Дописывает из потока до limit байт с подтвержденного смещения; возвращает новое смещение"""
+        hasher = self.hasher_at(upload_id, offset)
+        received = 0
+        with open(self.partial_path(upload_id), 'r+b') as target:
+            # Хвост оборванной части, не подтвержденный в базе, отбрасывается
+            target.truncate(offset)
+            target.seek(offset)
+            while received < limit:
+                block = stream.read(min(READ_SIZE, limit - received))
+                if not block:
+                    break
+                target.write(block)
+                hasher.update(block)
+                received += len(block)
+        with self.lock:
+            self.hashers[upload_id] = (offset + received, hasher)
+        return offset + received
+
+    def finish(self, upload_id, size):
+        """Переносит завершенную загрузку в хранилище по содержимому; возвращает sha256"""
+        sha256 = self.hasher_at(upload_id, size).hexdigest()
+        partial = self.partial_path(upload_id)
+        with open(partial, 'rb+') as source:
+            os.fsync(source.fileno())
+        target = self.object_path(sha256)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(partial)
+            os.utime(target)  # продлевает жизнь для сборки мусора
+        else:
+            os.replace(partial, target)
+        return sha256
+
+    def discard(self, upload_id):
+        with self.lock:
+            self.hashers.pop(upload_id, None)
+        try:
+            os.remove(self.partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self, referenced, now=None):
+        """Удаляет файлы хранилища, не входящие в referenced; возвращает число файлов"""
+        now = time.time() if now is None else now
+        referenced = set(referenced)
+        removed = 0
+        root = os.path.join(self.folder, 'objects')
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not OBJECT_PATTERN.match(filename) or filename in referenced:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if now - os.path.getmtime(path) < self.min_age:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
@@ -0,0 +1,226 @@
+"""
+Аватары пользователей Nexa Messenger
+
+Загрузка проходит через конвейер:
+
+- тип файла определяется по сигнатуре (magic bytes), а не по расширению;
+  Pillow открывает файл только декодером этого типа, слишком большие
+  по числу пикселей изображения отклоняются до декодирования;
+- из изображения получаются квадратные миниатюры AVATAR_SIZES в WebP;
+  миниатюры собираются заново из пикселей, поэтому EXIF (в том числе
+  геометка), ICC и комментарии исходного файла не сохраняются;
+- файлы адресуются содержимым: ключ - начало SHA-256 загруженных байтов,
+  файлы лежат как <ключ>_<размер>.webp. Одинаковые загрузки дают один
+  ключ и обрабатываются один раз;
+- обработка идет в пуле потоков, а не в потоке запроса. Под gevent
+  используется пул настоящих потоков gevent, чтобы Pillow не блокировал
+  цикл событий. В пуле выполняется только работа с файлами (process);
+  запись в базу и события делает вызывающий код после завершения Future;
+- файлы, на которые не ссылается ни один профиль, удаляются сборкой
+  мусора. Файлы моложе min_age не трогаются: их ключ мог еще не попасть
+  в базу.
+"""
+
+import hashlib
+import io
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+AVATAR_SIZES = (48, 128, 256)
+AVATAR_FORMAT = 'webp'
+AVATAR_QUALITY = 80
+AVATAR_MAX_PIXELS = 40 * 1000 * 1000   # защита от "бомб" декомпрессии
+DEFAULT_PICTURE = 'default.jpg'
+
+# Сигнатура -> формат Pillow
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+FILE_PATTERN = re.compile(r'^([0-9a-f]{32})_\d+\.' + AVATAR_FORMAT + '$')
+# Файлы, сохраненные до конвейера: avatar_<id>_<время>.<расширение>
+LEGACY_PATTERN = re.compile(r'^avatar_\d+_\d{8}_\d{6}\.[a-z]+$')
+
+
+class AvatarError(ValueError):
+    """Загрузка не является допустимым изображением"""
+
+
+def sniff_image_type(data):
+    """Формат изображения по сигнатуре или None"""
+    for signature, image_format in SIGNATURES:
+        if data.startswith(signature):
+            return image_format
+    if len(data) >= 12 and data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def avatar_key(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def is_avatar_key(picture):
+    return bool(picture) and KEY_PATTERN.match(picture) is not None
+
+
+def avatar_filename(key, size):
+    return f'{key}_{size}.{AVATAR_FORMAT}'
+
+
+def avatar_path(picture, size=128):
+    """Путь аватара относительно static или None для аватара по умолчанию"""
+    if not picture or picture == DEFAULT_PICTURE:
+        return None
+    if is_avatar_key(picture):
+        # Ближайшая миниатюра не меньше запрошенного размера
+        size = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+        return f'avatars/{avatar_filename(picture, size)}'
+    return f'avatars/{picture}'
+
+
+def render_thumbnails(data):
+    """Проверяет загрузку и возвращает {размер: байты WebP}"""
+    image_format = sniff_image_type(data)
+    if image_format is None:
+        raise AvatarError('Файл не является изображением PNG, JPEG, GIF или WebP')
+    try:
+        image = Image.open(io.BytesIO(data), formats=[image_format])
+        width, height = image.size
+        if width * height > AVATAR_MAX_PIXELS:
+            raise AvatarError('Слишком большое изображение')
+        # JPEG можно декодировать сразу в уменьшенном масштабе
+        image.draft('RGB', (AVATAR_SIZES[-1] * 2, AVATAR_SIZES[-1] * 2))
+        image = ImageOps.exif_transpose(image)  # первый кадр GIF/WebP, с учетом поворота из EXIF
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    except AvatarError:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as error:
+        raise AvatarError('Не удалось прочитать изображение') from error
+
+    thumbnails = {}
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        thumbnail.info = {}  # без EXIF, ICC и прочих метаданных исходника
+        output = io.BytesIO()
+        thumbnail.save(output, AVATAR_FORMAT.upper(), quality=AVATAR_QUALITY, method=4)
+        thumbnails[size] = output.getvalue()
+        image = thumbnail  # следующий размер уменьшаем из предыдущего
+    return thumbnails
+
+
+def thread_pool(workers):
+    """Пул потоков для обработки; под gevent - пул настоящих потоков"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(max_workers=workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='avatar')
+
+
+class AvatarStore:
+    def __init__(self, folder, workers=2, min_age=600):
+        self.folder = folder
+        self.workers = workers
+        self.min_age = min_age      # с
+        self.executor = None
+        self.pid = None
+
+    def submit(self, func, *args):
+        """Выполняет func(*args) в пуле обработки; возвращает Future"""
+        # После fork воркера gunicorn потоки мастера не существуют
+        if self.pid != os.getpid():
+            self.executor = thread_pool(self.workers)
+            self.pid = os.getpid()
+        return self.executor.submit(func, *args)
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def exists(self, key):
+        """True, если миниатюры ключа уже есть; продлевает им жизнь для сборки мусора"""
+        paths = [self.path(avatar_filename(key, size)) for size in AVATAR_SIZES]
+        if not all(os.path.exists(path) for path in paths):
+            return False
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                return False
+        return True
+
+    def process(self, data, key=None):
+        """Создает миниатюры загрузки (если их еще нет) и возвращает ключ"""
+        key = key or avatar_key(data)
+        if self.exists(key):
+            return key
+        thumbnails = render_thumbnails(data)
+        os.makedirs(self.folder, exist_ok=True)
+        for size, content in thumbnails.items():
+            # Запись через временный файл: параллельная загрузка того же файла не увидит половину
+            path = self.path(avatar_filename(key, size))
+            temporary = f'{path}.{os.getpid()}.{id(content)}.tmp'
+            with open(temporary, 'wb') as output:
+                output.write(content)
+            os.replace(temporary, path)
+        return key
+
+    def is_old(self, path, now):
+        try:
+            return now - os.path.getmtime(path) >= self.min_age
+        except OSError:
+            return False
+
+    def release(self, picture, now=None):
+        """Удаляет файлы аватара, на который больше никто не ссылается; возвращает число файлов"""
+        if not picture or picture == DEFAULT_PICTURE or '/' in picture or '\\' in picture:
+            return 0
+        if is_avatar_key(picture):
+            filenames = [avatar_filename(picture, size) for size in AVATAR_SIZES]
+        elif LEGACY_PATTERN.match(picture):
+            filenames = [picture]
+        else:
+            return 0
+        return self.remove(filenames, time.time() if now is None else now)
+
+    def collect_garbage(self, referenced, now=None):
+        """Удаляет все файлы аватаров, не входящие в referenced; возвращает число файлов"""
+        referenced = set(referenced)
+        try:
+            filenames = os.listdir(self.folder)
+        except FileNotFoundError:
+            return 0
+        orphaned = []
+        for filename in filenames:
+            match = FILE_PATTERN.match(filename)
+            if match:
+                if match.group(1) not in referenced:
+                    orphaned.append(filename)
+            elif LEGACY_PATTERN.match(filename) and filename not in referenced:
+                orphaned.append(filename)
+        return self.remove(orphaned, time.time() if now is None else now)
+
+    def remove(self, filenames, now):
+        removed = 0
+        for filename in filenames:
+            path = self.path(filename)
+            if not self.is_old(path, now):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -0,0 +1,96 @@
+"""
+Реестр блокировок пользователей Nexa Messenger
+
+Активные блокировки хранятся в памяти процесса: проверка "заблокирован ли
+пользователь" - поиск в словаре, без запроса к базе и без записи во время
+чтения. Сроки временных блокировок лежат в куче, поэтому планировщик
+за O(log n) находит истекшие и снимает их в базе одной пачкой.
+
+Блокировки, выданные в других воркерах, подхватываются полной
+перезагрузкой реестра раз в refresh_interval секунд.
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class BanRegistry:
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.bans = {}      # user_id -> (ban_until или None навсегда, причина)
+        self.expiry = []    # куча (ban_until, user_id); устаревшие записи пропускаются при извлечении
+        self.loaded_at = None
+        self.scheduler_pid = None
+
+    def needs_reload(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.refresh_interval
+
+    def load(self, rows):
+        """Полностью перестраивает реестр из [(user_id, ban_until, причина)]"""
+        with self.lock:
+            self.bans = {user_id: (ban_until, reason) for user_id, ban_until, reason in rows}
+            self.expiry = [(ban_until, user_id) for user_id, (ban_until, _) in self.bans.items() if ban_until]
+            heapq.heapify(self.expiry)
+            self.loaded_at = time.time()
+
+    def ban(self, user_id, ban_until, reason):
+        with self.lock:
+            self.bans[user_id] = (ban_until, reason)
+            if ban_until:
+                heapq.heappush(self.expiry, (ban_until, user_id))
+
+    def unban(self, user_id):
+        with self.lock:
+            self.bans.pop(user_id, None)
+
+    def get(self, user_id, now=None):
+        """(ban_until, причина) действующей блокировки или None"""
+        ban = self.bans.get(user_id)
+        if ban is None:
+            return None
+        ban_until = ban[0]
+        if ban_until and ban_until <= (now or datetime.utcnow()):
+            return None  # истекла, планировщик снимет ее в базе
+        return ban
+
+    def is_banned(self, user_id, now=None):
+        return self.get(user_id, now) is not None
+
+    def due(self, now=None, limit=500):
+        """Забирает из реестра до limit истекших блокировок; возвращает [(user_id, ban_until, причина)]"""
+        now = now or datetime.utcnow()
+        expired = []
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now and len(expired) < limit:
+                ban_until, user_id = heapq.heappop(self.expiry)
+                ban = self.bans.get(user_id)
+                # Запись устарела: блокировку сняли или продлили
+                if ban is None or ban[0] != ban_until:
+                    continue
+                del self.bans[user_id]
+                expired.append((user_id, ban_until, ban[1]))
+        return expired
+
+    def restore(self, expired):
+        """Возвращает блокировки в реестр, если снять их в базе не удалось"""
+        for user_id, ban_until, reason in expired:
+            self.ban(user_id, ban_until, reason)
+
+    def start_scheduler(self, sweep, start_background_task, interval=5):
+        """Запускает периодическое снятие истекших блокировок (один раз на процесс)"""
+        with self.lock:
+            # После fork воркера gunicorn поток мастера не существует
+            if self.scheduler_pid == os.getpid():
+                return
+            self.scheduler_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                sweep()
+
+        start_background_task(run)
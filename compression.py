@@ -0,0 +1,212 @@
+"""
+Сжатие ответов Nexa Messenger
+
+CompressionMiddleware - WSGI-слой, который сжимает ответы gzip, если
+клиент присылает Accept-Encoding: gzip и ответ подходит:
+
+- тип содержимого из allowlist (JSON, HTML, текст), без Content-Encoding;
+- не меньше min_size байт (маленький ответ сжатие только увеличит);
+- не частичный и не файловый: ответы с Accept-Ranges (send_file) не
+  трогаем, иначе сломаются Range и sendfile;
+- нет Cache-Control: no-transform, путь не из exclude_paths.
+
+Ответ с Content-Length сжимается целиком и получает новую длину.
+Потоковый ответ (без Content-Length) сжимается по частям: каждая часть
+сбрасывается Z_SYNC_FLUSH, чтобы клиент получал данные без задержки.
+Приложение, которое пишет тело через write() из start_response (старый
+WSGI-интерфейс), получает настоящий write() сервера - такой ответ
+отдается без сжатия.
+
+Для Socket.IO сжатие настраивается отдельно: long-polling сжимает сам
+engine.io (http_compression), а для WebSocket simple-websocket
+согласует permessage-deflate. websocket_deflate() задает режим
+согласования (см. WEBSOCKET_DEFLATE_MODES).
+"""
+
+import zlib
+
+DEFAULT_MIME_TYPES = frozenset({
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    'text/css',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'text/xml',
+})
+
+DEFAULT_MIN_SIZE = 1024     # байт
+DEFAULT_LEVEL = 6
+
+# on - как в библиотеке: общий словарь между сообщениями (лучшее сжатие)
+# no_context_takeover - словарь сбрасывается после каждого сообщения: меньше памяти на соединение
+# off - расширение не согласуется
+WEBSOCKET_DEFLATE_MODES = ('on', 'no_context_takeover', 'off')
+
+
+def parse_accept_encoding(header):
+    """{кодировка: q} из заголовка Accept-Encoding"""
+    codings = {}
+    for part in header.lower().split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+def accepts_encoding(codings, encoding):
+    """True, если кодировка разрешена: названа с q > 0 или покрыта '*' с q > 0"""
+    return codings.get(encoding, codings.get('*', 0.0)) > 0
+
+
+def accepts_gzip(environ):
+    return accepts_encoding(parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING', '')), 'gzip')
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL,
+                 mime_types=DEFAULT_MIME_TYPES, exclude_paths=('/socket.io',)):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.mime_types = frozenset(mime_types)
+        self.exclude_paths = tuple(exclude_paths)
+
+    def __call__(self, environ, start_response):
+        if (environ.get('REQUEST_METHOD') == 'HEAD' or not accepts_gzip(environ)
+                or environ.get('PATH_INFO', '').startswith(self.exclude_paths)):
+            return self.app(environ, start_response)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return write
+
+        def write(data):
+            # Тело уже пошло мимо middleware: отвечаем как есть, без сжатия
+            if 'write' not in captured:
+                captured['write'] = start_response(captured['status'], captured['headers'], captured['exc_info'])
+            captured['write'](data)
+
+        body = self.app(environ, capture)
+        if 'write' in captured:
+            return body
+        status, headers = captured['status'], captured['headers']
+        mode = self.compression_mode(status, headers)
+        if mode is None:
+            start_response(status, headers, captured['exc_info'])
+            return body
+
+        headers = self.compressed_headers(headers)
+        if mode == 'buffered':
+            try:
+                compressed = gzip_bytes(b''.join(body), self.level)
+            finally:
+                close = getattr(body, 'close', None)
+                if close is not None:
+                    close()
+            headers.append(('Content-Length', str(len(compressed))))
+            start_response(status, headers, captured['exc_info'])
+            return [compressed]
+
+        start_response(status, headers, captured['exc_info'])
+        return self.stream(body)
+
+    def compression_mode(self, status, headers):
+        """'buffered', 'streaming' или None - ответ отдается как есть"""
+        if not status.startswith('200'):
+            return None
+        values = {}
+        for name, value in headers:
+            values[name.lower()] = value
+        if 'content-encoding' in values or 'accept-ranges' in values or 'content-range' in values:
+            return None
+        if 'no-transform' in values.get('cache-control', '').lower():
+            return None
+        if values.get('content-type', '').split(';')[0].strip().lower() not in self.mime_types:
+            return None
+        length = values.get('content-length')
+        if length is None:
+            return 'streaming'
+        try:
+            return 'buffered' if int(length) >= self.min_size else None
+        except ValueError:
+            return None
+
+    def compressed_headers(self, headers):
+        result = []
+        vary = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                # Сжатое представление не совпадает байт в байт с исходным
+                value = 'W/' + value
+            if lower == 'vary':
+                vary = value
+                continue
+            result.append((name, value))
+        if vary is None:
+            vary = 'Accept-Encoding'
+        elif vary.strip() != '*' and 'accept-encoding' not in vary.lower():
+            vary = vary + ', Accept-Encoding'
+        result.append(('Vary', vary))
+        result.append(('Content-Encoding', 'gzip'))
+        return result
+
+    def stream(self, body):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        try:
+            for chunk in body:
+                if chunk:
+                    yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+
+def gzip_bytes(data, level=DEFAULT_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def websocket_deflate(mode):
+    """Задает, как simple-websocket согласует permessage-deflate (режимы WEBSOCKET_DEFLATE_MODES)"""
+    if mode not in WEBSOCKET_DEFLATE_MODES:
+        raise ValueError(f'Неизвестный режим permessage-deflate: {mode!r}')
+    if mode == 'on':
+        return
+
+    # simple-websocket создает PerMessageDeflate() при каждом рукопожатии без параметров,
+    # поэтому режим задается подменой класса в его модуле
+    import simple_websocket.ws
+    from wsproto.extensions import PerMessageDeflate
+
+    class ConfiguredPerMessageDeflate(PerMessageDeflate):
+        def __init__(self):
+            super().__init__(server_no_context_takeover=(mode == 'no_context_takeover'))
+
+        def accept(self, offer):
+            if mode == 'off':
+                return None
+            return super().accept(offer)
+
+    simple_websocket.ws.PerMessageDeflate = ConfiguredPerMessageDeflate
@@ -0,0 +1,144 @@
+"""
+Общие помощники тестов: тестовая база, пользователи, каналы и вход,
+подсчет SQL-запросов, замер времени и запуск файла тестов как скрипта
+
+Тесты пересоздают таблицы, поэтому работают только с базой в памяти
+или с файлом SQLite во временной папке. Модуль задает DATABASE_URL до
+импорта app: pytest загружает conftest первым, а тест, запущенный как
+скрипт, импортирует его сам до app. DATABASE_URL из окружения (рабочая
+база) в тестах не используется, а reset_database() еще раз проверяет
+адрес настроенного приложения.
+"""
+
+import inspect
+import os
+import pathlib
+import tempfile
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+MEMORY_DATABASE_URL = 'sqlite://'
+
+
+def is_test_database(url):
+    """База в памяти или файл SQLite во временной папке"""
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        return True
+    if url.startswith('sqlite:///'):
+        path = os.path.realpath(url[len('sqlite:///'):])
+        return path.startswith(os.path.realpath(tempfile.gettempdir()) + os.sep)
+    return False
+
+
+if not is_test_database(os.environ.get('DATABASE_URL', '')):
+    os.environ['DATABASE_URL'] = MEMORY_DATABASE_URL
+
+from sqlalchemy import event
+
+from app import app, db, socketio, Channel, ChannelMember, User
+
+
+def reset_database():
+    """Удаляет и создает заново все таблицы тестовой базы"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not is_test_database(uri):
+        raise RuntimeError(f'Тесты пересоздают таблицы, а база {uri} не тестовая')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+
+def create_users(*usernames, **fields):
+    """Добавляет пользователей с именами usernames; возвращает их id"""
+    fields.setdefault('password_hash', '-')
+    with app.app_context():
+        users = [User(username=name, display_name=name.title(), email=f'{name}@nexa.com', **fields)
+                 for name in usernames]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def setup_users(*usernames, count=3, **fields):
+    """Пересоздает базу и добавляет пользователей (по умолчанию user0..user{count-1}); возвращает их id"""
+    reset_database()
+    return create_users(*(usernames or [f'user{i}' for i in range(count)]), **fields)
+
+
+def create_channel(member_ids, name='team', is_public=False):
+    """Канал, созданный первым из member_ids, со всеми ними в участниках; возвращает его id"""
+    with app.app_context():
+        channel = Channel(name=name, is_public=is_public, created_by=member_ids[0])
+        db.session.add(channel)
+        db.session.commit()
+        db.session.add_all([ChannelMember(channel_id=channel.id, user_id=user_id) for user_id in member_ids])
+        db.session.commit()
+        return channel.id
+
+
+def login_client(user_id):
+    """Тестовый HTTP-клиент с сессией пользователя"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def connect(user_id):
+    """Socket.IO-клиент пользователя"""
+    return socketio.test_client(app, flask_test_client=login_client(user_id))
+
+
+def received(socket, name):
+    """Данные событий name, полученных Socket.IO-клиентом с прошлого вызова"""
+    return [packet['args'][0] for packet in socket.get_received() if packet['name'] == name]
+
+
+@contextmanager
+def count_statements():
+    """Собирает SQL-запросы, выполненные внутри блока"""
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    # Контекст приложения не держится открытым: блок работает как без подсчета
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+
+@contextmanager
+def stopwatch():
+    """Замер времени блока: with stopwatch() as timer: ...; timer.elapsed - секунды"""
+    timer = SimpleNamespace(elapsed=None)
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.elapsed = time.perf_counter() - started
+
+
+def print_title(title):
+    """Заголовок вывода замеров при запуске файла как скрипта"""
+    print(f'📈 {title}')
+    print('=' * 50)
+
+
+def run_tests(namespace, message):
+    """Запуск файла тестов как скрипта: все его test_* по порядку объявления
+
+    Параметр tmp_path (как у фикстуры pytest) получает новую временную папку.
+    """
+    for name, test in list(namespace.items()):
+        if name.startswith('test_') and inspect.isfunction(test) and test.__module__ == namespace['__name__']:
+            arguments = {parameter: pathlib.Path(tempfile.mkdtemp())
+                         for parameter in inspect.signature(test).parameters if parameter == 'tmp_path'}
+            test(**arguments)
+    print(message)
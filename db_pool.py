@@ -0,0 +1,151 @@
+"""
+Пул соединений с базой данных Nexa Messenger
+
+Размер пула выводится из модели воркеров gunicorn (gunicorn.conf.py
+передает ее через GUNICORN_WORKER_CLASS / GUNICORN_WORKERS / GUNICORN_THREADS):
+
+- бюджет соединений сервера (DB_MAX_CONNECTIONS) делится поровну между воркерами;
+- gevent/eventlet: на воркер приходятся сотни гринлетов, поэтому пул
+  небольшой, а лишние гринлеты ждут соединение в очереди пула (pool_timeout),
+  а не открывают новые соединения до исчерпания max_connections;
+- потоковые воркеры: пул по числу потоков.
+
+Любой параметр переопределяется переменными DB_POOL_SIZE, DB_MAX_OVERFLOW,
+DB_POOL_TIMEOUT, DB_POOL_RECYCLE и DB_STATEMENT_TIMEOUT.
+
+PoolMetrics считает время ожидания соединения при выдаче из пула
+(checkout) и таймауты пула; срез отдается в /api/admin/db_pool.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+GREEN_WORKERS = {'gevent', 'eventlet', 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'}
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONNECTIONS = 90      # max_connections PostgreSQL (100) минус резерв для миграций и psql
+DEFAULT_POOL_TIMEOUT = 10         # с
+DEFAULT_POOL_RECYCLE = 1800       # с, раньше таймаутов простоя у балансировщиков и pgbouncer
+DEFAULT_STATEMENT_TIMEOUT = 15000  # мс
+
+
+def is_postgresql(url):
+    return make_url(url).get_backend_name() == 'postgresql'
+
+
+def pool_settings(env=None):
+    """Параметры пула для текущей модели воркеров"""
+    env = os.environ if env is None else env
+    worker_class = env.get('GUNICORN_WORKER_CLASS', 'sync')
+    workers = max(1, int(env.get('GUNICORN_WORKERS', 1)))
+    budget = int(env.get('DB_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+    per_worker = max(2, budget // workers)
+
+    if worker_class in GREEN_WORKERS:
+        pool_size = min(DEFAULT_POOL_SIZE, per_worker)
+    else:
+        threads = int(env.get('GUNICORN_THREADS', DEFAULT_POOL_SIZE))
+        pool_size = max(2, min(threads, per_worker))
+
+    return {
+        'pool_size': int(env.get('DB_POOL_SIZE', pool_size)),
+        'max_overflow': int(env.get('DB_MAX_OVERFLOW', per_worker - pool_size)),
+        'pool_timeout': float(env.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)),
+        'pool_recycle': int(env.get('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE)),
+        'statement_timeout': int(env.get('DB_STATEMENT_TIMEOUT', DEFAULT_STATEMENT_TIMEOUT)),
+    }
+
+
+def postgres_engine_options(settings, metrics=None):
+    """Параметры движка PostgreSQL (SQLALCHEMY_ENGINE_OPTIONS)"""
+    options = {
+        'pool_size': settings['pool_size'],
+        'max_overflow': settings['max_overflow'],
+        'pool_timeout': settings['pool_timeout'],
+        'pool_recycle': settings['pool_recycle'],
+        # Соединения, закрытые сервером или балансировщиком, отбрасываются до выдачи
+        'pool_pre_ping': True,
+        'connect_args': {
+            'connect_timeout': 5,
+            'options': '-c statement_timeout=%d' % settings['statement_timeout'],
+        },
+    }
+    if metrics is not None:
+        options['poolclass'] = timed_pool_class(metrics)
+    return options
+
+
+def timed_pool_class(metrics, base=QueuePool):
+    """Класс пула, который сообщает время выдачи соединений в metrics"""
+
+    class TimedPool(base):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                connection = super().connect()
+            except PoolTimeoutError:
+                metrics.record(time.perf_counter() - started, timed_out=True)
+                raise
+            metrics.record(time.perf_counter() - started)
+            return connection
+
+    return TimedPool
+
+
+class PoolMetrics:
+    """Счетчики ожидания соединений из пула"""
+
+    # Верхние границы корзин гистограммы ожидания, с
+    BUCKETS = (0.001, 0.01, 0.1, 1.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, wait, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            for position, bound in enumerate(self.BUCKETS):
+                if wait <= bound:
+                    break
+            else:
+                position = len(self.BUCKETS)
+            self.histogram[position] += 1
+
+    def snapshot(self, pool=None):
+        """Текущие счетчики и состояние пула (для QueuePool)"""
+        with self.lock:
+            labels = ['<=%gms' % (bound * 1000) for bound in self.BUCKETS] + ['>%gms' % (self.BUCKETS[-1] * 1000)]
+            data = {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'wait_histogram': dict(zip(labels, self.histogram)),
+            }
+        if isinstance(pool, QueuePool):
+            data['pool'] = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'max_overflow': pool._max_overflow,
+            }
+        return data
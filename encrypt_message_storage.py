@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Перевод истории сообщений Nexa Messenger в хранение только шифротекста
+
+1. Включите MESSAGE_ENCRYPTION_AT_REST=1 и перезапустите сервер -
+   новые сообщения сохраняются без открытого текста
+2. Очистите открытый текст старых сообщений:  python encrypt_message_storage.py
+3. Верните место на диске (SQLite):           python encrypt_message_storage.py --vacuum
+
+Задача идет порциями и может быть прервана и запущена снова.
+"""
+
+import sys
+
+
+def main():
+    """Основная функция"""
+    from sqlalchemy import text
+
+    from app import app, db, message_keys, drop_plaintext_messages
+
+    batch_size = 500
+    for arg in sys.argv[1:]:
+        if arg.startswith('--batch-size='):
+            batch_size = int(arg.split('=', 1)[1])
+
+    print("🔐 Удаление открытого текста сообщений")
+    print("=" * 50)
+    print(f"🔑 Основной ключ: {message_keys.primary_id}")
+    if not app.config['MESSAGE_ENCRYPTION_AT_REST']:
+        print("⚠️  MESSAGE_ENCRYPTION_AT_REST не включен: новые сообщения по-прежнему хранят открытый текст")
+
+    def progress(last_id, updated):
+        print(f"   ... обработано до id {last_id}, очищено: {updated}")
+
+    with app.app_context():
+        updated = drop_plaintext_messages(batch_size=batch_size, progress=progress)
+        print(f"\n✅ Очищено сообщений: {updated}")
+
+        if '--vacuum' in sys.argv:
+            if db.engine.dialect.name == 'sqlite':
+                # VACUUM нельзя выполнять внутри транзакции
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                    connection.execute(text('VACUUM'))
+                print("🧹 База данных сжата")
+            else:
+                print("ℹ️  Для PostgreSQL место освобождает autovacuum (или VACUUM FULL message вручную)")
+
+
+if __name__ == "__main__":
+    main()
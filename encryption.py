@@ -0,0 +1,177 @@
+"""
+Набор ключей шифрования сообщений Nexa Messenger
+
+Ключи задаются переменной окружения MESSAGE_ENCRYPTION_KEYS в виде
+"id:ключ,id:ключ,...", первый ключ - основной (им шифруются новые сообщения).
+Если переменная не задана, ключ один раз генерируется и сохраняется в файл,
+чтобы переживать перезапуски и совпадать у всех воркеров.
+
+Шифротекст хранится как "<id ключа>:<токен Fernet>", поэтому расшифровка
+сразу выбирает нужный ключ. Старые токены без префикса расшифровываются
+перебором ключей, как в MultiFernet.
+
+Расшифрованные тексты кэшируются в LRU внутри процесса: ключ кэша - сам
+шифротекст, поэтому после редактирования или ротации запись просто
+перестает совпадать и вытесняется со временем.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+
+# Текст, который показывается вместо сообщения, если расшифровать его не удалось
+UNREADABLE_MESSAGE = "Сообщение повреждено"
+
+
+def parse_keys(value):
+    """Разбирает строку "id:ключ,id:ключ" в список пар"""
+    keys = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key_id, _, key = item.partition(':')
+        if not key:
+            raise ValueError('Ключ шифрования должен иметь вид "id:ключ"')
+        keys.append((key_id.strip(), key.strip()))
+    if not keys:
+        raise ValueError('Не задано ни одного ключа шифрования')
+    return keys
+
+
+def load_or_create_key_file(path, wait=5.0):
+    """Читает ключи из файла, создавая его с новым ключом при первом запуске
+    
+    Новый ключ пишется во временный файл и публикуется через os.link:
+    воркеры, стартующие одновременно, видят либо готовый файл, либо никакого,
+    и ключ выбирает тот, кто опубликовал первым. Пустой файл (его мог
+    оставить создающий процесс старой версии) перечитывается до wait секунд.
+    """
+    if not os.path.exists(path):
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.keys-')
+        try:
+            with os.fdopen(fd, 'w') as f:  # mkstemp создает файл с правами 0600
+                f.write('1:%s\n' % Fernet.generate_key().decode())
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(temporary, path)
+            except FileExistsError:
+                pass  # Файл уже опубликовал другой воркер
+        finally:
+            os.remove(temporary)
+
+    deadline = time.monotonic() + wait
+    while True:
+        with open(path) as f:
+            value = f.read().strip()
+        if value or time.monotonic() >= deadline:
+            return value
+        time.sleep(0.05)
+
+
+class DecryptionCache:
+    """LRU расшифрованных текстов: шифротекст -> открытый текст"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ciphertext):
+        with self.lock:
+            plaintext = self.items.get(ciphertext)
+            if plaintext is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(ciphertext)
+            self.hits += 1
+            return plaintext
+
+    def put(self, ciphertext, plaintext):
+        with self.lock:
+            self.items[ciphertext] = plaintext
+            self.items.move_to_end(ciphertext)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeyRing:
+    def __init__(self, keys, cache_size=0):
+        # Объекты Fernet создаются один раз на ключ, а не на каждое сообщение
+        self.fernets = {key_id: Fernet(key.encode() if isinstance(key, str) else key) for key_id, key in keys}
+        self.primary_id = keys[0][0]
+        self.primary = self.fernets[self.primary_id]
+        self.cache = DecryptionCache(cache_size) if cache_size else None
+
+    @classmethod
+    def from_config(cls, value=None, key_file=None, cache_size=0):
+        """Создает набор ключей из строки конфигурации или файла ключей"""
+        if not value:
+            if not key_file:
+                raise ValueError('Не заданы ни MESSAGE_ENCRYPTION_KEYS, ни файл ключей')
+            value = load_or_create_key_file(key_file)
+        return cls(parse_keys(value), cache_size=cache_size)
+
+    def key_id(self, ciphertext):
+        """Возвращает id ключа шифротекста (None для старых токенов без префикса)"""
+        key_id, separator, _ = ciphertext.partition(':')
+        return key_id if separator else None
+
+    def encrypt(self, plaintext):
+        return '%s:%s' % (self.primary_id, self.primary.encrypt(plaintext.encode()).decode())
+
+    def decrypt(self, ciphertext, default=UNREADABLE_MESSAGE):
+        if self.cache is None:
+            return self._decrypt(ciphertext, default)
+        plaintext = self.cache.get(ciphertext)
+        if plaintext is None:
+            plaintext = self._decrypt(ciphertext, None)
+            if plaintext is None:
+                return default
+            self.cache.put(ciphertext, plaintext)
+        return plaintext
+
+    def _decrypt(self, ciphertext, default):
+        key_id = self.key_id(ciphertext)
+        try:
+            if key_id is not None:
+                fernet = self.fernets.get(key_id)
+                if fernet is None:
+                    return default
+                return fernet.decrypt(ciphertext[len(key_id) + 1:].encode()).decode()
+            for fernet in self.fernets.values():
+                try:
+                    return fernet.decrypt(ciphertext.encode()).decode()
+                except InvalidToken:
+                    continue
+        except (InvalidToken, ValueError):
+            pass
+        return default
+
+    def encrypt_many(self, plaintexts):
+        """Шифрует пачку сообщений основным ключом"""
+        primary, prefix = self.primary, self.primary_id + ':'
+        return [prefix + primary.encrypt(plaintext.encode()).decode() for plaintext in plaintexts]
+
+    def decrypt_many(self, ciphertexts, default=UNREADABLE_MESSAGE):
+        """Расшифровывает пачку сообщений (например, страницу истории)"""
+        return [self.decrypt(ciphertext, default) if ciphertext else default for ciphertext in ciphertexts]
+
+    def needs_rotation(self, ciphertext):
+        """True, если шифротекст создан не основным ключом"""
+        return self.key_id(ciphertext or '') != self.primary_id
@@ -0,0 +1,86 @@
+"""
+Групповая фиксация сообщений Nexa Messenger
+
+Обработчик отправки не пишет в базу сам: он ставит сообщение в очередь
+и сразу подтверждает отправителю временный id. Поток записи забирает
+сообщения пачками - пока не наберется max_batch или не пройдет interval
+с первого сообщения пачки - и фиксирует каждую пачку одной транзакцией,
+то есть одним fsync вместо fsync на сообщение.
+
+Поток один и забирает сообщения в порядке постановки, поэтому порядок
+сообщений внутри диалога и канала сохраняется.
+"""
+
+import queue
+import threading
+import time
+
+
+class GroupCommitWriter:
+    def __init__(self, flush, interval=0.005, max_batch=64, wrap=None, name='group-commit'):
+        self.flush = flush          # flush(items) фиксирует пачку и рассылает результат
+        self.interval = interval    # с
+        self.max_batch = max_batch
+        self.wrap = wrap
+        self.name = name
+        self.items = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.written = 0
+
+    def start(self):
+        with self.lock:
+            # После fork воркера gunicorn поток мастера не существует
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, item):
+        self.start()
+        self.items.put(item)
+
+    def drain(self):
+        """Ждет, пока все поставленное в очередь будет зафиксировано"""
+        if self.thread is not None and self.thread.is_alive():
+            self.items.join()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'messages': self.written,
+            'avg_batch': round(self.written / self.batches, 2) if self.batches else 0.0,
+            'queued': self.items.qsize(),
+        }
+
+    def _collect(self):
+        """Блокируется до первого сообщения, затем добирает пачку до max_batch или interval"""
+        batch = [self.items.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.items.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                if self.wrap is not None:
+                    with self.wrap():
+                        self.flush(batch)
+                else:
+                    self.flush(batch)
+            except Exception as error:
+                # flush сам сообщает отправителям об ошибках; поток записи не должен умирать
+                print(f"❌ Ошибка групповой записи ({len(batch)} сообщ.): {error}")
+            finally:
+                self.batches += 1
+                self.written += len(batch)
+                for _ in batch:
+                    self.items.task_done()
@@ -1,12 +1,36 @@
 # Конфигурация Gunicorn для Nexa Messenger
 import multiprocessing
+import os
 
 # Базовые настройки
 bind = "127.0.0.1:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "gevent"
+
+# Профили воркеров
+#
+# По умолчанию - один воркер: комнаты и подключения Socket.IO хранятся
+# в памяти процесса, и второй воркер не увидел бы чужих комнат.
+#
+# Многопроцессный профиль включается переменной SOCKETIO_MESSAGE_QUEUE:
+#   SOCKETIO_MESSAGE_QUEUE=local://127.0.0.1:5680  - ретранслятор на локальном сокете,
+#                                                    без внешних сервисов (один хост)
+#   SOCKETIO_MESSAGE_QUEUE=redis://host:6379/0     - несколько хостов
+# Воркеры делят комнаты и emit через шину (см. socket_queue.py), их число
+# задается WEB_CONCURRENCY. Long-polling требует, чтобы все запросы сессии
+# попадали в один воркер, поэтому в этом профиле клиенты должны использовать
+# транспорт websocket, либо запускайте по экземпляру gunicorn на порт за
+# балансировщиком с привязкой сессий (nginx ip_hash).
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+else:
+    workers = 1
 worker_connections = 1000
 
+# Модель воркеров для расчета пула соединений с базой (см. db_pool.py);
+# переменные ставятся до загрузки приложения (preload_app)
+os.environ.setdefault('GUNICORN_WORKER_CLASS', worker_class)
+os.environ.setdefault('GUNICORN_WORKERS', str(workers))
+
 # Настройки производительности
 max_requests = 1000
 max_requests_jitter = 100
@@ -27,3 +51,29 @@ limit_request_field_size = 8190
 
 # Настройки для WebSocket
 worker_tmp_dir = "/dev/shm"
+
+# Миграции схемы применяются один раз в мастер-процессе до запуска воркеров
+def on_starting(server):
+    from app import app, db
+    from migrations import run_migrations
+
+    with app.app_context():
+        run_migrations(db.engine, db.metadata, log=server.log.info)
+
+
+# Воркер не должен пользоваться соединениями, открытыми мастером до fork
+def post_fork(server, worker):
+    from app import app, db
+    from db_pool import is_postgresql
+
+    if worker_class == 'gevent' and is_postgresql(app.config['SQLALCHEMY_DATABASE_URI']):
+        # psycopg2 без psycogreen блокирует весь воркер на время запроса
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning("psycogreen не установлен: запросы к PostgreSQL блокируют воркер gevent")
+        else:
+            patch_psycopg()
+
+    with app.app_context():
+        db.engine.dispose(close=False)
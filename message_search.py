@@ -0,0 +1,230 @@
+"""
+Полнотекстовый поиск по сообщениям Nexa Messenger
+
+SQLite:      внешняя FTS5-таблица message_fts, синхронизируемая триггерами
+PostgreSQL:  GIN-индекс по to_tsvector('simple', content)
+
+Оба варианта возвращают результаты, отсортированные по релевантности,
+с подсвеченным фрагментом текста. Фрагмент экранируется здесь же,
+поэтому его можно вставлять в страницу как HTML.
+
+Если открытый текст не хранится (MESSAGE_ENCRYPTION_AT_REST), индексировать
+нечего: search_encrypted расшифровывает последние доступные сообщения
+и ищет в них, от новых к старым. За один запрос просматривается не больше
+SCAN_LIMIT сообщений; чтобы искать дальше, клиент передает курсор -
+id, с которого продолжается просмотр.
+"""
+
+import html
+import re
+
+from sqlalchemy import text
+
+# Служебные маркеры подсветки: не встречаются в обычном тексте и не ломают экранирование
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+        content, content='message', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+POSTGRES_SCHEMA = [
+    """CREATE INDEX IF NOT EXISTS ix_message_content_fts
+        ON message USING GIN (to_tsvector('simple', content))""",
+]
+
+# Сообщения, доступные пользователю: его личные диалоги и каналы, где он участник,
+# а также публичные каналы. Удаленные сообщения в выдачу не попадают.
+ACCESS_FILTER = """
+    m.is_deleted = :false AND m.deleted_for_all = :false AND (
+        (m.channel_id IS NULL AND (m.sender_id = :user_id OR m.receiver_id = :user_id))
+        OR m.channel_id IN (SELECT channel_id FROM channel_member WHERE user_id = :user_id)
+        OR m.channel_id IN (SELECT id FROM channel WHERE is_public = :true)
+    )
+"""
+
+SQLITE_QUERY = """
+    SELECT m.id, snippet(message_fts, 0, :hl_start, :hl_end, '…', 12) AS snippet,
+           bm25(message_fts) AS rank
+    FROM message_fts JOIN message m ON m.id = message_fts.rowid
+    WHERE message_fts MATCH :query AND {access}
+    ORDER BY rank, m.id DESC
+    LIMIT :limit OFFSET :offset
+""".format(access=ACCESS_FILTER)
+
+POSTGRES_QUERY = """
+    SELECT m.id,
+           ts_headline('simple', m.content, q.query,
+                       'StartSel=' || :hl_start || ', StopSel=' || :hl_end || ', MaxWords=24, MinWords=8') AS snippet,
+           -ts_rank(to_tsvector('simple', m.content), q.query) AS rank
+    FROM message m, to_tsquery('simple', :query) AS q(query)
+    WHERE to_tsvector('simple', m.content) @@ q.query AND {access}
+    ORDER BY rank, m.id DESC
+    LIMIT :limit OFFSET :offset
+""".format(access=ACCESS_FILTER)
+
+
+SCAN_QUERY = """
+    SELECT m.id, m.content, m.encrypted_content
+    FROM message m
+    WHERE m.id < :before_id AND {access}
+    ORDER BY m.id DESC
+    LIMIT :limit
+""".format(access=ACCESS_FILTER)
+
+# Сколько последних сообщений просматривает поиск без индекса
+SCAN_LIMIT = 5000
+SCAN_BATCH_SIZE = 500
+
+
+def ensure_search_index(connection):
+    """Создает поисковый индекс, если его еще нет (идемпотентно)"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+        )).first()
+        for statement in SQLITE_SCHEMA:
+            connection.execute(text(statement))
+        if not exists:
+            # Индексируем уже существующие сообщения
+            connection.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_SCHEMA:
+            connection.execute(text(statement))
+
+
+def drop_search_index(connection):
+    """Удаляет поисковый индекс вместе с таблицей сообщений"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("DROP TABLE IF EXISTS message_fts"))
+
+
+def build_query(dialect, raw_query):
+    """Превращает пользовательский ввод в безопасный запрос; последнее слово ищется по префиксу"""
+    tokens = _TOKEN_RE.findall(raw_query.lower())
+    if not tokens:
+        return None
+    if dialect == 'postgresql':
+        return ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+    return ' '.join('"%s"' % token for token in tokens[:-1]) + ' "%s"*' % tokens[-1]
+
+
+def render_snippet(snippet):
+    """Экранирует фрагмент и заменяет маркеры подсветки на <mark>"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+
+def search_messages(session, user_id, raw_query, limit=20, offset=0):
+    """Ищет сообщения, доступные пользователю; возвращает [(message_id, snippet_html, rank)]"""
+    dialect = session.get_bind().dialect.name
+    query = build_query(dialect, raw_query)
+    if query is None:
+        return []
+
+    sql = POSTGRES_QUERY if dialect == 'postgresql' else SQLITE_QUERY
+    rows = session.execute(text(sql), {
+        'query': query,
+        'user_id': user_id,
+        'hl_start': HIGHLIGHT_START,
+        'hl_end': HIGHLIGHT_END,
+        'true': True,
+        'false': False,
+        'limit': limit,
+        'offset': offset
+    }).all()
+    return [(message_id, render_snippet(snippet), rank) for message_id, snippet, rank in rows]
+
+
+def _is_hit(word, tokens):
+    """Слово совпадает с запросом: целиком с одним из слов или по префиксу с последним"""
+    return word in tokens[:-1] or word.startswith(tokens[-1])
+
+
+def highlight_text(text_value, tokens, words=12):
+    """Строит фрагмент вокруг первого совпадения с маркерами подсветки (как snippet() в FTS5)"""
+    matches = list(_TOKEN_RE.finditer(text_value))
+    if not matches:
+        return text_value
+    first = next((i for i, match in enumerate(matches) if _is_hit(match.group().lower(), tokens)), 0)
+    start = max(0, first - words // 2)
+    end = min(len(matches), start + words)
+
+    pieces = ['…'] if start > 0 else []
+    position = matches[start].start()
+    for match in matches[start:end]:
+        pieces.append(text_value[position:match.start()])
+        word = match.group()
+        pieces.append(HIGHLIGHT_START + word + HIGHLIGHT_END if _is_hit(word.lower(), tokens) else word)
+        position = match.end()
+    if end < len(matches):
+        pieces.append('…')
+    return ''.join(pieces)
+
+
+def search_encrypted(session, user_id, raw_query, decrypt_rows, limit=20, offset=0,
+                     before_id=None, scan_limit=SCAN_LIMIT):
+    """Ищет без полнотекстового индекса; decrypt_rows([(content, encrypted_content)]) -> [текст]
+
+    Просматриваются сообщения с id меньше before_id (все, если None), не
+    больше scan_limit за вызов; результаты упорядочены от новых к старым.
+    Возвращает (результаты, курсор): курсор - before_id для продолжения
+    поиска или None, если более старых совпадений нет.
+    """
+    tokens = _TOKEN_RE.findall(raw_query.lower())
+    if not tokens:
+        return [], None
+
+    hits = []
+    scanned = 0
+    cursor = None
+    # Лишнее совпадение сверх страницы показывает, что продолжать есть куда
+    while len(hits) <= offset + limit:
+        if scanned >= scan_limit:
+            # Бюджет просмотра исчерпан: продолжение - с последнего просмотренного
+            cursor = before_id
+            break
+        batch = min(SCAN_BATCH_SIZE, scan_limit - scanned)
+        rows = session.execute(text(SCAN_QUERY), {
+            'user_id': user_id,
+            'before_id': before_id if before_id is not None else 2 ** 62,
+            'true': True,
+            'false': False,
+            'limit': batch
+        }).all()
+        if not rows:
+            break
+        scanned += len(rows)
+        before_id = rows[-1][0]
+
+        texts = decrypt_rows((content, encrypted_content) for _, content, encrypted_content in rows)
+        for (message_id, _, _), text_value in zip(rows, texts):
+            words = set(_TOKEN_RE.findall(text_value.lower()))
+            if not all(token in words for token in tokens[:-1]):
+                continue
+            if not any(word.startswith(tokens[-1]) for word in words):
+                continue
+            hits.append((message_id, render_snippet(highlight_text(text_value, tokens)), 0))
+        if len(rows) < batch:
+            break
+
+    hits = hits[offset:offset + limit + 1]
+    if len(hits) > limit:
+        hits = hits[:limit]
+        cursor = hits[-1][0]
+    return hits, cursor
@@ -0,0 +1,190 @@
+"""
+Версионные миграции схемы базы данных Nexa Messenger
+
+Каждая миграция - функция от соединения, которая применяется один раз
+и записывается в таблицу schema_version. Перед миграциями недостающие
+таблицы создаются по моделям (metadata.create_all), а шаги миграций
+идемпотентны (IF NOT EXISTS, проверка колонок), поэтому и новые базы,
+и базы, созданные старыми версиями приложения, приходят к одной схеме.
+Поддерживаются SQLite и PostgreSQL.
+
+Запуск: python update_database.py (или автоматически при старте app.py / gunicorn)
+"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Регистрирует функцию как миграцию с номером version"""
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return register
+
+
+def column_names(connection, table):
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def add_column(connection, table, name, ddl):
+    """Добавляет колонку, если ее еще нет"""
+    if name not in column_names(connection, table):
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+
+def create_index(connection, name, table, columns, unique=False):
+    connection.execute(text('CREATE {unique}INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'.format(
+        unique='UNIQUE ' if unique else '', name=name, table=table, columns=', '.join(columns)
+    )))
+
+
+def delete_duplicates(connection, table, columns):
+    """Оставляет по одной строке (с наименьшим id) на каждое сочетание columns"""
+    connection.execute(text(
+        f'DELETE FROM "{table}" WHERE id NOT IN '
+        f'(SELECT MIN(id) FROM "{table}" GROUP BY {", ".join(columns)})'
+    ))
+
+
+@migration(1, 'moderation_columns')
+def moderation_columns(connection):
+    """Колонки модерации и рейтинга пользователей (бывший update_database.py)"""
+    add_column(connection, 'user', 'warnings_count', 'INTEGER DEFAULT 0')
+    add_column(connection, 'user', 'last_warning', 'TIMESTAMP')
+    add_column(connection, 'user', 'rating', 'FLOAT DEFAULT 5.0')
+    add_column(connection, 'user', 'rating_count', 'INTEGER DEFAULT 0')
+    connection.execute(text(
+        'UPDATE "user" SET warnings_count = 0 WHERE warnings_count IS NULL'
+    ))
+    connection.execute(text(
+        'UPDATE "user" SET rating = 5.0, rating_count = 0 WHERE rating IS NULL OR rating_count IS NULL'
+    ))
+
+
+@migration(2, 'message_history_indexes')
+def message_history_indexes(connection):
+    """Курсорная пагинация диалогов и дельта-синхронизация каналов"""
+    add_column(connection, 'channel', 'seq', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'message', 'channel_seq', 'INTEGER')
+    create_index(connection, 'ix_message_conversation', 'message', ['sender_id', 'receiver_id', 'id'])
+    create_index(connection, 'ix_message_channel', 'message', ['channel_id', 'id'])
+    create_index(connection, 'ix_message_channel_seq', 'message', ['channel_id', 'channel_seq'])
+
+
+@migration(3, 'conversations_backfill')
+def conversations_backfill(connection):
+    """Заполняет список разговоров по истории сообщений (старые сообщения считаются прочитанными)"""
+    connection.execute(text("""
+        INSERT INTO conversation
+            (user_id, kind, target_id, last_message_id, last_activity, last_read_message_id, unread_count)
+        SELECT pair.user_id, 'dm', pair.peer_id, m.id, m.timestamp, m.id, 0
+        FROM (
+            SELECT both_ways.user_id, both_ways.peer_id, MAX(both_ways.id) AS last_id
+            FROM (
+                SELECT sender_id AS user_id, receiver_id AS peer_id, id FROM message WHERE channel_id IS NULL
+                UNION ALL
+                SELECT receiver_id, sender_id, id FROM message WHERE channel_id IS NULL
+            ) AS both_ways
+            GROUP BY both_ways.user_id, both_ways.peer_id
+        ) AS pair
+        JOIN message m ON m.id = pair.last_id
+        ON CONFLICT (user_id, kind, target_id) DO NOTHING
+    """))
+    connection.execute(text("""
+        INSERT INTO conversation
+            (user_id, kind, target_id, last_message_id, last_activity, last_read_message_id, unread_count)
+        SELECT cm.user_id, 'channel', cm.channel_id, m.id, m.timestamp, m.id, 0
+        FROM channel_member cm
+        JOIN (
+            SELECT channel_id, MAX(id) AS last_id FROM message WHERE channel_id IS NOT NULL GROUP BY channel_id
+        ) AS last ON last.channel_id = cm.channel_id
+        JOIN message m ON m.id = last.last_id
+        ON CONFLICT (user_id, kind, target_id) DO NOTHING
+    """))
+
+
+@migration(4, 'hot_path_indexes')
+def hot_path_indexes(connection):
+    """Индексы и ограничения уникальности для частых запросов"""
+    # Сообщения: входящие пользователя и статистика по дням
+    create_index(connection, 'ix_message_receiver', 'message', ['receiver_id', 'id'])
+    create_index(connection, 'ix_message_timestamp', 'message', ['timestamp'])
+
+    # Участие в каналах и реакции: по одной записи на пользователя
+    delete_duplicates(connection, 'channel_member', ['channel_id', 'user_id'])
+    create_index(connection, 'uq_channel_member', 'channel_member', ['channel_id', 'user_id'], unique=True)
+    create_index(connection, 'ix_channel_member_user', 'channel_member', ['user_id', 'channel_id'])
+    delete_duplicates(connection, 'message_reaction', ['message_id', 'user_id'])
+    create_index(connection, 'uq_message_reaction', 'message_reaction', ['message_id', 'user_id'], unique=True)
+
+    # Жалобы: очередь модерации по статусу, повторные жалобы, статистика
+    create_index(connection, 'ix_report_status_created', 'report', ['status', 'created_at'])
+    create_index(connection, 'ix_report_created', 'report', ['created_at'])
+    create_index(connection, 'ix_report_reporter', 'report', ['reporter_id', 'reported_user_id', 'status'])
+
+    # Пользователи: недавно заходившие и регистрации по дням
+    create_index(connection, 'ix_user_online', 'user', ['is_online', 'last_seen'])
+    create_index(connection, 'ix_user_last_seen', 'user', ['last_seen'])
+    create_index(connection, 'ix_user_created', 'user', ['created_at'])
+
+
+@migration(5, 'reaction_counts')
+def reaction_counts(connection):
+    """Заполняет счетчики реакций по уже поставленным реакциям"""
+    create_index(connection, 'uq_message_reaction_count', 'message_reaction_count', ['message_id', 'emoji'], unique=True)
+    connection.execute(text("""
+        INSERT INTO message_reaction_count (message_id, emoji, count)
+        SELECT message_id, emoji, COUNT(*) FROM message_reaction
+        GROUP BY message_id, emoji
+        ON CONFLICT (message_id, emoji) DO NOTHING
+    """))
+
+
+@migration(6, 'message_versions')
+def message_versions(connection):
+    """Версия сообщения для событий правки и удаления"""
+    add_column(connection, 'message', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def ensure_version_table(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    """))
+
+
+def applied_versions(connection):
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_version'))}
+
+
+def run_migrations(engine, metadata=None, log=print):
+    """Применяет недостающие миграции по порядку; каждая - в своей транзакции
+
+    Возвращает список примененных номеров.
+    """
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        if metadata is not None:
+            metadata.create_all(connection)
+        done = applied_versions(connection)
+
+    applied = []
+    for version, name, func in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(
+                text('INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+            )
+        applied.append(version)
+        log(f"✅ Миграция {version:03d} {name} применена")
+    return applied
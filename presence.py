@@ -0,0 +1,139 @@
+"""
+Реестр присутствия пользователей Nexa Messenger
+
+Каждая вкладка (подключение Socket.IO) увеличивает счетчик пользователя
+в памяти воркера, поэтому статус меняется только при первом подключении
+и последнем отключении. Время last_seen копится в памяти и записывается
+в базу пачками.
+
+Воркеров может быть несколько (см. socket_queue.py), и каждый видит
+только свои подключения. Поэтому при записи пачки воркер сохраняет
+свои счетчики в общую таблицу подключений и продлевает их пульсом, а
+обратно читает, кто в сети у других воркеров (remote). Статус "в сети" -
+свои подключения или remote; колонка user.is_online считается по общей
+таблице, а не по подключениям одного воркера. Подключения у других
+воркеров видны с задержкой до одного интервала записи; строки воркера,
+который перестал продлевать пульс, истекают через EXPIRY_INTERVALS
+интервалов.
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+EXPIRY_INTERVALS = 3
+
+
+class PresenceRegistry:
+    def __init__(self, flush_interval=30, worker_id=None):
+        self.flush_interval = flush_interval
+        self.worker_id = worker_id
+        self.lock = threading.Lock()
+        self.connections = {}   # user_id -> число открытых подключений
+        self.pending = {}       # user_id -> last_seen, еще не записанный в базу
+        self.changed = set()    # user_id, чей счетчик подключений еще не записан в базу
+        self.remote = frozenset()  # user_id в сети у других воркеров (по последней записи)
+        self.flusher_pid = None
+
+    @property
+    def worker(self):
+        """Имя воркера в общей таблице; pid читается каждый раз - после fork он другой"""
+        return self.worker_id or f'{socket.gethostname()}:{os.getpid()}'
+
+    def connect(self, user_id):
+        """Регистрирует подключение; возвращает True, если пользователь стал онлайн"""
+        with self.lock:
+            count = self.connections.get(user_id, 0) + 1
+            self.connections[user_id] = count
+            self.pending[user_id] = datetime.utcnow()
+            self.changed.add(user_id)
+            return count == 1 and user_id not in self.remote
+
+    def disconnect(self, user_id):
+        """Снимает подключение; возвращает True, если пользователь ушел из сети"""
+        with self.lock:
+            count = self.connections.get(user_id, 0) - 1
+            if count > 0:
+                self.connections[user_id] = count
+            else:
+                self.connections.pop(user_id, None)
+            self.pending[user_id] = datetime.utcnow()
+            self.changed.add(user_id)
+            return count == 0 and user_id not in self.remote
+
+    def disconnect_all(self):
+        """Снимает все подключения воркера (при остановке процесса)"""
+        with self.lock:
+            self.changed.update(self.connections)
+            self.connections = {}
+
+    def touch(self, user_id):
+        """Отмечает активность пользователя без изменения статуса"""
+        with self.lock:
+            self.pending[user_id] = datetime.utcnow()
+
+    def is_online(self, user_id):
+        return user_id in self.connections or user_id in self.remote
+
+    def online_ids(self):
+        with self.lock:
+            return set(self.connections) | self.remote
+
+    def online_count(self):
+        return len(self.online_ids())
+
+    def drain(self):
+        """Забирает накопленные обновления для записи в базу
+
+        Возвращает (last_seen, connections): строки {'id', 'last_seen'} и
+        {user_id: число подключений у этого воркера} для изменившихся счетчиков.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            changed, self.changed = self.changed, set()
+            connections = {user_id: self.connections.get(user_id, 0) for user_id in changed}
+        rows = [{'id': user_id, 'last_seen': last_seen} for user_id, last_seen in pending.items()]
+        return rows, connections
+
+    def restore(self, rows, connections):
+        """Возвращает обновления в очередь, если запись в базу не удалась"""
+        with self.lock:
+            for row in rows:
+                self.pending.setdefault(row['id'], row['last_seen'])
+            # Счетчик перечитывается из памяти при следующей записи
+            self.changed.update(connections)
+
+    def set_remote(self, user_ids):
+        """Запоминает, кто в сети у других воркеров"""
+        self.remote = frozenset(user_ids)
+
+    def close(self, flush):
+        """Снимает подключения воркера и записывает изменения (при остановке процесса)"""
+        self.disconnect_all()
+        with self.lock:
+            if not self.changed and not self.pending:
+                return
+        flush()
+
+    def start_flusher(self, flush, start_background_task):
+        """Запускает периодическую запись last_seen (один раз на процесс)
+
+        Вместе с ней регистрируется запись при выходе: только в процессах,
+        которые обслуживают подключения, а не во всех, что импортируют app.
+        """
+        with self.lock:
+            # После fork воркера gunicorn поток мастера не существует
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        atexit.register(self.close, flush)
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                flush()
+
+        start_background_task(run)
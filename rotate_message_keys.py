@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Ротация ключей шифрования сообщений Nexa Messenger
+
+1. Сгенерируйте новый ключ:           python rotate_message_keys.py --new-key
+2. Поставьте его первым в MESSAGE_ENCRYPTION_KEYS (старые ключи оставьте после него)
+   и перезапустите сервер - новые сообщения шифруются новым ключом
+3. Перешифруйте историю:               python rotate_message_keys.py
+4. Когда перешифровка завершена, старые ключи можно убрать из списка
+"""
+
+import sys
+
+from cryptography.fernet import Fernet
+
+
+def main():
+    """Основная функция"""
+    if '--new-key' in sys.argv:
+        print(Fernet.generate_key().decode())
+        return
+
+    from app import app, message_keys, reencrypt_messages
+
+    batch_size = 500
+    for arg in sys.argv[1:]:
+        if arg.startswith('--batch-size='):
+            batch_size = int(arg.split('=', 1)[1])
+
+    print("🔐 Перешифровка сообщений")
+    print("=" * 50)
+    print(f"🔑 Основной ключ: {message_keys.primary_id}")
+
+    def progress(last_id, updated):
+        print(f"   ... обработано до id {last_id}, перешифровано: {updated}")
+
+    with app.app_context():
+        updated = reencrypt_messages(batch_size=batch_size, progress=progress)
+
+    print(f"\n✅ Перешифровано сообщений: {updated}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Общая шина Socket.IO для нескольких воркеров и серверов Nexa Messenger
+
+Адрес шины задается переменной окружения SOCKETIO_MESSAGE_QUEUE:
+    redis://, rediss://, kafka://, amqp://  - штатные менеджеры Flask-SocketIO
+    local://127.0.0.1:5680                  - ретранслятор на локальном TCP-сокете,
+                                              не требует внешних сервисов
+    memory://                               - шина внутри одного процесса (для тестов)
+"""
+
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+DEFAULT_CHANNEL = 'flask-socketio'
+DEFAULT_LOCAL_PORT = 5680
+
+_FRAME_HEADER = struct.Struct('!I')
+
+
+def socketio_queue_options(url, channel=DEFAULT_CHANNEL):
+    """Возвращает параметры SocketIO(...) для заданного адреса шины"""
+    if not url:
+        return {}
+
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return {'client_manager': MemoryManager(url, channel=channel)}
+    if scheme == 'local':
+        return {'client_manager': LocalSocketManager(url, channel=channel)}
+
+    # Redis, Kafka, AMQP и т.д. Flask-SocketIO подключает сам
+    return {'message_queue': url, 'channel': channel}
+
+
+class MemoryHub:
+    """Раздает опубликованные сообщения всем подписчикам канала в пределах процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, []))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+
+memory_hub = MemoryHub()
+
+
+class MemoryManager(socketio.PubSubManager):
+    """Менеджер клиентов, разделяющий комнаты между серверами одного процесса"""
+    name = 'memory'
+
+    def __init__(self, url='memory://', channel=DEFAULT_CHANNEL, write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.subscription = None if write_only else memory_hub.subscribe(channel)
+
+    def _publish(self, data):
+        # Сериализуем, чтобы получатели не делили изменяемые объекты с отправителем
+        memory_hub.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self.subscription.get()
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Соединение с ретранслятором закрыто')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_frame(sock):
+    (size,) = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return _recv_exact(sock, size)
+
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """Ретранслятор: пересылает каждый кадр всем остальным подключенным воркерам"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        self.peers = set()
+        self.peers_lock = threading.Lock()
+        super().__init__(address, LocalBrokerHandler)
+
+    def relay(self, sender, frame):
+        with self.peers_lock:
+            peers = [peer for peer in self.peers if peer is not sender]
+        for peer in peers:
+            try:
+                _send_frame(peer, frame)
+            except OSError:
+                with self.peers_lock:
+                    self.peers.discard(peer)
+
+
+class LocalBrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        with self.server.peers_lock:
+            self.server.peers.add(self.request)
+        try:
+            while True:
+                self.server.relay(self.request, _recv_frame(self.request))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.server.peers_lock:
+                self.server.peers.discard(self.request)
+
+
+class LocalSocketManager(socketio.PubSubManager):
+    """Менеджер клиентов поверх ретранслятора на локальном TCP-сокете
+
+    Первый воркер, сумевший занять порт, поднимает ретранслятор у себя,
+    остальные подключаются к нему. Если владелец порта перезапускается,
+    его место занимает следующий переподключившийся воркер.
+    """
+    name = 'local'
+    reconnect_delay = 0.5
+
+    def __init__(self, url='local://127.0.0.1:%d' % DEFAULT_LOCAL_PORT, channel=DEFAULT_CHANNEL,
+                 write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or '127.0.0.1', parsed.port or DEFAULT_LOCAL_PORT)
+        self.broker = None
+        self.sock = None
+        self.send_lock = threading.Lock()
+
+    def _start_broker(self):
+        """Пытается стать ретранслятором; если порт занят - он уже есть у другого воркера"""
+        try:
+            broker = LocalBroker(self.address)
+        except OSError:
+            return
+        self.broker = broker
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+
+    def _connect(self):
+        # Подключаемся лениво: при preload_app менеджер создается еще в мастере gunicorn
+        if self.broker is None:
+            self._start_broker()
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _publish(self, data):
+        frame = json.dumps({'channel': self.channel, 'message': self.json.dumps(data)}).encode()
+        with self.send_lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.sock = self._connect()
+                    _send_frame(self.sock, frame)
+                    return
+                except OSError as e:
+                    self._close()
+                    if attempt:
+                        # Как менеджеры Redis и Kombu: событие теряется, но запись,
+                        # после которой его отправляли, уже сохранена - запрос не падает
+                        self._get_logger().error('Шина Socket.IO недоступна, событие не отправлено: %s', e)
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _listen(self):
+        while True:
+            sock = None
+            try:
+                with self.send_lock:
+                    if self.sock is None:
+                        self.sock = self._connect()
+                    sock = self.sock
+                while True:
+                    envelope = json.loads(_recv_frame(sock))
+                    if envelope.get('channel') == self.channel:
+                        yield envelope['message']
+            except (ConnectionError, OSError):
+                with self.send_lock:
+                    if self.sock is sock:
+                        self._close()
+                time.sleep(self.reconnect_delay)
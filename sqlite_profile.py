@@ -0,0 +1,121 @@
+"""
+Профиль SQLite для продакшена Nexa Messenger
+
+- WAL: читатели не блокируют писателя и наоборот
+- synchronous=NORMAL: в режиме WAL безопасно, fsync только на контрольных точках
+- busy_timeout: вместо мгновенного "database is locked" ждем освобождения
+- mmap_size и cache_size: горячие страницы читаются из памяти
+
+Прагмы ставятся на каждое новое соединение пула (событие connect).
+
+SQLite допускает одного писателя за раз. WriterQueue - один поток,
+выполняющий задания по очереди: при SQLITE_WRITER_QUEUE=1 через него
+идет отправка сообщений, и обработчики не конкурируют за блокировку
+файла. По умолчанию очередь выключена: задания не объединяются в
+пачки, и на замерах (python test_sqlite_profile.py) она медленнее
+прямой записи с busy_timeout.
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,          # мс
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,      # отрицательное значение - в КиБ (64 МБ)
+    'temp_store': 'MEMORY',
+}
+
+
+def is_sqlite_file(url):
+    """True для файловой базы SQLite (для базы в памяти профиль не нужен)"""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def sqlite_engine_options():
+    """Параметры движка для файловой базы SQLite (SQLALCHEMY_ENGINE_OPTIONS)"""
+    return {
+        'connect_args': {
+            # Таймаут драйвера совпадает с busy_timeout
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            # Соединения пула используются разными потоками обработчиков
+            'check_same_thread': False,
+        },
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_pre_ping': False,
+    }
+
+
+def apply_pragmas(engine, pragmas=None):
+    """Ставит прагмы на каждое новое соединение движка"""
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    return set_pragmas
+
+
+class WriterQueue:
+    """Очередь записи: задания выполняются по одному в отдельном потоке
+
+    wrap - фабрика контекста, в котором выполняется каждое задание
+    (например, app.app_context, чтобы у задания была своя сессия).
+    """
+
+    def __init__(self, wrap=None, name='sqlite-writer'):
+        self.wrap = wrap
+        self.name = name
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Ставит задание в очередь; возвращает Future с результатом"""
+        future = Future()
+        self.start()
+        self.jobs.put((future, func, args, kwargs))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """Выполняет задание в потоке записи и ждет результата"""
+        if threading.current_thread() is self.thread:
+            # Задание из самого потока записи выполняется сразу, иначе - взаимоблокировка
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self.wrap is not None:
+                    with self.wrap():
+                        result = func(*args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,490 @@
+// Админ-панель: статистика, пользователи и модерация
+
+let currentPage = 1;
+let totalPages = 1;
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Загружаем статистику
+    loadStatistics();
+
+    // Загружаем пользователей
+    loadUsers();
+
+    // Инициализируем график
+    initChart();
+});
+
+function loadStatistics() {
+    const days = document.getElementById('stats-range').value;
+    fetch(`/admin/statistics?days=${days}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'error') {
+                showError(data.message);
+                return;
+            }
+
+            updateChart(data);
+        })
+        .catch(error => {
+            console.error('Ошибка загрузки статистики:', error);
+        });
+}
+
+function loadUsers(page = 1) {
+    const search = document.getElementById('user-search').value;
+
+    fetch(`/admin/users?page=${page}&search=${encodeURIComponent(search)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'error') {
+                showError(data.message);
+                return;
+            }
+
+            displayUsers(data.users);
+            updatePagination(data.current_page, data.pages, data.total);
+            currentPage = data.current_page;
+            totalPages = data.pages;
+        })
+        .catch(error => {
+            console.error('Ошибка загрузки пользователей:', error);
+        });
+}
+
+function displayUsers(users) {
+    const tbody = document.getElementById('users-tbody');
+    tbody.innerHTML = '';
+
+    users.forEach(user => {
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td><strong>#${user.id}</strong></td>
+            <td>
+                <div class="user-avatar-small" onclick="viewUserProfile('${user.username}')" title="Посмотреть профиль">
+                    ${user.avatar_url
+                        ? `<img src="${user.avatar_url}" alt="Avatar">` 
+                        : '<i class="fas fa-user"></i>'}
+                    <span class="status-indicator ${user.is_online ? 'online' : 'offline'}"></span>
+                </div>
+            </td>
+            <td>${user.display_name}</td>
+            <td>@${user.username}</td>
+            <td>${user.email}</td>
+            <td>
+                <span class="status-badge ${user.status}">
+                    ${getStatusText(user.status)} ${user.custom_status ? `(${user.custom_status})` : ''}
+                </span>
+            </td>
+            <td>
+                <span class="online-indicator ${user.is_online ? 'online' : 'offline'}">
+                    ${user.is_online ? '🟢' : '⚫'}
+                </span>
+            </td>
+            <td>
+                <span class="admin-badge ${user.is_admin ? 'admin' : 'user'}">
+                    ${user.is_admin ? '👑 Админ' : '👤 Пользователь'}
+                </span>
+            </td>
+            <td>
+                ${user.is_banned ? 
+                    `<span class="ban-badge">
+                        🚫 Заблокирован<br>
+                        <small>${user.ban_reason}</small>
+                        ${user.ban_until ? `<br><small>До: ${user.ban_until}</small>` : '<br><small>Навсегда</small>'}
+                    </span>` : 
+                    '<span class="status-ok">✅ Активен</span>'
+                }
+            </td>
+            <td>${user.created_at}</td>
+            <td>
+                <button class="btn btn-sm btn-secondary" onclick="viewUser(${user.id})">
+                    <i class="fas fa-eye"></i>
+                </button>
+                <button class="btn btn-sm btn-warning" onclick="toggleAdmin(${user.id})">
+                    <i class="fas fa-shield-alt"></i>
+                </button>
+                <button class="btn btn-sm btn-warning" onclick="warnUser(${user.id}, '${user.username}')" title="Выдать предупреждение">
+                    ⚠️
+                </button>
+                ${user.is_banned ? 
+                    `<button class="btn btn-sm btn-success" onclick="unbanUser(${user.id})">
+                        <i class="fas fa-unlock"></i>
+                    </button>` : 
+                    `<button class="btn btn-sm btn-danger" onclick="banUser(${user.id})">
+                        <i class="fas fa-ban"></i>
+                    </button>`
+                }
+                <button class="btn btn-sm btn-danger" onclick="deleteUser(${user.id})">
+                    <i class="fas fa-trash"></i>
+                </button>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-warning" onclick="reportUser(${user.id}, '${user.username}')">
+                    🚩 Пожаловаться
+                </button>
+            </td>
+        `;
+        tbody.appendChild(row);
+    });
+}
+
+function updatePagination(currentPage, totalPages, totalUsers) {
+    const pagination = document.getElementById('pagination');
+
+    if (totalPages <= 1) {
+        pagination.innerHTML = '';
+        return;
+    }
+
+    let html = '<div class="pagination-info">';
+    html += `Показано ${((currentPage - 1) * 20) + 1}-${Math.min(currentPage * 20, totalUsers)} из ${totalUsers}`;
+    html += '</div>';
+
+    html += '<div class="pagination-controls">';
+
+    if (currentPage > 1) {
+        html += `<button class="btn btn-sm" onclick="loadUsers(${currentPage - 1})">← Предыдущая</button>`;
+    }
+
+    for (let i = Math.max(1, currentPage - 2); i <= Math.min(totalPages, currentPage + 2); i++) {
+        html += `<button class="btn btn-sm ${i === currentPage ? 'btn-primary' : ''}" onclick="loadUsers(${i})">${i}</button>`;
+    }
+
+    if (currentPage < totalPages) {
+        html += `<button class="btn btn-sm" onclick="loadUsers(${currentPage + 1})">Следующая →</button>`;
+    }
+
+    html += '</div>';
+    pagination.innerHTML = html;
+}
+
+function getStatusText(status) {
+    const statusMap = {
+        'online': '🟢 В сети',
+        'away': '🟡 Отошел',
+        'busy': '🔴 Занят',
+        'dnd': '🚫 Не беспокоить'
+    };
+    return statusMap[status] || status;
+}
+
+function viewUser(userId) {
+    // Здесь можно добавить загрузку детальной информации о пользователе
+    showInfo('Функция просмотра пользователя в разработке');
+}
+
+function toggleAdmin(userId) {
+    if (confirm('Изменить права администратора для этого пользователя?')) {
+        fetch(`/api/user/${userId}/toggle_admin`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                showInfo(data.message);
+                loadUsers(currentPage); // Перезагружаем список
+            } else {
+                showError(data.message);
+            }
+        })
+        .catch(error => {
+            console.error('Ошибка:', error);
+            showError('Ошибка при изменении прав');
+        });
+    }
+}
+
+function banUser(userId) {
+    const reason = prompt('Причина блокировки:');
+    if (!reason) return;
+
+    const duration = prompt('Длительность в минутах (0 = навсегда):');
+    if (duration === null) return;
+
+    const durationNum = parseInt(duration) || 0;
+
+    fetch(`/api/user/${userId}/ban`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            reason: reason,
+            duration: durationNum
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            showInfo(data.message);
+            loadUsers(currentPage);
+        } else {
+            showError(data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Ошибка:', error);
+        showError('Ошибка при блокировке');
+    });
+}
+
+function unbanUser(userId) {
+    if (confirm('Разблокировать пользователя?')) {
+        fetch(`/api/user/${userId}/unban`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                showInfo(data.message);
+                loadUsers(currentPage);
+            } else {
+                showError(data.message);
+            }
+        })
+        .catch(error => {
+            console.error('Ошибка:', error);
+            showError('Ошибка при разблокировке');
+        });
+    }
+}
+
+function deleteUser(userId) {
+    if (confirm('УДАЛИТЬ пользователя? Это действие нельзя отменить!')) {
+        fetch(`/api/user/${userId}/delete`, {
+            method: 'DELETE',
+            headers: {
+                'Content-Type': 'application/json',
+            }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                showInfo(data.message);
+                loadUsers(currentPage);
+            } else {
+                showError(data.message);
+            }
+        })
+        .catch(error => {
+            console.error('Ошибка:', error);
+            showError('Ошибка при удалении');
+        });
+    }
+}
+
+function viewReport(reportId) {
+    // Здесь можно добавить просмотр жалобы
+    showInfo('Функция просмотра жалобы в разработке');
+}
+
+function initChart() {
+    const ctx = document.getElementById('statsChart').getContext('2d');
+    window.statsChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: [],
+            datasets: [{
+                label: 'Новые пользователи',
+                data: [],
+                borderColor: '#00d4ff',
+                backgroundColor: 'rgba(0, 212, 255, 0.1)',
+                tension: 0.4
+            }, {
+                label: 'Сообщения',
+                data: [],
+                borderColor: '#ff6b9d',
+                backgroundColor: 'rgba(255, 107, 157, 0.1)',
+                tension: 0.4
+            }]
+        },
+        options: {
+            responsive: true,
+            plugins: {
+                legend: {
+                    position: 'top',
+                }
+            },
+            scales: {
+                y: {
+                    beginAtZero: true
+                }
+            }
+        }
+    });
+}
+
+function updateChart(data) {
+    if (window.statsChart) {
+        window.statsChart.data.labels = data.dates;
+        window.statsChart.data.datasets[0].data = data.user_counts;
+        window.statsChart.data.datasets[1].data = data.message_counts;
+        window.statsChart.update();
+    }
+}
+
+function closeUserModal() {
+    document.getElementById('user-modal').style.display = 'none';
+}
+
+function reportUser(userId, username) {
+    document.getElementById('report-user-id').value = userId;
+    document.getElementById('report-username').textContent = username;
+    document.getElementById('report-modal').style.display = 'block';
+}
+
+function viewUserProfile(username) {
+    window.open(`/profile/${username}`, '_blank');
+}
+
+function closeReportModal() {
+    document.getElementById('report-modal').style.display = 'none';
+}
+
+function warnUser(userId, username) {
+    document.getElementById('warn-user-id').value = userId;
+    document.getElementById('warn-username').textContent = username;
+    document.getElementById('warn-modal').style.display = 'block';
+}
+
+function closeWarnModal() {
+    document.getElementById('warn-modal').style.display = 'none';
+}
+
+function banUser(userId, username) {
+    document.getElementById('ban-user-id').value = userId;
+    document.getElementById('ban-username').textContent = username;
+    document.getElementById('ban-modal').style.display = 'block';
+}
+
+function closeBanModal() {
+    document.getElementById('ban-modal').style.display = 'none';
+}
+
+function submitReport() {
+    const userId = document.getElementById('report-user-id').value;
+    const reason = document.getElementById('report-reason').value;
+    const description = document.getElementById('report-description').value;
+    const evidence = document.getElementById('report-evidence').value;
+
+    if (!reason || !description) {
+        showError('Пожалуйста, заполните причину и описание');
+        return;
+    }
+
+    const reportData = {
+        reported_user_id: userId,
+        reason: reason,
+        description: description,
+        evidence: evidence
+    };
+
+    fetch('/api/report', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(reportData)
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            showInfo('Жалоба отправлена успешно!');
+            closeReportModal();
+            // Очищаем форму
+            document.getElementById('report-reason').value = '';
+            document.getElementById('report-description').value = '';
+            document.getElementById('report-evidence').value = '';
+        } else {
+            showError(data.message || 'Ошибка при отправке жалобы');
+        }
+    })
+    .catch(error => {
+        console.error('Ошибка:', error);
+        showError('Ошибка при отправке жалобы');
+    });
+}
+
+function submitWarn() {
+    const userId = document.getElementById('warn-user-id').value;
+    const reason = document.getElementById('warn-reason').value;
+
+    if (!reason) {
+        showError('Укажите причину предупреждения');
+        return;
+    }
+
+    fetch(`/api/user/${userId}/warn`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            reason: reason
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            showSuccess(data.message);
+            closeWarnModal();
+            loadUsers(currentPage); // Обновляем список пользователей
+        } else {
+            showError(data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Ошибка:', error);
+        showError('Произошла ошибка при выдаче предупреждения');
+    });
+}
+
+function submitBan() {
+    const userId = document.getElementById('ban-user-id').value;
+    const duration = parseInt(document.getElementById('ban-duration').value);
+    const reason = document.getElementById('ban-reason').value;
+
+    if (!reason) {
+        showError('Укажите причину блокировки');
+        return;
+    }
+
+    fetch(`/api/user/${userId}/ban`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            reason: reason,
+            duration: duration
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            showSuccess(data.message);
+            closeBanModal();
+            loadUsers(currentPage); // Обновляем список пользователей
+        } else {
+            showError(data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Ошибка:', error);
+        showError('Произошла ошибка при блокировке пользователя');
+        });
+}
+
+// Поиск при нажатии Enter
+document.getElementById('user-search').addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') {
+        loadUsers(1);
+    }
+});
@@ -0,0 +1,878 @@
+// Чат: диалоги, сообщения и события WebSocket (шаблон chat.html задает currentUserId и conversationsCursor)
+
+let currentChatUserId = null;
+let loadingConversations = false;
+let socket = null;
+
+// Инициализация WebSocket
+document.addEventListener('DOMContentLoaded', function() {
+    socket = io();
+
+    socket.on('connect', function() {
+        console.log('Подключен к серверу');
+    });
+
+    // Сервер доставляет в комнату user_<id> только сообщения наших диалогов
+    socket.on('new_message', function(data) {
+        const peerId = data.sender_id === currentUserId ? data.receiver_id : data.sender_id;
+        if (String(peerId) === String(currentChatUserId)) {
+            data.is_own = data.sender_id === currentUserId;
+            displayMessage(data);
+            if (!data.is_own) {
+                markRead(peerId, data.id);
+            }
+        } else if (data.sender_id !== currentUserId) {
+            if (document.querySelector(`.user-item[data-user-id="${peerId}"]`)) {
+                setUnreadBadge(peerId, getUnreadBadge(peerId) + 1);
+            } else if (!document.getElementById('user-search').value.trim()) {
+                // Новый собеседник - обновляем список диалогов
+                loadConversations(true);
+            }
+        }
+    });
+
+    // Прочтение в другой вкладке
+    socket.on('read_state', function(data) {
+        if (data.kind === 'dm') {
+            setUnreadBadge(data.target_id, data.unread_count);
+        }
+    });
+
+    socket.on('user_status', function(data) {
+        updateUserStatus(data.user_id, data.status);
+    });
+
+    socket.on('typing_start', function(data) {
+        if (String(data.user_id) === String(currentChatUserId)) {
+            showTypingIndicator();
+        }
+    });
+
+    socket.on('typing_stop', function(data) {
+        if (String(data.user_id) === String(currentChatUserId)) {
+            hideTypingIndicator();
+        }
+    });
+
+    socket.on('message_notification', function(data) {
+        showMessageNotification(data);
+    });
+
+    socket.on('reaction_update', function(data) {
+        setReactions(data.message_id, data.reactions);
+    });
+
+    // Правки и удаления применяются на месте, без перезагрузки истории
+    socket.on('message_edited', applyMessageEdit);
+    socket.on('message_deleted', applyMessageDelete);
+
+    // Сообщение из очереди групповой записи не удалось сохранить
+    socket.on('message_failed', function(data) {
+        alert('Сообщение не отправлено. Попробуйте еще раз.');
+    });
+
+    // Значки непрочитанных всех диалогов одним запросом
+    loadUnreadBadges();
+
+    // Инициализация поиска пользователей
+    setupUserSearch();
+
+    // Инициализация индикатора печати
+    setupTypingIndicator();
+
+    // Инициализация мобильного меню
+    setupMobileMenu();
+
+    // Запрашиваем разрешение на уведомления
+    requestNotificationPermission();
+});
+
+// Обработка клика по пользователю
+document.querySelectorAll('.user-item').forEach(item => {
+    item.addEventListener('click', function() {
+        const userId = this.dataset.userId;
+        const username = this.dataset.username;
+
+        // Убираем активный класс у всех пользователей
+        document.querySelectorAll('.user-item').forEach(u => u.classList.remove('active'));
+        // Добавляем активный класс текущему пользователю
+        this.classList.add('active');
+
+        currentChatUserId = userId;
+        document.getElementById('current-chat-user').textContent = username;
+
+        // Активируем поле ввода
+        document.getElementById('message-input').disabled = false;
+        document.getElementById('send-button').disabled = false;
+
+        // Загружаем сообщения
+        loadMessages(userId);
+    });
+});
+
+// Загрузка сообщений: сначала последняя страница, более старые - при прокрутке вверх
+let oldestMessageId = null;
+let hasMoreMessages = false;
+let loadingOlderMessages = false;
+
+function loadMessages(userId) {
+    fetch(`/api/messages/${userId}`)
+        .then(response => response.json())
+        .then(page => {
+            const chatMessages = document.getElementById('chat-messages');
+            chatMessages.innerHTML = '';
+            oldestMessageId = page.oldest_id;
+            hasMoreMessages = page.has_more;
+
+            if (page.messages.length === 0) {
+                chatMessages.innerHTML = '<div class="no-messages">Нет сообщений. Начните разговор первым!</div>';
+            } else {
+                page.messages.forEach(message => {
+                    displayMessage(message);
+                });
+            }
+
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+
+            if (page.newest_id) {
+                markRead(userId, page.newest_id);
+            }
+        });
+}
+
+// Счетчики непрочитанных
+function loadUnreadBadges() {
+    fetch('/api/unread')
+        .then(response => response.json())
+        .then(data => {
+            Object.entries(data.dialogs).forEach(([userId, count]) => setUnreadBadge(userId, count));
+        });
+}
+
+function getUnreadBadge(userId) {
+    const badge = document.querySelector(`.user-item[data-user-id="${userId}"] .unread-badge`);
+    return badge ? parseInt(badge.textContent || '0') : 0;
+}
+
+function setUnreadBadge(userId, count) {
+    const badge = document.querySelector(`.user-item[data-user-id="${userId}"] .unread-badge`);
+    if (badge) {
+        badge.textContent = count > 0 ? count : '';
+        badge.style.display = count > 0 ? 'inline-block' : 'none';
+    }
+}
+
+function markRead(userId, messageId) {
+    setUnreadBadge(userId, 0);
+    fetch('/api/read', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ user_id: parseInt(userId), message_id: messageId })
+    });
+}
+
+function loadOlderMessages() {
+    if (!currentChatUserId || !hasMoreMessages || loadingOlderMessages) {
+        return;
+    }
+
+    loadingOlderMessages = true;
+    const userId = currentChatUserId;
+    fetch(`/api/messages/${userId}?before_id=${oldestMessageId}`)
+        .then(response => response.json())
+        .then(page => {
+            if (userId !== currentChatUserId) {
+                return;
+            }
+
+            const chatMessages = document.getElementById('chat-messages');
+            const previousHeight = chatMessages.scrollHeight;
+
+            // Вставляем от новых к старым, чтобы сохранить порядок
+            page.messages.slice().reverse().forEach(message => {
+                displayMessage(message, true);
+            });
+
+            oldestMessageId = page.oldest_id || oldestMessageId;
+            hasMoreMessages = page.has_more;
+
+            // Сохраняем позицию прокрутки после вставки
+            chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+        })
+        .finally(() => {
+            loadingOlderMessages = false;
+        });
+}
+
+document.getElementById('chat-messages').addEventListener('scroll', function() {
+    if (this.scrollTop < 50) {
+        loadOlderMessages();
+    }
+});
+
+// Отображение сообщения
+function displayMessage(message, prepend = false) {
+    const chatMessages = document.getElementById('chat-messages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${message.is_own ? 'own' : 'other'}`;
+    messageDiv.dataset.messageId = message.id;
+    messageDiv.dataset.version = message.version || 1;
+
+    // Добавляем имя отправителя для чужих сообщений
+    const senderName = message.is_own ? 'Вы' : (message.sender_name || 'Пользователь');
+
+    // HTML для ответа на сообщение
+    let replyHtml = '';
+    if (message.reply_to_id && message.reply_to_content) {
+        replyHtml = `
+            <div class="message-reply">
+                <i class="fas fa-reply"></i>
+                <span>${message.reply_to_content}</span>
+            </div>
+        `;
+    }
+
+    // HTML для индикатора редактирования
+    let editedHtml = '';
+    if (message.is_edited) {
+        editedHtml = '<span class="edited-indicator">(изменено)</span>';
+    }
+
+    // HTML для реакций
+    const reactionsHtml = renderReactions(message.id, message.reactions);
+
+    messageDiv.innerHTML = `
+        <div class="message-content">
+            ${!message.is_own ? `
+                <div class="message-sender">
+                    <div class="sender-avatar" onclick="viewUserProfile('${message.sender_username}')" title="Посмотреть профиль">
+                        <i class="fas fa-user"></i>
+                    </div>
+                    <span>${senderName}</span>
+                </div>
+            ` : ''}
+            ${replyHtml}
+            <div class="message-text">${message.content}</div>
+            ${renderAttachments(message.attachments)}
+            <div class="message-footer">
+                <span class="message-time">${message.timestamp}</span>
+                ${editedHtml}
+            </div>
+            ${reactionsHtml}
+            <div class="message-actions">
+                <button type="button" class="action-btn" onclick="replyToMessage(${message.id}, '${message.content}')">
+                    <i class="fas fa-reply"></i>
+                </button>
+                <button type="button" class="action-btn" onclick="showReactions(${message.id})">
+                    <i class="fas fa-smile"></i>
+                </button>
+                ${!message.is_own ? `
+                    <button type="button" class="action-btn" onclick="viewUserProfile('${message.sender_username}')" title="Посмотреть профиль">
+                        <i class="fas fa-user"></i>
+                    </button>
+                    <button type="button" class="action-btn" onclick="reportUserFromChat(${message.id}, '${message.sender_username}')" title="Пожаловаться">
+                        🚩
+                    </button>
+                ` : ''}
+                ${message.is_own ? `
+                    <button type="button" class="action-btn" onclick="editMessage(${message.id})">
+                        <i class="fas fa-edit"></i>
+                    </button>
+                    <button type="button" class="action-btn" onclick="deleteMessage(${message.id})">
+                        <i class="fas fa-trash"></i>
+                    </button>
+                ` : ''}
+            </div>
+        </div>
+    `;
+
+    if (prepend) {
+        chatMessages.insertBefore(messageDiv, chatMessages.firstChild);
+        return;
+    }
+
+    chatMessages.appendChild(messageDiv);
+
+    // Плавная прокрутка к новому сообщению
+    setTimeout(() => {
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }, 100);
+
+    // Добавляем анимацию появления
+    messageDiv.style.opacity = '0';
+    messageDiv.style.transform = 'translateY(10px)';
+    setTimeout(() => {
+        messageDiv.style.transition = 'all 0.3s ease';
+        messageDiv.style.opacity = '1';
+        messageDiv.style.transform = 'translateY(0)';
+    }, 50);
+}
+
+// Отправка сообщения
+document.getElementById('message-form').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    const input = document.getElementById('message-input');
+    const message = input.value.trim();
+
+    if ((message || pendingAttachments.length) && currentChatUserId) {
+        // Отправляем через WebSocket
+        socket.emit('send_message', {
+            receiver_id: currentChatUserId,
+            content: message,
+            attachment_ids: takeAttachments()
+        });
+
+        // Очищаем поле ввода
+        input.value = '';
+        stopTyping();
+    }
+});
+
+// Обновление статуса пользователя
+function updateUserStatus(userId, status) {
+    const userItem = document.querySelector(`[data-user-id="${userId}"]`);
+    if (userItem) {
+        const statusIndicator = userItem.querySelector('.status-indicator');
+        const statusText = userItem.querySelector('.status-text');
+
+        statusIndicator.className = `status-indicator ${status}`;
+        statusText.className = `status-text ${status}`;
+        statusText.textContent = status === 'online' ? 'В сети' : 'Не в сети';
+    }
+}
+
+// Поиск пользователей
+function setupUserSearch() {
+    const searchInput = document.getElementById('user-search');
+    const clearButton = document.getElementById('clear-search');
+    const usersList = document.getElementById('users-list');
+
+    let searchTimeout;
+
+    searchInput.addEventListener('input', function() {
+        const query = this.value.trim();
+
+        if (clearButton) {
+            clearButton.style.display = query ? 'block' : 'none';
+        }
+
+        clearTimeout(searchTimeout);
+        searchTimeout = setTimeout(() => {
+            if (query) {
+                searchUsers(query);
+            } else {
+                loadConversations(true);
+            }
+        }, 300);
+    });
+
+    if (clearButton) {
+        clearButton.addEventListener('click', function() {
+            searchInput.value = '';
+            this.style.display = 'none';
+            loadConversations(true);
+        });
+    }
+}
+
+function searchUsers(query) {
+    fetch(`/search_users?q=${encodeURIComponent(query)}`)
+        .then(response => response.json())
+        .then(users => {
+            updateUsersList(users);
+        })
+        .catch(error => {
+            console.error('Ошибка поиска:', error);
+        });
+}
+
+function updateUsersList(users) {
+    const usersList = document.getElementById('users-list');
+    usersList.innerHTML = '';
+
+    if (users.length === 0) {
+        usersList.innerHTML = '<div class="no-users">Пользователи не найдены</div>';
+        return;
+    }
+
+    users.forEach(user => {
+        usersList.appendChild(createUserItem(user));
+    });
+}
+
+function createUserItem(user) {
+    const userDiv = document.createElement('div');
+    userDiv.className = 'user-item';
+    userDiv.dataset.userId = user.id;
+    userDiv.dataset.username = user.username;
+
+    userDiv.innerHTML = `
+        <div class="user-avatar" onclick="viewUserProfile('${user.username}')" title="Посмотреть профиль">
+            <i class="fas fa-user"></i>
+            <span class="status-indicator ${user.is_online ? 'online' : 'offline'}"></span>
+        </div>
+        <div class="user-info">
+            <div class="user-name">${user.display_name || user.username}</div>
+            <div class="user-username">@${user.username}</div>
+            <div class="user-status">
+                <span class="status-text ${user.is_online ? 'online' : 'offline'}">
+                    ${user.is_online ? 'В сети' : 'Не в сети'}
+                </span>
+            </div>
+        </div>
+        <div class="user-actions">
+            <button type="button" class="action-btn" onclick="viewUserProfile('${user.username}')" title="Посмотреть профиль">
+                <i class="fas fa-user"></i>
+            </button>
+            <button type="button" class="action-btn" onclick="reportUserFromList('${user.username}')" title="Пожаловаться">
+                🚩
+            </button>
+        </div>
+        <span class="unread-badge" style="display: none;"></span>
+    `;
+
+    // Добавляем обработчик клика
+    userDiv.addEventListener('click', function() {
+        const userId = this.dataset.userId;
+
+        // Убираем активный класс у всех пользователей
+        document.querySelectorAll('.user-item').forEach(u => u.classList.remove('active'));
+        // Добавляем активный класс текущему пользователю
+        this.classList.add('active');
+
+        currentChatUserId = userId;
+        document.getElementById('current-chat-user').textContent = user.display_name || user.username;
+
+        // Активируем поле ввода
+        document.getElementById('message-input').disabled = false;
+        document.getElementById('send-button').disabled = false;
+
+        // Загружаем сообщения
+        loadMessages(userId);
+    });
+
+    return userDiv;
+}
+
+// Список диалогов: следующие страницы догружаются при прокрутке
+function loadConversations(reset = false) {
+    if (loadingConversations || (!reset && !conversationsCursor)) {
+        return;
+    }
+
+    loadingConversations = true;
+    const cursor = reset ? '' : `&cursor=${encodeURIComponent(conversationsCursor)}`;
+    fetch(`/api/conversations?kind=dm${cursor}`)
+        .then(response => response.json())
+        .then(data => {
+            const usersList = document.getElementById('users-list');
+            if (reset) {
+                usersList.innerHTML = '';
+            }
+            data.conversations.forEach(conversation => {
+                usersList.appendChild(createUserItem({
+                    id: conversation.id,
+                    username: conversation.username,
+                    display_name: conversation.name,
+                    is_online: conversation.is_online
+                }));
+                setUnreadBadge(conversation.id, conversation.unread_count);
+            });
+            conversationsCursor = data.next_cursor;
+        })
+        .finally(() => {
+            loadingConversations = false;
+        });
+}
+
+document.getElementById('users-list').addEventListener('scroll', function() {
+    const searching = document.getElementById('user-search').value.trim();
+    if (!searching && this.scrollTop + this.clientHeight > this.scrollHeight - 50) {
+        loadConversations();
+    }
+});
+
+// Индикатор печати: отправляем только начало и конец печати.
+// Если пользователь просто перестал печатать, состояние истекает на сервере
+// (TYPING_TTL, 6 с), поэтому во время долгой печати достаточно редкого продления.
+const TYPING_REFRESH_MS = 3000;
+let typingTarget = null;
+let typingSentAt = 0;
+
+function setupTypingIndicator() {
+    const messageInput = document.getElementById('message-input');
+    if (messageInput) {
+        messageInput.addEventListener('input', function() {
+            if (!currentChatUserId || !this.value) {
+                stopTyping();
+                return;
+            }
+            if (typingTarget !== currentChatUserId) {
+                stopTyping();
+            }
+            const now = Date.now();
+            if (typingTarget === null || now - typingSentAt > TYPING_REFRESH_MS) {
+                socket.emit('typing_start', { receiver_id: currentChatUserId });
+                typingTarget = currentChatUserId;
+                typingSentAt = now;
+            }
+        });
+    }
+}
+
+function stopTyping() {
+    if (typingTarget !== null) {
+        socket.emit('typing_stop', { receiver_id: typingTarget });
+        typingTarget = null;
+    }
+}
+
+function showTypingIndicator() {
+    const indicator = document.getElementById('typing-indicator');
+    if (indicator) {
+        indicator.style.display = 'flex';
+    }
+}
+
+function hideTypingIndicator() {
+    const indicator = document.getElementById('typing-indicator');
+    if (indicator) {
+        indicator.style.display = 'none';
+    }
+}
+
+// Запрос разрешения на уведомления
+function requestNotificationPermission() {
+    if ('Notification' in window && Notification.permission === 'default') {
+        Notification.requestPermission();
+    }
+}
+
+// Уведомления о сообщениях
+function showMessageNotification(data) {
+    // Проверяем поддержку уведомлений
+    if ('Notification' in window && Notification.permission === 'granted') {
+        new Notification(`Новое сообщение от ${data.sender_name}`, {
+            body: data.content,
+            icon: '/static/favicon.ico',
+            badge: '/static/favicon.ico'
+        });
+    }
+
+    // Показываем уведомление в интерфейсе
+    const notification = document.createElement('div');
+    notification.className = 'message-notification';
+    notification.innerHTML = `
+        <div class="notification-content">
+            <i class="fas fa-envelope"></i>
+            <span>${data.sender_name}: ${data.content}</span>
+        </div>
+    `;
+
+    document.body.appendChild(notification);
+
+    // Анимация появления
+    setTimeout(() => {
+        notification.classList.add('show');
+    }, 100);
+
+    // Автоматически убираем через 5 секунд
+    setTimeout(() => {
+        notification.classList.remove('show');
+        setTimeout(() => {
+            if (notification.parentNode) {
+                notification.parentNode.removeChild(notification);
+            }
+        }, 300);
+    }, 5000);
+}
+
+// Мобильное меню
+function setupMobileMenu() {
+    const sidebarToggle = document.getElementById('sidebar-toggle');
+    const chatSidebar = document.querySelector('.chat-sidebar');
+    const isMobile = document.body.classList.contains('device-mobile');
+
+    if (isMobile && sidebarToggle && chatSidebar) {
+        sidebarToggle.style.display = 'block';
+
+        sidebarToggle.addEventListener('click', function() {
+            chatSidebar.classList.toggle('active');
+        });
+
+        // Закрываем меню при клике на пользователя
+        document.addEventListener('click', function(e) {
+            if (e.target.closest('.user-item')) {
+                chatSidebar.classList.remove('active');
+            }
+        });
+
+        // Закрываем меню при клике вне сайдбара
+        document.addEventListener('click', function(e) {
+            if (!e.target.closest('.chat-sidebar') && !e.target.closest('.sidebar-toggle')) {
+                chatSidebar.classList.remove('active');
+            }
+        });
+    }
+}
+
+// Новые функции для ответов, реакций и редактирования
+let currentReplyTo = null;
+
+function replyToMessage(messageId, content) {
+    currentReplyTo = messageId;
+    document.getElementById('reply-preview').style.display = 'block';
+    document.getElementById('reply-text').textContent = content.substring(0, 50) + (content.length > 50 ? '...' : '');
+    document.getElementById('message-input').focus();
+}
+
+function cancelReply() {
+    currentReplyTo = null;
+    document.getElementById('reply-preview').style.display = 'none';
+}
+
+function toggleEmojiPicker() {
+    const picker = document.getElementById('emoji-picker');
+    picker.style.display = picker.style.display === 'none' ? 'block' : 'none';
+}
+
+function addEmoji(emoji) {
+    const input = document.getElementById('message-input');
+    input.value += emoji;
+    input.focus();
+    toggleEmojiPicker();
+}
+
+function editMessage(messageId) {
+    const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+    const messageText = messageDiv.querySelector('.message-text');
+    const currentText = messageText.textContent;
+
+    const input = document.createElement('input');
+    input.type = 'text';
+    input.value = currentText;
+    input.className = 'edit-input';
+
+    const saveBtn = document.createElement('button');
+    saveBtn.textContent = 'Сохранить';
+    saveBtn.className = 'btn btn-primary btn-sm';
+    saveBtn.onclick = () => saveEditedMessage(messageId, input.value);
+
+    const cancelBtn = document.createElement('button');
+    cancelBtn.textContent = 'Отмена';
+    cancelBtn.className = 'btn btn-secondary btn-sm';
+    cancelBtn.onclick = () => cancelEdit(messageDiv, currentText);
+
+    messageText.innerHTML = '';
+    messageText.appendChild(input);
+    messageText.appendChild(saveBtn);
+    messageText.appendChild(cancelBtn);
+
+    input.focus();
+}
+
+function saveEditedMessage(messageId, newContent) {
+    fetch(`/api/message/${messageId}/edit`, {
+        method: 'PUT',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ content: newContent })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status !== 'success') {
+            // Новый текст придет событием message_edited
+            showError(data.message || 'Ошибка при редактировании');
+        }
+    })
+    .catch(error => {
+        showError('Ошибка сети при редактировании');
+    });
+}
+
+function findNewerMessage(data) {
+    // Элемент сообщения, если событие новее уже показанной версии
+    const messageDiv = document.querySelector(`[data-message-id="${data.message_id}"]`);
+    if (!messageDiv || parseInt(messageDiv.dataset.version || 1) >= data.version) {
+        return null;
+    }
+    messageDiv.dataset.version = data.version;
+    return messageDiv;
+}
+
+function applyMessageEdit(data) {
+    const messageDiv = findNewerMessage(data);
+    if (!messageDiv) {
+        return;
+    }
+    messageDiv.querySelector('.message-text').textContent = data.content;
+    if (!messageDiv.querySelector('.edited-indicator')) {
+        messageDiv.querySelector('.message-footer').insertAdjacentHTML(
+            'beforeend', '<span class="edited-indicator">(изменено)</span>'
+        );
+    }
+}
+
+function applyMessageDelete(data) {
+    const messageDiv = findNewerMessage(data);
+    if (messageDiv) {
+        messageDiv.remove();
+    }
+}
+
+function cancelEdit(messageDiv, originalText) {
+    const messageText = messageDiv.querySelector('.message-text');
+    messageText.textContent = originalText;
+}
+
+function deleteMessage(messageId) {
+    if (confirm('Вы уверены, что хотите удалить это сообщение?')) {
+        fetch(`/api/message/${messageId}/delete`, {
+            method: 'DELETE',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ delete_for_all: false })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+                if (messageDiv) {
+                    messageDiv.remove();
+                }
+            } else {
+                showError(data.message || 'Ошибка при удалении');
+            }
+        })
+        .catch(error => {
+            showError('Ошибка сети при удалении');
+        });
+    }
+}
+
+function showReactions(messageId) {
+    // Показываем панель с реакциями
+    const reactions = ['👍', '❤️', '😄', '😮', '😢', '😡'];
+    const reactionsHtml = reactions.map(emoji => 
+        `<button type="button" class="reaction-btn" onclick="addReaction(${messageId}, '${emoji}')">${emoji}</button>`
+    ).join('');
+
+    // Создаем или обновляем панель реакций
+    let reactionsPanel = document.getElementById('reactions-panel');
+    if (!reactionsPanel) {
+        reactionsPanel = document.createElement('div');
+        reactionsPanel.id = 'reactions-panel';
+        reactionsPanel.className = 'reactions-panel';
+        document.body.appendChild(reactionsPanel);
+    }
+
+    reactionsPanel.innerHTML = reactionsHtml;
+    reactionsPanel.style.display = 'block';
+
+    // Позиционируем панель
+    const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+    const rect = messageDiv.getBoundingClientRect();
+    reactionsPanel.style.left = rect.left + 'px';
+    reactionsPanel.style.top = (rect.top - 60) + 'px';
+
+    // Скрываем панель через 3 секунды
+    setTimeout(() => {
+        reactionsPanel.style.display = 'none';
+    }, 3000);
+}
+
+function renderReactions(messageId, reactions) {
+    if (!reactions || reactions.length === 0) {
+        return '';
+    }
+    return `
+        <div class="message-reactions">
+            ${reactions.map(r =>
+                `<span class="reaction" onclick="addReaction(${messageId}, '${r.emoji}')">${r.emoji} ${r.count}</span>`
+            ).join('')}
+        </div>
+    `;
+}
+
+function setReactions(messageId, reactions) {
+    // Счетчики реакций заменяются на месте, без перезагрузки истории
+    const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+    if (!messageDiv) {
+        return;
+    }
+    const current = messageDiv.querySelector('.message-reactions');
+    if (current) {
+        current.remove();
+    }
+    const html = renderReactions(messageId, reactions);
+    if (html) {
+        messageDiv.querySelector('.message-actions').insertAdjacentHTML('beforebegin', html);
+    }
+}
+
+function addReaction(messageId, emoji) {
+    fetch(`/api/message/${messageId}/react`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ emoji: emoji })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            setReactions(messageId, data.reactions);
+        } else {
+            showError(data.message || 'Ошибка при добавлении реакции');
+        }
+    })
+    .catch(error => {
+        showError('Ошибка сети при добавлении реакции');
+    });
+
+    // Скрываем панель реакций
+    document.getElementById('reactions-panel').style.display = 'none';
+}
+
+// Функция для просмотра профиля пользователя
+function viewUserProfile(username) {
+    window.open(`/profile/${username}`, '_blank');
+}
+
+// Функция для жалобы на пользователя из чата
+function reportUserFromChat(messageId, username) {
+    if (confirm(`Пожаловаться на пользователя @${username}?\n\nВы будете перенаправлены на страницу создания жалобы.`)) {
+        window.open(`/profile/${username}`, '_blank');
+    }
+}
+
+// Функция для жалобы на пользователя из списка
+function reportUserFromList(username) {
+    if (confirm(`Пожаловаться на пользователя @${username}?\n\nВы будете перенаправлены на страницу создания жалобы.`)) {
+        window.open(`/profile/${username}`, '_blank');
+    }
+}
+
+// Обновляем функцию отправки сообщения для поддержки ответов
+document.getElementById('message-form').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    const input = document.getElementById('message-input');
+    const message = input.value.trim();
+
+    if (message && currentChatUserId) {
+        // Отправляем через WebSocket
+        socket.emit('send_message', {
+            receiver_id: currentChatUserId,
+            content: message,
+            reply_to_id: currentReplyTo
+        });
+
+        // Очищаем поле ввода и ответ
+        input.value = '';
+        cancelReply();
+    }
+});
@@ -286,3 +286,87 @@ window.addEventListener('online', () => {
 window.addEventListener('offline', () => {
     showWarning('Потеряно подключение к интернету');
 });
+
+// Вложения: загрузка частями с продолжением после обрыва (см. attachments.py)
+let pendingAttachments = [];
+
+function escapeAttachmentText(text) {
+    const span = document.createElement('span');
+    span.textContent = text;
+    return span.innerHTML;
+}
+
+async function uploadAttachment(file, onProgress) {
+    const created = await fetch('/api/attachments', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size})
+    });
+    let status = await created.json();
+    if (!created.ok) {
+        throw new Error(status.message || 'Не удалось начать загрузку');
+    }
+
+    let retries = 0;
+    while (!status.complete) {
+        try {
+            const response = await fetch(`/api/attachments/${status.upload_id}`, {
+                method: 'PUT',
+                headers: {'Upload-Offset': String(status.offset), 'Content-Type': 'application/octet-stream'},
+                body: file.slice(status.offset, status.offset + status.chunk_size)
+            });
+            // 409 - сервер подтвердил другое смещение, продолжаем с него
+            if (!response.ok && response.status !== 409) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            status = await response.json();
+            retries = 0;
+        } catch (error) {
+            if (++retries > 5) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            status = await (await fetch(`/api/attachments/${status.upload_id}`)).json();
+        }
+        if (onProgress) {
+            onProgress(status.offset / status.size);
+        }
+    }
+    return status.upload_id;
+}
+
+async function attachFiles(files) {
+    const label = document.getElementById('attachment-status');
+    for (const file of files) {
+        try {
+            pendingAttachments.push(await uploadAttachment(file, progress => {
+                label.textContent = `${file.name}: ${Math.round(progress * 100)}%`;
+            }));
+            label.textContent = `Вложений: ${pendingAttachments.length}`;
+        } catch (error) {
+            label.textContent = `${file.name}: ошибка загрузки`;
+        }
+    }
+}
+
+function takeAttachments() {
+    const label = document.getElementById('attachment-status');
+    if (label) {
+        label.textContent = '';
+    }
+    return pendingAttachments.splice(0);
+}
+
+function renderAttachments(attachments) {
+    if (!attachments || !attachments.length) {
+        return '';
+    }
+    return `<div class="message-attachments">${attachments.map(attachment => {
+        const name = escapeAttachmentText(attachment.filename);
+        if (attachment.content_type.startsWith('image/')) {
+            return `<a href="${attachment.url}" target="_blank"><img src="${attachment.url}" alt="${name}" loading="lazy"></a>`;
+        }
+        return `<a href="${attachment.url}" class="attachment-file"><i class="fas fa-paperclip"></i> ${name}
+            <span class="attachment-size">${(attachment.size / 1024).toFixed(0)} КБ</span></a>`;
+    }).join('')}</div>`;
+}
@@ -0,0 +1,161 @@
+"""
+Статические файлы Nexa Messenger: отпечатки, сжатие и кеширование
+
+Сборки нет: манифест static/manifest.json хранит для каждого файла
+начало его SHA-256. url_for('static', ...) добавляет к адресу ?v=<хеш>,
+и ответ на адрес с актуальным хешем кешируется браузером на год
+(immutable) - при изменении файла меняется и адрес. Адрес без хеша или
+со старым хешем браузер перепроверяет по ETag.
+
+Рядом с текстовыми файлами лежат заранее сжатые варианты: .gz всегда,
+.br - если установлен пакет brotli. Вариант отдается по Accept-Encoding,
+поэтому сжимать на каждый запрос не нужно.
+
+При старте приложение сверяет манифест с файлами. Устаревший манифест
+пересобирается (с предупреждением), а при STATIC_MANIFEST_STRICT=1 старт
+прерывается. Пересборка вручную: python static_assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+from compression import accepts_encoding, parse_accept_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+# Пользовательские файлы: у аватаров адрес уже содержит хеш, а uploads в манифест не входят
+EXCLUDED_DIRS = {'avatars', 'uploads'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def scan(static_folder):
+    """{путь относительно static: хеш} для всех файлов, кроме вариантов и пользовательских"""
+    hashes = {}
+    for directory, directories, filenames in os.walk(static_folder):
+        if directory == static_folder:
+            directories[:] = [name for name in directories if name not in EXCLUDED_DIRS]
+        for filename in filenames:
+            if filename == MANIFEST_NAME or filename.endswith(('.gz', '.br', '.tmp')):
+                continue
+            path = os.path.join(directory, filename)
+            hashes[os.path.relpath(path, static_folder).replace(os.sep, '/')] = file_hash(path)
+    return dict(sorted(hashes.items()))
+
+
+def write_atomic(path, content):
+    # Воркеры могут пересобирать манифест одновременно
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(content)
+    os.replace(temporary, path)
+
+
+def compress(path):
+    """Пишет сжатые варианты файла; вариант, который не меньше исходника, удаляется"""
+    with open(path, 'rb') as source:
+        content = source.read()
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            write_atomic(path + suffix, compressed)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def is_compressible(filename):
+    return os.path.splitext(filename)[1].lower() in COMPRESSIBLE
+
+
+class AssetManifest:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.path = os.path.join(static_folder, MANIFEST_NAME)
+        self.hashes = {}
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as source:
+                return json.load(source)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def build(self):
+        """Пересчитывает хеши, сжатые варианты и записывает манифест"""
+        self.hashes = scan(self.static_folder)
+        for filename in self.hashes:
+            if is_compressible(filename):
+                compress(os.path.join(self.static_folder, filename))
+        write_atomic(self.path, (json.dumps(self.hashes, indent=2, ensure_ascii=False) + '\n').encode('utf-8'))
+        return self.hashes
+
+    def stale(self):
+        """Файлы, для которых манифест или сжатый вариант устарел"""
+        current = scan(self.static_folder)
+        recorded = self.load()
+        changed = sorted(name for name in set(current) | set(recorded) if current.get(name) != recorded.get(name))
+        for filename in current:
+            path = os.path.join(self.static_folder, filename)
+            if is_compressible(filename) and filename not in changed:
+                variant = path + '.gz'
+                # Вариант не пишется, если сжатие не дает выигрыша (см. compress)
+                if os.path.exists(variant) and os.path.getmtime(variant) < os.path.getmtime(path):
+                    changed.append(filename)
+                elif not os.path.exists(variant) and os.path.getsize(path) > 1024:
+                    changed.append(filename)
+        return changed
+
+    def check(self, strict=False, log=print):
+        """Стартовая проверка: загружает актуальный манифест или пересобирает устаревший"""
+        changed = self.stale()
+        if not changed:
+            self.hashes = self.load()
+            return []
+        message = f'Манифест статических файлов устарел: {", ".join(changed[:10])}'
+        if strict:
+            raise RuntimeError(message + ' (python static_assets.py)')
+        log(f'⚠️ {message}; пересобираю')
+        try:
+            self.build()
+        except OSError as error:
+            # Папка только для чтения: отпечатки считаем в памяти, без сжатых вариантов
+            log(f'⚠️ Не удалось записать манифест: {error}')
+            self.hashes = scan(self.static_folder)
+        return changed
+
+    def version(self, filename):
+        return self.hashes.get(filename)
+
+    def variant(self, filename, accept_encoding):
+        """(имя сжатого варианта, Content-Encoding) для клиента или None"""
+        if filename not in self.hashes or not is_compressible(filename):
+            return None
+        codings = parse_accept_encoding(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            if accepts_encoding(codings, encoding) and os.path.exists(os.path.join(self.static_folder, filename + suffix)):
+                return filename + suffix, encoding
+        return None
+
+
+if __name__ == '__main__':
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    hashes = AssetManifest(folder).build()
+    print(f'✅ Манифест статических файлов: {len(hashes)} файлов')
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Тесты статистики админ-панели: агрегация по дням и кэш завершенных дней
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import count_statements, create_users, login_client, run_tests, setup_users
+from app import app, db, Message, Report, DailyStat
+
+
+def setup_data():
+    """Создает администратора и активность за несколько дней"""
+    now = datetime.utcnow()
+    admin_id, = setup_users('admin', is_admin=True, created_at=now - timedelta(days=2))
+    user_id, = create_users('user', created_at=now)
+    with app.app_context():
+        for days_ago, count in ((0, 3), (1, 2), (6, 1), (40, 5)):
+            for _ in range(count):
+                db.session.add(Message(sender_id=admin_id, receiver_id=user_id, content='-',
+                                       encrypted_content='-', timestamp=now - timedelta(days=days_ago)))
+        db.session.add(Report(reporter_id=user_id, reported_user_id=admin_id, reason='spam',
+                              created_at=now - timedelta(days=1)))
+        db.session.commit()
+    return admin_id
+
+
+def test_statistics_by_day():
+    """Счетчики по дням и общие итоги"""
+    client = login_client(setup_data())
+
+    data = client.get('/admin/statistics?days=7').get_json()
+
+    assert len(data['dates']) == 7
+    assert data['message_counts'] == [1, 0, 0, 0, 0, 2, 3]
+    assert data['user_counts'] == [0, 0, 0, 0, 1, 0, 1]
+    assert data['report_counts'] == [0, 0, 0, 0, 0, 1, 0]
+    assert data['total_messages'] == 11
+    assert data['pending_reports'] == 1
+
+    year = client.get('/admin/statistics?days=365').get_json()
+    assert sum(year['message_counts']) == 11
+    assert client.get('/admin/statistics?days=12').status_code == 400
+
+
+def test_closed_days_are_cached():
+    """Завершенные дни считаются один раз, повторный запрос считает только сегодня"""
+    client = login_client(setup_data())
+    client.get('/admin/statistics?days=30')
+
+    with app.app_context():
+        assert DailyStat.query.count() == 29
+
+    with count_statements() as statements:
+        client.get('/admin/statistics?days=30')
+
+    grouped = [s for s in statements if 'GROUP BY' in s]
+    # Только сегодняшний день: по одному запросу на таблицу
+    assert len(grouped) == 3
+    assert not [s for s in statements if s.startswith('INSERT')]
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Статистика админ-панели работает")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Тесты вложений: загрузка частями с продолжением, хеш по ходу записи,
+хранение по содержимому, отдача с Range и доступ только участникам
+Запуск как скрипта - пиковая память на загрузку большого файла
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import tracemalloc
+
+from conftest import login_client, run_tests, setup_users
+from app import app, socketio, attachment_store
+from attachments import AttachmentStore, safe_filename
+
+
+class BrokenStream(io.BytesIO):
+    """Поток, оборванный после limit байт (клиент отключился на середине части)"""
+
+    def __init__(self, data, limit):
+        super().__init__(data[:limit])
+
+
+def test_store_resumes_after_lost_hash_state():
+    data = os.urandom(300 * 1024)
+    with tempfile.TemporaryDirectory() as folder:
+        store = AttachmentStore(folder)
+        upload_id = 'a' * 32
+        store.create(upload_id)
+        offset = store.append(upload_id, 0, io.BytesIO(data[:100 * 1024]), 100 * 1024)
+        assert offset == 100 * 1024
+
+        # Часть оборвалась; подтвержденным остается прежнее смещение
+        store.append(upload_id, offset, BrokenStream(data[offset:], 5000), 100 * 1024)
+        # Другой воркер без состояния хеша продолжает с подтвержденного смещения
+        other = AttachmentStore(folder)
+        offset = other.append(upload_id, offset, io.BytesIO(data[offset:]), len(data) - offset)
+        sha256 = other.finish(upload_id, offset)
+
+        assert sha256 == hashlib.sha256(data).hexdigest()
+        with open(other.object_path(sha256), 'rb') as stored:
+            assert stored.read() == data
+        assert os.listdir(os.path.join(folder, 'partial')) == []
+
+
+def test_safe_filename():
+    assert safe_filename('../../etc/passwd') == 'passwd'
+    assert safe_filename('C:\\Users\\me\\отчет 1.pdf') == 'отчет 1.pdf'
+    assert safe_filename('a"b<c>.txt') == 'a_b_c_.txt'
+    assert safe_filename('x' * 300 + '.pdf') == 'x' * 251 + '.pdf'
+
+
+def put_chunk(client, upload_id, offset, chunk):
+    return client.put(f'/api/attachments/{upload_id}', data=chunk,
+                      headers={'Upload-Offset': str(offset)}, content_type='application/octet-stream')
+
+
+def upload(client, data, filename='report.pdf', chunk_size=64 * 1024):
+    created = client.post('/api/attachments', json={'filename': filename, 'size': len(data)})
+    assert created.status_code == 201
+    upload_id = created.get_json()['upload_id']
+    for offset in range(0, len(data), chunk_size):
+        response = put_chunk(client, upload_id, offset, data[offset:offset + chunk_size])
+        assert response.status_code == 200
+    assert response.get_json()['complete']
+    return upload_id
+
+
+def test_chunked_upload_send_and_download():
+    alice_id, bob_id, carol_id = setup_users('alice', 'bob', 'carol')
+    alice, bob, carol = login_client(alice_id), login_client(bob_id), login_client(carol_id)
+    data = os.urandom(200 * 1024)
+    folder = attachment_store.folder
+    alice_socket = socketio.test_client(app, flask_test_client=alice)
+    bob_socket = socketio.test_client(app, flask_test_client=bob)
+    try:
+        with tempfile.TemporaryDirectory() as attachment_store.folder:
+            assert alice.post('/api/attachments', json={'filename': 'run.exe', 'size': 10}).status_code == 400
+
+            created = alice.post('/api/attachments', json={'filename': 'отчет 1.pdf', 'size': len(data)}).get_json()
+            upload_id = created['upload_id']
+            assert put_chunk(alice, upload_id, 0, data[:70000]).get_json()['offset'] == 70000
+
+            # Повтор той же части после обрыва: 409 и подтвержденное смещение
+            conflict = put_chunk(alice, upload_id, 0, data[:70000])
+            assert conflict.status_code == 409
+            assert conflict.headers['Upload-Offset'] == '70000'
+            assert put_chunk(bob, upload_id, 70000, data[70000:]).status_code == 404
+            assert alice.get(f'/api/attachments/{upload_id}').get_json()['offset'] == 70000
+
+            done = put_chunk(alice, upload_id, 70000, data[70000:]).get_json()
+            assert done['complete'] and done['offset'] == len(data)
+
+            # Одинаковый файл хранится один раз
+            upload(alice, data, 'copy.pdf')
+            objects = [name for _, _, names in os.walk(os.path.join(attachment_store.folder, 'objects')) for name in names]
+            assert objects == [hashlib.sha256(data).hexdigest()]
+
+            alice_socket.get_received()
+            bob_socket.get_received()
+            ack = alice_socket.emit('send_message', {'receiver_id': bob_id, 'content': '', 'attachment_ids': [upload_id]},
+                                    callback=True)
+            assert ack['status'] == 'sent'
+            # Вложение нельзя отправить второй раз
+            assert alice_socket.emit('send_message', {'receiver_id': bob_id, 'content': 'еще раз', 'attachment_ids': [upload_id]},
+                                     callback=True)['status'] == 'error'
+
+            delivered = [m['args'][0] for m in bob_socket.get_received() if m['name'] == 'new_message']
+            attachment = delivered[0]['attachments'][0]
+            assert (attachment['id'], attachment['filename'], attachment['size']) == (upload_id, 'отчет 1.pdf', len(data))
+            history = bob.get(f'/api/messages/{alice_id}').get_json()['messages']
+            assert history[-1]['attachments'] == [attachment]
+
+            response = bob.get(attachment['url'])
+            assert response.status_code == 200 and response.data == data
+            assert response.headers['Cache-Control'] == 'private, max-age=86400'
+            assert 'attachment' in response.headers['Content-Disposition']
+
+            partial = bob.get(attachment['url'], headers={'Range': 'bytes=1000-1999'})
+            assert partial.status_code == 206
+            assert partial.data == data[1000:2000]
+            assert partial.headers['Content-Range'] == f'bytes 1000-1999/{len(data)}'
+
+            assert bob.get(attachment['url'], headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+            assert carol.get(attachment['url']).status_code == 404
+
+            # За nginx воркер только проверяет права
+            app.config['ATTACHMENT_ACCEL_REDIRECT'] = '/protected-attachments/'
+            try:
+                accel = bob.get(attachment['url'])
+            finally:
+                app.config['ATTACHMENT_ACCEL_REDIRECT'] = None
+            sha256 = hashlib.sha256(data).hexdigest()
+            assert accel.headers['X-Accel-Redirect'] == f'/protected-attachments/objects/{sha256[:2]}/{sha256}'
+            assert accel.data == b''
+    finally:
+        attachment_store.folder = folder
+        alice_socket.disconnect()
+        bob_socket.disconnect()
+
+
+def test_parallel_chunk_with_same_offset_is_rejected():
+    alice_id, bob_id, carol_id = setup_users('alice', 'bob', 'carol')
+    alice = login_client(alice_id)
+    data = os.urandom(100 * 1024)
+    folder = attachment_store.folder
+    try:
+        with tempfile.TemporaryDirectory() as attachment_store.folder:
+            upload_id = alice.post('/api/attachments', json={'filename': 'a.pdf', 'size': len(data)}).get_json()['upload_id']
+            with attachment_store.writing(upload_id) as claimed:
+                assert claimed
+                # Повтор той же части в этом же процессе
+                with attachment_store.writing(upload_id) as again:
+                    assert not again
+            # Часть пишет другой воркер: запрос не трогает файл и получает 409
+            other_worker = AttachmentStore(attachment_store.folder)
+            with other_worker.writing(upload_id) as claimed:
+                assert claimed
+                busy = put_chunk(alice, upload_id, 0, data)
+                assert busy.status_code == 409 and busy.headers['Upload-Offset'] == '0'
+                assert os.path.getsize(attachment_store.partial_path(upload_id)) == 0
+
+            done = put_chunk(alice, upload_id, 0, data).get_json()
+            assert done['complete']
+            with open(attachment_store.object_path(hashlib.sha256(data).hexdigest()), 'rb') as stored:
+                assert stored.read() == data
+    finally:
+        attachment_store.folder = folder
+
+
+def benchmark(size=64 * 1024 * 1024, chunk_size=4 * 1024 * 1024):
+    """Пиковая память Python на загрузку файла частями"""
+    alice_id, bob_id, carol_id = setup_users('alice', 'bob', 'carol')
+    alice = login_client(alice_id)
+    data = os.urandom(size)
+    folder = attachment_store.folder
+    try:
+        with tempfile.TemporaryDirectory() as attachment_store.folder:
+            created = alice.post('/api/attachments', json={'filename': 'big.zip', 'size': size}).get_json()
+            upload_id = created['upload_id']
+            # Тела частей - потоки, как сокет на сервере; созданы до начала замера
+            bodies = [io.BytesIO(data[offset:offset + chunk_size]) for offset in range(0, size, chunk_size)]
+            peak = 0
+            tracemalloc.start()
+            for number, body in enumerate(bodies):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                response = alice.put(f'/api/attachments/{upload_id}', input_stream=body, content_length=chunk_size,
+                                     headers={'Upload-Offset': str(number * chunk_size)},
+                                     content_type='application/octet-stream')
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+            assert response.get_json()['complete']
+    finally:
+        attachment_store.folder = folder
+    print(f'Файл {size // (1024 * 1024)} МБ частями по {chunk_size // (1024 * 1024)} МБ: '
+          f'пик памяти на обработку части {peak / 1024:.0f} КБ')
+
+
+if __name__ == '__main__':
+    run_tests(globals(), '✅ Все тесты вложений пройдены')
+    benchmark()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Тесты аватаров: проверка по сигнатуре, миниатюры без метаданных,
+хранение по содержимому, обработка вне потока запроса и сборка мусора
+Запуск как скрипта - размер миниатюр против исходной загрузки
+"""
+
+import io
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from conftest import login_client, run_tests, setup_users, stopwatch
+import app as nexa
+from app import app, db, socketio, avatar_store, User
+from avatars import AvatarError, AvatarStore, AVATAR_SIZES, avatar_filename, render_thumbnails, sniff_image_type
+
+
+def make_image(image_format='JPEG', size=(1200, 800), color=(200, 30, 30), exif=True, noise=False):
+    if noise:
+        image = Image.merge('RGB', [Image.effect_noise(size, 60)] * 3)
+    else:
+        image = Image.new('RGB', size, color)
+    output = io.BytesIO()
+    options = {}
+    if exif:
+        metadata = Image.Exif()
+        metadata[0x010F] = 'Camera'           # Make
+        metadata[0x0112] = 6                  # Orientation: повернуть на 90°
+        options['exif'] = metadata.tobytes()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def test_sniff_image_type():
+    assert sniff_image_type(make_image('PNG', exif=False)) == 'PNG'
+    assert sniff_image_type(make_image('JPEG')) == 'JPEG'
+    assert sniff_image_type(make_image('GIF', exif=False)) == 'GIF'
+    assert sniff_image_type(make_image('WEBP', exif=False)) == 'WEBP'
+    assert sniff_image_type(b'<?php echo 1; ?>') is None
+    assert sniff_image_type(b'RIFF\x00\x00\x00\x00WAVE') is None
+
+
+def test_thumbnails_are_square_and_stripped():
+    thumbnails = render_thumbnails(make_image())
+    assert sorted(thumbnails) == sorted(AVATAR_SIZES)
+    for size, content in thumbnails.items():
+        image = Image.open(io.BytesIO(content))
+        assert image.format == 'WEBP'
+        assert image.size == (size, size)
+        assert not image.getexif()
+        assert 'icc_profile' not in image.info
+
+    # Подмена расширения не помогает: внутри не изображение
+    try:
+        render_thumbnails(b'\x89PNG\r\n\x1a\n' + b'garbage' * 10)
+    except AvatarError:
+        pass
+    else:
+        raise AssertionError('битый PNG принят')
+
+
+def test_store_dedupes_and_collects_garbage():
+    with tempfile.TemporaryDirectory() as folder:
+        store = AvatarStore(folder, min_age=60)
+        first = store.process(make_image())
+        assert store.process(make_image()) == first
+        assert len(os.listdir(folder)) == len(AVATAR_SIZES)
+
+        second = store.process(make_image(color=(0, 0, 255)))
+        now = time.time()
+        assert store.collect_garbage([second], now=now) == 0          # файлы еще молодые
+        assert store.collect_garbage([second], now=now + 120) == len(AVATAR_SIZES)
+        assert sorted(os.listdir(folder)) == sorted(avatar_filename(second, size) for size in AVATAR_SIZES)
+        assert store.release('../app.py', now=now + 120) == 0
+
+
+def setup_user():
+    user_id, = setup_users('alice')
+    return user_id
+
+
+def upload(client, data, filename='me.jpg'):
+    return client.post('/api/user/avatar', data={'avatar': (io.BytesIO(data), filename)},
+                       content_type='multipart/form-data')
+
+
+def wait_for(socket, name, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for message in socket.get_received():
+            if message['name'] == name:
+                return message['args'][0]
+        time.sleep(0.02)
+    raise AssertionError(f'нет события {name}')
+
+
+def test_upload_processed_off_request_thread():
+    user_id = setup_user()
+    client = login_client(user_id)
+    socket = socketio.test_client(app, flask_test_client=client)
+    socket.get_received()
+    folder = avatar_store.folder
+    set_avatar = nexa.set_avatar
+    threads = []
+
+    def recording_set_avatar(*args):
+        threads.append(threading.current_thread().name)
+        return set_avatar(*args)
+
+    nexa.set_avatar = recording_set_avatar
+    try:
+        with tempfile.TemporaryDirectory() as avatar_store.folder:
+            assert upload(client, b'not an image', 'me.png').status_code == 400
+
+            response = upload(client, make_image())
+            assert response.status_code == 202
+            key = response.get_json()['filename']
+            update = wait_for(socket, 'avatar_updated')
+            assert update['profile_picture'] == key
+            # В пуле только миниатюры: профиль обновляет фоновая задача Socket.IO
+            assert threads and not threads[0].startswith('avatar')
+            assert update['avatar_urls']['48'] == f'/static/avatars/{key}_48.webp'
+
+            # Повторная загрузка того же файла не обрабатывается заново
+            response = upload(client, make_image(), 'copy.jpeg')
+            assert response.status_code == 200
+            assert response.get_json()['filename'] == key
+
+            profile = client.get(f'/api/user/{user_id}/profile').get_json()
+            assert profile['avatar_url'] == f'/static/avatars/{key}_256.webp'
+
+            # Битый файл с верной сигнатурой отклоняется в обработке
+            assert upload(client, b'\xff\xd8\xff' + b'\x00' * 100).status_code == 202
+            assert 'message' in wait_for(socket, 'avatar_failed')
+            with app.app_context():
+                assert db.session.get(User, user_id).profile_picture == key
+    finally:
+        nexa.set_avatar = set_avatar
+        avatar_store.folder = folder
+        socket.disconnect()
+
+
+def benchmark():
+    """Размер миниатюр против исходной загрузки и время обработки"""
+    for image_format in ('JPEG', 'PNG'):
+        data = make_image(image_format, size=(3000, 2000), noise=True)
+        with stopwatch() as timer:
+            thumbnails = render_thumbnails(data)
+        sizes = ', '.join(f'{size}px {len(content) / 1024:.1f} КБ' for size, content in sorted(thumbnails.items()))
+        print(f'{image_format} 3000x2000 {len(data) / 1024:.0f} КБ -> {sizes} за {timer.elapsed * 1000:.0f} мс')
+
+
+if __name__ == '__main__':
+    run_tests(globals(), '✅ Все тесты аватаров пройдены')
+    benchmark()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Тесты реестра блокировок: проверка без запросов к базе, вход после
+истечения срока, пакетное снятие истекших блокировок с уведомлением
+Запуск как скрипта - сколько запросов к базе уходит на проверку блокировки
+"""
+
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from conftest import count_statements, create_users, login_client, run_tests, setup_users, stopwatch
+from app import app, db, socketio, ban_registry, active_ban, lift_expired_bans, User
+from ban_registry import BanRegistry
+
+
+def test_registry_expiry_heap():
+    registry = BanRegistry()
+    now = datetime(2026, 1, 1)
+    registry.load([
+        (1, now + timedelta(minutes=10), 'спам'),
+        (2, now + timedelta(minutes=5), 'флуд'),
+        (3, None, 'навсегда'),
+    ])
+    assert registry.is_banned(1, now) and registry.is_banned(3, now)
+    assert registry.get(2, now + timedelta(minutes=6)) is None  # истекла, хотя еще в реестре
+
+    # Продление и снятие оставляют в куче устаревшие записи - они пропускаются
+    registry.ban(1, now + timedelta(minutes=60), 'спам')
+    registry.unban(2)
+    assert registry.due(now + timedelta(minutes=30)) == []
+
+    registry.ban(4, now + timedelta(minutes=1), 'a')
+    registry.ban(5, now + timedelta(minutes=2), 'b')
+    assert [user_id for user_id, _, _ in registry.due(now + timedelta(minutes=90), limit=2)] == [4, 5]
+    assert [user_id for user_id, _, _ in registry.due(now + timedelta(minutes=90))] == [1]
+    assert registry.is_banned(3, now + timedelta(days=365))
+
+
+def test_registry_restore():
+    registry = BanRegistry()
+    now = datetime(2026, 1, 1)
+    registry.ban(1, now, 'спам')
+    expired = registry.due(now)
+    assert not registry.bans
+    registry.restore(expired)
+    assert registry.due(now) == expired
+
+
+def setup_accounts():
+    """Администратор, alice и bob с паролем secret"""
+    password_hash = generate_password_hash('secret')
+    admin_id, = setup_users('admin', password_hash=password_hash, is_admin=True)
+    alice_id, bob_id = create_users('alice', 'bob', password_hash=password_hash)
+    ban_registry.loaded_at = None  # реестр перечитает новую базу
+    return [admin_id, alice_id, bob_id]
+
+
+def login(username):
+    return app.test_client().post('/login', data={'username': username, 'password': 'secret'})
+
+
+def test_ban_blocks_login_and_profile_without_queries():
+    admin_id, alice_id, bob_id = setup_accounts()
+    admin = login_client(admin_id)
+    assert admin.post(f'/api/user/{alice_id}/ban', json={'reason': 'спам', 'duration': 0}).status_code == 200
+
+    response = login('alice')
+    assert response.status_code == 200
+    assert 'заблокирован навсегда' in response.get_data(as_text=True)
+    assert login('bob').status_code == 302
+
+    assert login_client(bob_id).get(f'/api/user/{alice_id}/profile').status_code == 403
+
+    with app.app_context(), count_statements() as statements:
+        for _ in range(100):
+            assert active_ban(alice_id) is not None
+            assert active_ban(bob_id) is None
+    assert statements == []
+
+    assert admin.post(f'/api/user/{alice_id}/unban').status_code == 200
+    assert login('alice').status_code == 302
+
+
+def test_expired_ban_allows_login_without_write():
+    admin_id, alice_id, bob_id = setup_accounts()
+    with app.app_context():
+        user = db.session.get(User, alice_id)
+        user.is_banned = True
+        user.ban_reason = 'флуд'
+        user.ban_until = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+
+    assert login('alice').status_code == 302
+    with app.app_context():
+        # Вход ничего не пишет: блокировку в базе снимает планировщик
+        assert db.session.get(User, alice_id).is_banned
+
+
+def test_lift_expired_bans_batch_and_notify():
+    admin_id, alice_id, bob_id = setup_accounts()
+    admin = login_client(admin_id)
+    for user_id in (alice_id, bob_id):
+        assert admin.post(f'/api/user/{user_id}/ban', json={'reason': 'флуд', 'duration': 1}).status_code == 200
+
+    alice_socket = socketio.test_client(app, flask_test_client=login_client(alice_id))
+    alice_socket.get_received()
+    try:
+        assert lift_expired_bans() == []
+
+        # Срок alice истек, а bob за это время продлили в другом воркере
+        past = datetime.utcnow() - timedelta(seconds=1)
+        with app.app_context():
+            db.session.get(User, alice_id).ban_until = past
+            db.session.get(User, bob_id).ban_until = datetime.utcnow() + timedelta(hours=1)
+            db.session.commit()
+        ban_registry.ban(alice_id, past, 'флуд')
+        ban_registry.ban(bob_id, past, 'флуд')
+
+        assert lift_expired_bans() == [alice_id]
+        with app.app_context():
+            assert not db.session.get(User, alice_id).is_banned
+            assert db.session.get(User, bob_id).is_banned
+        # Продленная блокировка остается в реестре этого воркера с новым сроком
+        assert active_ban(alice_id) is None
+        assert active_ban(bob_id)[0] > datetime.utcnow()
+        assert [message['name'] for message in alice_socket.get_received()] == ['user_unbanned']
+    finally:
+        alice_socket.disconnect()
+
+
+def benchmark(checks=2000):
+    """Запросы к базе на проверку блокировки: чтение строки пользователя против реестра"""
+    admin_id, alice_id, bob_id = setup_accounts()
+    login_client(admin_id).post(f'/api/user/{alice_id}/ban', json={'reason': 'спам', 'duration': 60})
+
+    with app.app_context(), count_statements() as statements:
+        with stopwatch() as db_time:
+            for _ in range(checks):
+                db.session.get(User, alice_id, populate_existing=True).is_banned
+        db_statements = len(statements)
+
+        with stopwatch() as registry_time:
+            for _ in range(checks):
+                active_ban(alice_id)
+    print(f'Проверок блокировки: {checks}')
+    print(f'  из базы:   {db_statements} запросов, {db_time.elapsed * 1e6 / checks:.1f} мкс на проверку')
+    print(f'  из реестра: {len(statements) - db_statements} запросов, '
+          f'{registry_time.elapsed * 1e6 / checks:.1f} мкс на проверку')
+
+
+if __name__ == '__main__':
+    run_tests(globals(), '✅ Все тесты блокировок пройдены')
+    benchmark()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тесты дельта-синхронизации истории канала по номеру изменения (since)
+"""
+
+from conftest import create_channel, login_client, run_tests, setup_users
+from app import app, db, socketio, Channel, Message
+
+
+def setup_channel():
+    """Создает канал с двумя участниками и одного постороннего пользователя"""
+    user_ids = setup_users('alice', 'bob', 'eve')
+    return create_channel(user_ids[:2]), user_ids
+
+
+def send(client, channel_id, *contents):
+    """Отправляет сообщения в канал через Socket.IO"""
+    socket = socketio.test_client(app, flask_test_client=client)
+    for content in contents:
+        socket.emit('send_message', {'channel_id': channel_id, 'content': content})
+    socket.disconnect()
+
+
+def test_full_load_returns_latest_page_and_cursor():
+    """Первая загрузка отдает последнюю страницу и текущий номер канала"""
+    channel_id, (alice_id, bob_id, eve_id) = setup_channel()
+    alice = login_client(alice_id)
+    send(alice, channel_id, *[f'm{i}' for i in range(5)])
+
+    data = alice.get(f'/api/channel/{channel_id}/messages?limit=3').get_json()
+    assert [m['content'] for m in data['messages']] == ['m2', 'm3', 'm4']
+    assert data['seq'] == 5
+    assert data['has_more'] is True
+
+    older = alice.get(f"/api/channel/{channel_id}/messages?before_id={data['oldest_id']}").get_json()
+    assert [m['content'] for m in older['messages']] == ['m0', 'm1']
+
+    assert login_client(eve_id).get(f'/api/channel/{channel_id}/messages?since=0').status_code == 403
+
+
+def test_since_returns_only_changes():
+    """По курсору приходят только новые, измененные, удаленные и отреагированные сообщения"""
+    channel_id, (alice_id, bob_id, _) = setup_channel()
+    alice, bob = login_client(alice_id), login_client(bob_id)
+    send(alice, channel_id, 'first', 'second', 'third', 'fourth')
+    seq = bob.get(f'/api/channel/{channel_id}/messages').get_json()['seq']
+
+    with app.app_context():
+        ids = [m.id for m in Message.query.filter_by(channel_id=channel_id).order_by(Message.id)]
+    alice.put(f'/api/message/{ids[0]}/edit', json={'content': 'first (edited)'})
+    alice.delete(f'/api/message/{ids[1]}/delete', json={'delete_for_all': True})
+    bob.post(f'/api/message/{ids[2]}/react', json={'emoji': '👍'})
+    send(alice, channel_id, 'fifth')
+
+    delta = bob.get(f'/api/channel/{channel_id}/messages?since={seq}').get_json()
+    assert [m['content'] for m in delta['messages']] == ['first (edited)', 'third', 'fifth']
+    assert delta['messages'][1]['reactions'] == [{'emoji': '👍', 'count': 1}]
+    assert delta['deleted'] == [ids[1]]
+    assert delta['seq'] == seq + 4
+    assert delta['has_more'] is False
+
+    # Повторная синхронизация с новым курсором ничего не возвращает
+    empty = bob.get(f"/api/channel/{channel_id}/messages?since={delta['seq']}").get_json()
+    assert empty['messages'] == [] and empty['deleted'] == [] and empty['seq'] == delta['seq']
+
+    # Удаленное сообщение не попадает и в полную загрузку
+    full = bob.get(f'/api/channel/{channel_id}/messages').get_json()
+    assert 'second' not in [m['content'] for m in full['messages']]
+
+
+def test_since_cost_does_not_depend_on_history():
+    """Синхронизация читает только изменения, а не всю историю канала"""
+    channel_id, (alice_id, _, _) = setup_channel()
+    alice = login_client(alice_id)
+    with app.app_context():
+        for i in range(300):
+            seq = db.session.execute(db.update(Channel).where(Channel.id == channel_id)
+                                     .values(seq=Channel.seq + 1).returning(Channel.seq)).scalar_one()
+            db.session.add(Message(sender_id=alice_id, channel_id=channel_id, content=f'old {i}',
+                                   encrypted_content='-', channel_seq=seq))
+        db.session.commit()
+    send(alice, channel_id, 'new')
+
+    delta = alice.get(f'/api/channel/{channel_id}/messages?since=300').get_json()
+    assert [m['content'] for m in delta['messages']] == ['new']
+
+    with app.app_context():
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM message "
+            "WHERE channel_id = :channel_id AND channel_seq > 300 ORDER BY channel_seq"
+        ), {'channel_id': channel_id}).all()
+    assert any('ix_message_channel_seq' in str(row) for row in plan)
+
+
+def test_live_event_carries_sequence():
+    """Событие new_message содержит номер изменения, чтобы клиент видел пропуски"""
+    channel_id, (alice_id, bob_id, _) = setup_channel()
+    bob_socket = socketio.test_client(app, flask_test_client=login_client(bob_id))
+    bob_socket.get_received()
+
+    send(login_client(alice_id), channel_id, 'one', 'two')
+
+    events = [p['args'][0] for p in bob_socket.get_received() if p['name'] == 'new_message']
+    assert [event['channel_seq'] for event in events] == [1, 2]
+    bob_socket.disconnect()
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Дельта-синхронизация каналов работает")
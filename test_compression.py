@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Тесты сжатия ответов: пороги, allowlist типов, потоковые ответы,
+JSON истории сообщений и согласование permessage-deflate
+Запуск как скрипта - байты в сети и время процессора на запрос истории
+"""
+
+import gzip
+import json
+import os
+import time
+import zlib
+
+import simple_websocket.ws
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, Request
+from wsproto.extensions import PerMessageDeflate
+
+from conftest import login_client, run_tests, setup_users
+from app import app, db, Message
+from compression import CompressionMiddleware, websocket_deflate
+
+PAYLOAD = json.dumps([{'id': i, 'content': f'Сообщение номер {i}'} for i in range(200)], ensure_ascii=False)
+
+
+def wsgi_app(environ, start_response):
+    """Мини-приложение: ответ выбирается по пути"""
+    path = environ['PATH_INFO']
+    if path == '/small':
+        response = Response('{"ok": true}', mimetype='application/json')
+    elif path == '/image':
+        response = Response(b'\x89PNG' + b'\x00' * 5000, mimetype='image/png')
+    elif path == '/file':
+        response = Response(PAYLOAD, mimetype='application/json', headers={'Accept-Ranges': 'bytes'})
+    elif path == '/stream':
+        response = Response((f'строка {i}\n' for i in range(500)), mimetype='text/plain')
+    else:
+        response = Response(PAYLOAD, mimetype='application/json', headers={'ETag': '"abc"', 'Vary': 'Cookie'})
+    return response(environ, start_response)
+
+
+def test_middleware_thresholds_and_types():
+    client = Client(CompressionMiddleware(wsgi_app, min_size=1024))
+    gzip_header = {'Accept-Encoding': 'gzip, deflate, br'}
+
+    response = client.get('/json', headers=gzip_header)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) == len(response.data) < len(PAYLOAD.encode()) / 4
+    assert gzip.decompress(response.data).decode() == PAYLOAD
+    assert response.headers['ETag'] == 'W/"abc"'
+    assert response.headers['Vary'] == 'Cookie, Accept-Encoding'
+
+    assert 'Content-Encoding' not in client.get('/json').headers
+    assert 'Content-Encoding' not in client.get('/json', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+    assert 'Content-Encoding' not in client.get('/json', headers={'Accept-Encoding': '*, gzip;q=0'}).headers
+    assert client.get('/json', headers={'Accept-Encoding': 'br, *;q=0.1'}).headers['Content-Encoding'] == 'gzip'
+    for path in ('/small', '/image', '/file'):
+        assert 'Content-Encoding' not in client.get(path, headers=gzip_header).headers, path
+
+
+def test_middleware_streams_chunks():
+    client = Client(CompressionMiddleware(wsgi_app))
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+    # Каждая часть сброшена: первую строку можно распаковать, не дожидаясь конца ответа
+    chunks = iter(response.response)
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(next(chunks)) == 'строка 0\n'.encode()
+    rest = b''.join(decompressor.decompress(chunk) for chunk in chunks)
+    assert rest.decode().endswith('строка 499\n')
+    response.close()
+
+
+def legacy_app(environ, start_response):
+    """Приложение в старом стиле WSGI: тело через write(), итератор пустой"""
+    write = start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(PAYLOAD.encode())))])
+    write(PAYLOAD.encode())
+    return []
+
+
+def test_middleware_passes_write_through():
+    client = Client(CompressionMiddleware(legacy_app))
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == PAYLOAD
+
+
+def setup_history(total=50):
+    alice_id, bob_id = setup_users('alice', 'bob')
+    with app.app_context():
+        for i in range(total):
+            sender, receiver = (alice_id, bob_id) if i % 2 == 0 else (bob_id, alice_id)
+            db.session.add(Message(sender_id=sender, receiver_id=receiver, encrypted_content='-',
+                                   content=f'Привет! Это сообщение номер {i}, встречаемся завтра в {i % 24}:00'))
+        db.session.commit()
+    return alice_id, bob_id
+
+
+def test_message_history_compressed():
+    alice_id, bob_id = setup_history()
+    client = login_client(alice_id)
+    plain = client.get(f'/api/messages/{bob_id}?limit=50')
+    compressed = client.get(f'/api/messages/{bob_id}?limit=50', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+    assert len(compressed.data) < len(plain.data) / 4
+
+    # Статика отдается заранее сжатым вариантом и не сжимается второй раз
+    static = client.get('/static/js/main.js', headers={'Accept-Encoding': 'gzip'})
+    with open(os.path.join(app.static_folder, 'js', 'main.js'), 'rb') as source:
+        assert gzip.decompress(static.data) == source.read()
+    static.close()
+
+
+def handshake_extensions():
+    """Заголовок Sec-WebSocket-Extensions ответа simple-websocket браузеру с permessage-deflate"""
+    client = WSConnection(ConnectionType.CLIENT)
+    server = WSConnection(ConnectionType.SERVER)
+    server.receive_data(client.send(Request(host='nexa', target='/socket.io/', extensions=[PerMessageDeflate()])))
+    next(server.events())
+    response = server.send(AcceptConnection(extensions=[simple_websocket.ws.PerMessageDeflate()]))
+    for line in response.decode().split('\r\n'):
+        if line.lower().startswith('sec-websocket-extensions:'):
+            return line.split(':', 1)[1].strip()
+    return None
+
+
+def test_websocket_deflate_modes():
+    original = simple_websocket.ws.PerMessageDeflate
+    try:
+        assert handshake_extensions().startswith('permessage-deflate')
+        websocket_deflate('no_context_takeover')
+        assert 'server_no_context_takeover' in handshake_extensions()
+        websocket_deflate('off')
+        assert handshake_extensions() is None
+    finally:
+        simple_websocket.ws.PerMessageDeflate = original
+
+
+def benchmark(requests=200):
+    """Байты в сети и время процессора на запрос страницы истории (50 сообщений)"""
+    alice_id, bob_id = setup_history()
+    client = login_client(alice_id)
+    url = f'/api/messages/{bob_id}?limit=50'
+    middleware = app.wsgi_app
+    results = []
+    for label, level, headers in [('без сжатия', None, {}), ('gzip 1', 1, {'Accept-Encoding': 'gzip'}),
+                                  ('gzip 6', 6, {'Accept-Encoding': 'gzip'}), ('gzip 9', 9, {'Accept-Encoding': 'gzip'})]:
+        if level is not None:
+            middleware.level = level
+        client.get(url, headers=headers)
+        started = time.process_time()
+        for _ in range(requests):
+            size = len(client.get(url, headers=headers).data)
+        cpu = (time.process_time() - started) / requests
+        results.append((label, size, cpu))
+    middleware.level = app.config['COMPRESS_LEVEL']
+
+    base_size, base_cpu = results[0][1], results[0][2]
+    print(f'История из 50 сообщений, {requests} запросов:')
+    for label, size, cpu in results:
+        print(f'  {label:<11} {size:>6} байт ({size / base_size:.0%}), '
+              f'{cpu * 1000:.2f} мс CPU на запрос ({(cpu - base_cpu) * 1000:+.2f} мс)')
+
+
+if __name__ == '__main__':
+    run_tests(globals(), '✅ Все тесты сжатия пройдены')
+    benchmark()
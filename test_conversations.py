@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Тесты списка разговоров (/api/conversations) и боковой панели чата
+"""
+
+from conftest import connect, count_statements, create_channel, login_client, run_tests, setup_users
+
+
+def test_conversations_ordered_by_recency():
+    """Разговоры идут от последней активности, с превью и непрочитанными"""
+    user_ids = setup_users(count=4)
+    me, others = user_ids[0], user_ids[1:]
+    channel_id = create_channel([me, others[0]], is_public=True)
+
+    sockets = {user_id: connect(user_id) for user_id in user_ids}
+    sockets[others[0]].emit('send_message', {'receiver_id': me, 'content': 'first'})
+    sockets[me].emit('send_message', {'receiver_id': others[1], 'content': 'second'})
+    sockets[others[0]].emit('send_message', {'channel_id': channel_id, 'content': 'in channel'})
+    sockets[others[2]].emit('send_message', {'receiver_id': me, 'content': 'latest ' + 'x' * 60})
+
+    data = login_client(me).get('/api/conversations').get_json()
+    items = [(c['kind'], c['id']) for c in data['conversations']]
+    assert items == [('dm', others[2]), ('channel', channel_id), ('dm', others[1]), ('dm', others[0])]
+
+    latest = data['conversations'][0]
+    assert latest['unread_count'] == 1
+    assert latest['last_message']['content'] == ('latest ' + 'x' * 60)[:50] + '...'
+    assert data['conversations'][1]['name'] == 'team'
+    assert data['conversations'][2]['unread_count'] == 0
+
+    dialogs = login_client(me).get('/api/conversations?kind=dm').get_json()['conversations']
+    assert [c['id'] for c in dialogs] == [others[2], others[1], others[0]]
+    assert login_client(me).get('/api/conversations?kind=group').status_code == 400
+
+    for client in sockets.values():
+        client.disconnect()
+
+
+def test_cursor_pages_and_constant_queries():
+    """Курсор обходит все разговоры, число запросов не зависит от размера страницы"""
+    user_ids = setup_users(count=26)
+    me = user_ids[0]
+    for user_id in user_ids[1:]:
+        client = connect(user_id)
+        client.emit('send_message', {'receiver_id': me, 'content': f'from {user_id}'})
+        client.disconnect()
+
+    client = login_client(me)
+    seen = []
+    cursor = ''
+    while True:
+        page = client.get(f'/api/conversations?limit=10{cursor}').get_json()
+        seen.extend(c['id'] for c in page['conversations'])
+        if not page['has_more']:
+            break
+        cursor = '&cursor=' + page['next_cursor']
+    assert seen == list(reversed(user_ids[1:]))
+
+    def count_queries(limit):
+        with count_statements() as statements:
+            client.get(f'/api/conversations?limit={limit}')
+        return len(statements)
+
+    assert count_queries(5) == count_queries(25)
+
+
+def test_chat_sidebar_lists_only_conversations():
+    """Боковая панель чата показывает собеседников, а не всех пользователей"""
+    user_ids = setup_users(count=5)
+    client = connect(user_ids[1])
+    client.emit('send_message', {'receiver_id': user_ids[0], 'content': 'hello'})
+    client.disconnect()
+
+    html = login_client(user_ids[0]).get('/chat').get_data(as_text=True)
+    assert 'data-username="user1"' in html
+    assert 'data-username="user2"' not in html
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Список разговоров работает")
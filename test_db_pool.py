@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тесты пула соединений: размер по модели воркеров и метрики ожидания
+PostgreSQL заменяется файловой базой SQLite с тем же QueuePool
+"""
+
+import os
+import tempfile
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from db_pool import PoolMetrics, pool_settings, postgres_engine_options, timed_pool_class
+
+
+def test_pool_size_follows_worker_model():
+    gevent = pool_settings({'GUNICORN_WORKER_CLASS': 'gevent', 'GUNICORN_WORKERS': '4'})
+    # 90 соединений на 4 воркера: 10 постоянных и 12 сверх пула у каждого
+    assert (gevent['pool_size'], gevent['max_overflow']) == (10, 12)
+
+    crowded = pool_settings({'GUNICORN_WORKER_CLASS': 'gevent', 'GUNICORN_WORKERS': '30'})
+    assert crowded['pool_size'] + crowded['max_overflow'] == 3
+
+    threads = pool_settings({'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '4'})
+    assert (threads['pool_size'], threads['max_overflow']) == (4, 86)
+
+    custom = pool_settings({'GUNICORN_WORKER_CLASS': 'gevent', 'DB_POOL_SIZE': '3', 'DB_MAX_OVERFLOW': '0',
+                            'DB_STATEMENT_TIMEOUT': '2000'})
+    assert (custom['pool_size'], custom['max_overflow'], custom['statement_timeout']) == (3, 0, 2000)
+
+
+def test_postgres_engine_options():
+    metrics = PoolMetrics()
+    options = postgres_engine_options(pool_settings({'GUNICORN_WORKER_CLASS': 'gevent'}), metrics)
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args']['options'] == '-c statement_timeout=15000'
+
+    # Движок создается без подключения к серверу
+    engine = create_engine('postgresql+psycopg2://nexa@localhost/nexa', **options)
+    assert engine.pool.size() == 10
+    assert engine.pool._recycle == 1800
+    assert isinstance(engine.pool, options['poolclass'])
+
+
+def test_checkout_wait_and_timeouts_are_counted():
+    metrics = PoolMetrics()
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine('sqlite:///' + os.path.join(directory, 'nexa.db'),
+                               poolclass=timed_pool_class(metrics), pool_size=1, max_overflow=0,
+                               pool_timeout=0.2, connect_args={'check_same_thread': False})
+        try:
+            held = engine.connect()
+            errors = []
+
+            def checkout():
+                try:
+                    with engine.connect() as connection:
+                        connection.execute(text('SELECT 1'))
+                except PoolTimeoutError as error:
+                    errors.append(error)
+
+            waiting = threading.Thread(target=checkout)
+            waiting.start()
+            waiting.join()
+            assert len(errors) == 1
+
+            # После возврата соединения ожидающий его получает
+            waiting = threading.Thread(target=checkout)
+            waiting.start()
+            threading.Timer(0.05, held.close).start()
+            waiting.join()
+            assert len(errors) == 1
+
+            data = metrics.snapshot(engine.pool)
+            assert data['checkouts'] == 2
+            assert data['timeouts'] == 1
+            assert data['wait_max_ms'] >= 200
+            assert sum(data['wait_histogram'].values()) == 3
+            assert data['pool']['size'] == 1
+            assert data['pool']['checked_out'] == 0
+        finally:
+            engine.dispose()
+
+
+def test_admin_pool_endpoint():
+    from conftest import create_users, login_client, setup_users
+
+    admin_id, = setup_users('admin', is_admin=True)
+    user_id, = create_users('user')
+
+    assert login_client(user_id).get('/api/admin/db_pool').status_code == 403
+    data = login_client(admin_id).get('/api/admin/db_pool').get_json()
+    assert {'checkouts', 'timeouts', 'wait_avg_ms', 'wait_max_ms', 'wait_histogram'} <= set(data)
+
+
+if __name__ == '__main__':
+    from conftest import run_tests
+    run_tests(globals(), "✅ Тесты пула соединений пройдены")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Тесты хранения только шифротекста (MESSAGE_ENCRYPTION_AT_REST)
+Запуск как скрипта измеряет время загрузки страницы истории с кэшем и без
+"""
+
+from sqlalchemy import text
+
+from conftest import login_client, print_title, setup_users, stopwatch
+import app as nexa
+from app import app, db, Message
+from encryption import DecryptionCache
+
+
+def setup_history(total=30, at_rest=True):
+    """Создает переписку alice и bob; при at_rest открытый текст не сохраняется"""
+    alice_id, bob_id = setup_users('alice', 'bob')
+    with app.app_context():
+        for i in range(total):
+            sender, receiver = (alice_id, bob_id) if i % 2 == 0 else (bob_id, alice_id)
+            content = f'secret number {i}'
+            db.session.add(Message(sender_id=sender, receiver_id=receiver,
+                                   content='' if at_rest else content,
+                                   encrypted_content=nexa.encrypt_message(content)))
+        db.session.commit()
+    return alice_id, bob_id
+
+
+def at_rest(enabled=True):
+    """Переключает режим хранения и возвращает прежнее значение"""
+    previous = app.config['MESSAGE_ENCRYPTION_AT_REST']
+    app.config['MESSAGE_ENCRYPTION_AT_REST'] = enabled
+    return previous
+
+
+def test_history_is_decrypted_lazily_with_cache():
+    """История отдается расшифрованной, повторная загрузка берет тексты из кэша"""
+    previous = at_rest()
+    cache = nexa.message_keys.cache
+    nexa.message_keys.cache = DecryptionCache(100)
+    try:
+        alice_id, bob_id = setup_history()
+        client = login_client(alice_id)
+
+        first = client.get(f'/api/messages/{bob_id}?limit=10').get_json()
+        assert [m['content'] for m in first['messages']] == [f'secret number {i}' for i in range(20, 30)]
+        assert nexa.message_keys.cache.misses == 10
+
+        client.get(f'/api/messages/{bob_id}?limit=10')
+        assert nexa.message_keys.cache.hits == 10
+        assert len(nexa.message_keys.cache) == 10
+    finally:
+        nexa.message_keys.cache = cache
+        at_rest(previous)
+
+
+def test_edit_replaces_ciphertext():
+    """Редактирование в режиме шифротекста обновляет шифротекст, а не content"""
+    previous = at_rest()
+    try:
+        alice_id, bob_id = setup_history(total=2)
+        client = login_client(alice_id)
+        with app.app_context():
+            message_id = Message.query.filter_by(sender_id=alice_id).first().id
+
+        response = client.put(f'/api/message/{message_id}/edit', json={'content': 'edited text'})
+        assert response.status_code == 200
+
+        with app.app_context():
+            message = db.session.get(Message, message_id)
+            assert message.content == ''
+            assert nexa.decrypt_message(message.encrypted_content) == 'edited text'
+    finally:
+        at_rest(previous)
+
+
+def test_drop_plaintext_in_chunks():
+    """Миграция очищает открытый текст порциями и убирает его из поискового индекса"""
+    alice_id, bob_id = setup_history(total=7, at_rest=False)
+    client = login_client(alice_id)
+    before = client.get(f'/api/messages/{bob_id}').get_json()['messages']
+
+    with app.app_context():
+        chunks = []
+        updated = nexa.drop_plaintext_messages(batch_size=3, progress=lambda last_id, count: chunks.append(count))
+        assert updated == 7
+        assert chunks == [3, 6, 7]
+        assert Message.query.filter(Message.content != '').count() == 0
+        assert nexa.drop_plaintext_messages(batch_size=3) == 0
+        hits = db.session.execute(text("SELECT rowid FROM message_fts WHERE message_fts MATCH 'secret'")).all()
+        assert hits == []
+
+    after = client.get(f'/api/messages/{bob_id}').get_json()['messages']
+    assert [m['content'] for m in after] == [m['content'] for m in before]
+
+
+def test_search_without_plaintext():
+    """Поиск в режиме шифротекста находит сообщения и подсвечивает совпадение"""
+    previous = at_rest()
+    try:
+        alice_id, bob_id = setup_history(total=12)
+        client = login_client(bob_id)
+
+        data = client.get('/api/search/messages?q=number 1').get_json()
+        contents = [result['content'] for result in data['results']]
+        assert contents == ['secret number 11', 'secret number 10', 'secret number 1']
+        assert '<mark>number</mark> <mark>11</mark>' in data['results'][0]['snippet']
+
+        page = client.get('/api/search/messages?q=secret&per_page=5&page=3').get_json()
+        assert [result['content'] for result in page['results']] == ['secret number 1', 'secret number 0']
+        assert page['has_more'] is False and page['next_cursor'] is None
+    finally:
+        at_rest(previous)
+
+
+def test_search_continues_past_scan_limit():
+    """Совпадения старше лимита просмотра не теряются: курсор продолжает поиск"""
+    previous = at_rest()
+    try:
+        alice_id, bob_id = setup_history(total=12)
+        pages, cursor = [], None
+        with app.app_context():
+            while True:
+                hits, cursor = nexa.search_encrypted(db.session, bob_id, 'number 1', nexa.message_texts,
+                                                     limit=2, before_id=cursor, scan_limit=5)
+                pages.append([message_id for message_id, _, _ in hits])
+                if cursor is None:
+                    break
+        # id сообщения - номер + 1: 11 и 10 в первых пяти, 1 - только после двух продолжений
+        assert pages == [[12, 11], [], [2]]
+
+        client = login_client(bob_id)
+        data = client.get('/api/search/messages', query_string={'q': 'number 1', 'cursor': 3}).get_json()
+        assert [result['content'] for result in data['results']] == ['secret number 1']
+        assert data['has_more'] is False and data['next_cursor'] is None
+    finally:
+        at_rest(previous)
+
+
+def measure(total=2000, page_size=50, rounds=20, cache_size=10000):
+    """Среднее время загрузки страницы истории в режиме шифротекста"""
+    previous = at_rest()
+    cache = nexa.message_keys.cache
+    nexa.message_keys.cache = DecryptionCache(cache_size) if cache_size else None
+    try:
+        alice_id, bob_id = setup_history(total=total)
+        client = login_client(alice_id)
+        client.get(f'/api/messages/{bob_id}?limit={page_size}')  # прогрев
+        with stopwatch() as timer:
+            for _ in range(rounds):
+                client.get(f'/api/messages/{bob_id}?limit={page_size}')
+        return timer.elapsed / rounds
+    finally:
+        nexa.message_keys.cache = cache
+        at_rest(previous)
+
+
+if __name__ == '__main__':
+    print_title('Загрузка страницы истории (только шифротекст)')
+    for page_size in (50, 200):
+        without_cache = measure(page_size=page_size, cache_size=0)
+        with_cache = measure(page_size=page_size)
+        print(f"📄 {page_size:3d} сообщений | без кэша: {without_cache * 1000:.2f} мс | "
+              f"с кэшем: {with_cache * 1000:.2f} мс")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Тесты набора ключей шифрования и перешифровки истории
+"""
+
+import threading
+import time
+
+from cryptography.fernet import Fernet
+
+from conftest import run_tests, setup_users
+import app as nexa
+from encryption import KeyRing, UNREADABLE_MESSAGE, load_or_create_key_file
+
+
+def test_key_ring_rotation():
+    """Новый ключ шифрует, старые продолжают расшифровывать"""
+    old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    old_ring = KeyRing.from_config(f'1:{old_key}')
+    ring = KeyRing.from_config(f'2:{new_key},1:{old_key}')
+
+    old_token = old_ring.encrypt('привет')
+    legacy_token = Fernet(old_key).encrypt('legacy'.encode()).decode()
+
+    assert old_token.startswith('1:')
+    assert ring.decrypt(old_token) == 'привет'
+    assert ring.decrypt(legacy_token) == 'legacy'
+    assert ring.needs_rotation(old_token) and ring.needs_rotation(legacy_token)
+    assert not ring.needs_rotation(ring.encrypt('x'))
+    assert ring.decrypt_many(ring.encrypt_many(['a', 'b'])) == ['a', 'b']
+    assert ring.decrypt('3:garbage') == UNREADABLE_MESSAGE
+
+
+def test_key_file_survives_restart(tmp_path):
+    """Ключ из файла одинаков при повторной загрузке"""
+    path = str(tmp_path / 'keys')
+    token = KeyRing.from_config(key_file=path).encrypt('сообщение')
+    assert KeyRing.from_config(key_file=path).decrypt(token) == 'сообщение'
+    assert load_or_create_key_file(path).startswith('1:')
+
+
+def test_key_file_created_once_by_parallel_workers(tmp_path):
+    """Одновременный старт воркеров: все читают один и тот же непустой ключ"""
+    path = str(tmp_path / 'keys')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(load_or_create_key_file(path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 1 and results[0].startswith('1:')
+    assert [name for name in tmp_path.iterdir()] == [tmp_path / 'keys']
+
+    # Пустой файл, который еще дописывает другой процесс, перечитывается
+    late = tmp_path / 'late'
+    late.write_text('')
+    timer = threading.Timer(0.2, lambda: late.write_text('1:key\n'))
+    timer.start()
+    started = time.monotonic()
+    assert load_or_create_key_file(str(late)) == '1:key'
+    assert time.monotonic() - started < 2
+    timer.join()
+
+
+def test_reencrypt_messages_in_chunks():
+    """Перешифровка переводит всю историю на основной ключ, включая утерянные ключи и пустые тексты"""
+    old_key = Fernet.generate_key().decode()
+    lost_key = Fernet.generate_key()
+    primary = nexa.message_keys
+    user_id, = setup_users('u')
+    with nexa.app.app_context():
+        old_ring = KeyRing.from_config(f'old:{old_key}')
+        texts = [f'text {i}' for i in range(7)] + ['']  # последнее - сообщение только с вложениями
+        for i, content in enumerate(texts):
+            if i == 0:
+                ciphertext = Fernet(lost_key).encrypt(b'lost').decode()
+            else:
+                ciphertext = old_ring.encrypt(content)
+            nexa.db.session.add(nexa.Message(sender_id=user_id, receiver_id=user_id,
+                                             content=content, encrypted_content=ciphertext))
+        # Ключ утерян, открытого текста нет (хранение только шифротекста) - восстановить нечего
+        unrecoverable = Fernet(lost_key).encrypt(b'gone').decode()
+        nexa.db.session.add(nexa.Message(sender_id=user_id, receiver_id=user_id,
+                                         content='', encrypted_content=unrecoverable))
+        nexa.db.session.commit()
+
+        nexa.message_keys = KeyRing([('new', Fernet.generate_key()), ('old', old_key)])
+        try:
+            chunks = []
+            updated = nexa.reencrypt_messages(batch_size=3, progress=lambda last_id, count: chunks.append(count))
+            assert updated == 8
+            assert len(chunks) == 3
+            ciphertexts = [m.encrypted_content for m in nexa.Message.query.order_by(nexa.Message.id)]
+            assert all(c.startswith('new:') for c in ciphertexts[:-1])
+            assert ciphertexts[-1] == unrecoverable
+            assert nexa.message_keys.decrypt_many(ciphertexts[:-1]) == texts
+            assert nexa.reencrypt_messages(batch_size=3) == 0
+        finally:
+            nexa.message_keys = primary
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Шифрование сообщений работает")
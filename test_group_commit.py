@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Тесты групповой фиксации сообщений: пачки, порядок и подтверждение временным id
+Запуск как скрипта - сравнение сообщений/с с групповой фиксацией и без нее
+на файловой базе SQLite
+"""
+
+import os
+import sys
+import tempfile
+
+if __name__ == '__main__':
+    # Стоимость фиксации видна только на файловой базе; conftest допускает файл во временной папке
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'nexa.db')
+
+from conftest import connect, create_channel, print_title, setup_users, stopwatch
+from app import app, message_batches, Message, Conversation
+from group_commit import GroupCommitWriter
+
+
+def test_writer_groups_items_and_keeps_order():
+    batches = []
+    writer = GroupCommitWriter(batches.append, interval=0.05, max_batch=10)
+    for number in range(35):
+        writer.submit(number)
+    writer.drain()
+
+    assert [item for batch in batches for item in batch] == list(range(35))
+    assert all(len(batch) <= 10 for batch in batches)
+    assert len(batches) < 35
+    assert writer.stats()['messages'] == 35
+
+
+def test_writer_survives_failed_batch():
+    seen = []
+
+    def flush(batch):
+        if 'плохое' in batch:
+            raise ValueError('ошибка записи')
+        seen.extend(batch)
+
+    writer = GroupCommitWriter(flush, interval=0)
+    writer.submit('плохое')
+    writer.drain()
+    writer.submit('хорошее')
+    writer.drain()
+    assert seen == ['хорошее']
+
+
+def setup_channel():
+    alice_id, bob_id = setup_users('alice', 'bob')
+    return alice_id, bob_id, create_channel([alice_id, bob_id], name='news', is_public=True)
+
+
+class group_commit:
+    """Включает групповую фиксацию на время блока"""
+
+    def __init__(self, interval=0.5, max_batch=1000):
+        self.settings = {'interval': interval, 'max_batch': max_batch}
+
+    def __enter__(self):
+        self.previous = app.config['MESSAGE_GROUP_COMMIT'], message_batches.interval, message_batches.max_batch
+        app.config['MESSAGE_GROUP_COMMIT'] = True
+        message_batches.interval = self.settings['interval']
+        message_batches.max_batch = self.settings['max_batch']
+
+    def __exit__(self, *exc):
+        message_batches.drain()
+        app.config['MESSAGE_GROUP_COMMIT'], message_batches.interval, message_batches.max_batch = self.previous
+
+
+def test_messages_acknowledged_then_committed_in_order():
+    alice_id, bob_id, channel_id = setup_channel()
+    alice, bob = connect(alice_id), connect(bob_id)
+    bob.emit('join_channel', {'channel_id': channel_id})
+    bob.get_received()
+    alice.get_received()
+
+    # Пачка собирается дольше, чем идет отправка: в базу пишет только поток записи
+    with group_commit():
+        acks = [alice.emit('send_message', {'receiver_id': bob_id, 'content': f'привет {i}'}, callback=True)
+                for i in range(10)]
+        acks += [alice.emit('send_message', {'channel_id': channel_id, 'content': f'в канал {i}'}, callback=True)
+                 for i in range(5)]
+        assert all(ack['status'] == 'queued' for ack in acks)
+        assert len({ack['provisional_id'] for ack in acks}) == 15
+        message_batches.drain()
+
+    delivered = [packet['args'][0] for packet in bob.get_received() if packet['name'] == 'new_message']
+    alice.disconnect()
+    bob.disconnect()
+    assert [payload['provisional_id'] for payload in delivered] == [ack['provisional_id'] for ack in acks]
+    assert [payload['content'] for payload in delivered[:10]] == [f'привет {i}' for i in range(10)]
+    assert [payload['channel_seq'] for payload in delivered[10:]] == [1, 2, 3, 4, 5]
+    assert [payload['id'] for payload in delivered] == sorted(payload['id'] for payload in delivered)
+
+    with app.app_context():
+        assert Message.query.count() == 15
+        unread = {row.kind: row.unread_count for row in Conversation.query.filter_by(user_id=bob_id)}
+        assert unread == {'dm': 10, 'channel': 5}
+
+
+def test_failed_message_reported_to_sender():
+    alice_id, bob_id, channel_id = setup_channel()
+    alice = connect(alice_id)
+    alice.get_received()
+
+    with group_commit():
+        ack = alice.emit('send_message', {'receiver_id': bob_id, 'content': 'ответ', 'reply_to_id': {'id': 1}},
+                         callback=True)
+        good = alice.emit('send_message', {'receiver_id': bob_id, 'content': 'дошло'}, callback=True)
+        message_batches.drain()
+
+    received = alice.get_received()
+    alice.disconnect()
+    failed = [packet['args'][0] for packet in received if packet['name'] == 'message_failed']
+    assert failed == [{'provisional_id': ack['provisional_id']}]
+    sent = [packet['args'][0] for packet in received if packet['name'] == 'new_message']
+    assert [payload['provisional_id'] for payload in sent] == [good['provisional_id']]
+
+
+def benchmark(enabled, messages=500):
+    """Сообщений/с от отправки до фиксации в базе"""
+    alice_id, bob_id, _ = setup_channel()
+    alice = connect(alice_id)
+    previous = app.config['MESSAGE_GROUP_COMMIT']
+    app.config['MESSAGE_GROUP_COMMIT'] = enabled
+    message_batches.batches = message_batches.written = 0
+    try:
+        with stopwatch() as timer:
+            for i in range(messages):
+                alice.emit('send_message', {'receiver_id': bob_id, 'content': f'сообщение {i}'})
+            message_batches.drain()
+    finally:
+        app.config['MESSAGE_GROUP_COMMIT'] = previous
+        alice.disconnect()
+    with app.app_context():
+        assert Message.query.count() == messages
+    return messages / timer.elapsed, message_batches.stats()['avg_batch']
+
+
+if __name__ == '__main__':
+    print_title(f"Групповая фиксация сообщений ({app.config['SQLALCHEMY_DATABASE_URI']})")
+    for enabled in (False, True):
+        rate, avg_batch = benchmark(enabled)
+        title = 'групповая фиксация' if enabled else 'коммит на сообщение'
+        print(f"💬 {title:20s} | {rate:7.0f} сообщ./с | средняя пачка: {avg_batch}")
+    sys.exit(0)
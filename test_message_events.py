@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Тесты событий message_edited / message_deleted с версиями сообщений
+Клиент канала из теста повторяет логику channel_chat.html: история
+загружается один раз, дальше изменения применяются по событиям.
+Запуск как скрипта - число запросов к истории в сессии с частыми правками
+"""
+
+from conftest import connect, create_channel, login_client, print_title, received, setup_users
+from app import app, db, socketio, User, Message
+
+
+class ChannelClient:
+    """Клиент канала: история загружается один раз, дальше применяются события"""
+
+    CHANGES = ('new_message', 'message_edited', 'message_deleted', 'reaction_update')
+
+    def __init__(self, user_id, channel_id):
+        self.http = login_client(user_id)
+        self.socket = socketio.test_client(app, flask_test_client=self.http)
+        self.channel_id = channel_id
+        self.history_requests = 0
+        self.messages = {}  # id -> (текст, версия)
+        data = self.get(f'/api/channel/{channel_id}/messages?limit=100')
+        self.seq = data['seq']
+        for message in data['messages']:
+            self.messages[message['id']] = (message['content'], message['version'])
+
+    def get(self, url):
+        self.history_requests += 1
+        return self.http.get(url).get_json()
+
+    def sync(self):
+        data = self.get(f'/api/channel/{self.channel_id}/messages?since={self.seq}')
+        for message in data['messages']:
+            self.messages[message['id']] = (message['content'], message['version'])
+        for message_id in data['deleted']:
+            self.messages.pop(message_id, None)
+        self.seq = max(self.seq, data['seq'])
+
+    def pump(self):
+        for packet in self.socket.get_received():
+            data = packet['args'][0] if packet['args'] else None
+            if packet['name'] not in self.CHANGES or data.get('channel_id') != self.channel_id:
+                continue
+            if data['channel_seq'] != self.seq + 1:
+                self.sync()
+                continue
+            self.seq = data['channel_seq']
+            if packet['name'] == 'new_message':
+                self.messages[data['id']] = (data['content'], data['version'])
+            elif packet['name'] == 'message_edited':
+                if data['version'] > self.messages.get(data['message_id'], (None, 0))[1]:
+                    self.messages[data['message_id']] = (data['content'], data['version'])
+            elif packet['name'] == 'message_deleted':
+                self.messages.pop(data['message_id'], None)
+
+    def send(self, content):
+        self.socket.emit('send_message', {'channel_id': self.channel_id, 'content': content})
+
+    def disconnect(self):
+        self.socket.disconnect()
+
+
+def server_state(channel_id):
+    with app.app_context():
+        return {
+            message.id: (message.content, message.version)
+            for message in Message.query.filter_by(channel_id=channel_id, is_deleted=False)
+        }
+
+
+def test_dm_edit_and_delete_events():
+    alice_id, bob_id, eve_id = setup_users()
+    alice_http = login_client(alice_id)
+    alice = socketio.test_client(app, flask_test_client=alice_http)
+    bob = connect(bob_id)
+    eve = connect(eve_id)
+    alice.emit('send_message', {'receiver_id': bob_id, 'content': 'черновик'})
+    message = received(bob, 'new_message')[0]
+    assert message['version'] == 1
+    alice.get_received()
+    eve.get_received()
+
+    response = alice_http.put(f"/api/message/{message['id']}/edit", json={'content': 'итог'}).get_json()
+    assert response['version'] == 2
+    edited, = received(bob, 'message_edited')
+    assert edited['message_id'] == message['id']
+    assert (edited['content'], edited['version'], edited['is_edited']) == ('итог', 2, True)
+    assert received(alice, 'message_edited') == [edited]
+
+    alice_http.delete(f"/api/message/{message['id']}/delete", json={'delete_for_all': True})
+    deleted, = received(bob, 'message_deleted')
+    assert (deleted['version'], deleted['deleted_for_all']) == (3, True)
+    assert received(eve, 'message_edited') == [] and received(eve, 'message_deleted') == []
+
+    # Посторонний не может удалить чужое сообщение
+    assert login_client(eve_id).delete(f"/api/message/{message['id']}/delete",
+                                       json={'delete_for_all': True}).status_code == 404
+    for socket in (alice, bob, eve):
+        socket.disconnect()
+
+
+def test_only_sender_or_admin_can_delete():
+    alice_id, bob_id, eve_id, admin_id = setup_users(count=4)
+    channel_id = create_channel([alice_id, bob_id], is_public=True)
+    with app.app_context():
+        db.session.get(User, admin_id).is_admin = True
+        dm = Message(sender_id=alice_id, receiver_id=bob_id, content='лично', encrypted_content='-')
+        post = Message(sender_id=alice_id, channel_id=channel_id, content='в канал', encrypted_content='-')
+        db.session.add_all([dm, post])
+        db.session.commit()
+        dm_id, post_id = dm.id, post.id
+
+    bob, eve = login_client(bob_id), login_client(eve_id)
+    for delete_for_all in (False, True):
+        body = {'delete_for_all': delete_for_all}
+        # Собеседник и участник канала - не автор
+        assert bob.delete(f'/api/message/{dm_id}/delete', json=body).status_code == 403
+        assert bob.delete(f'/api/message/{post_id}/delete', json=body).status_code == 403
+        # Посторонний: личное сообщение не видно, публичный канал виден, но удалить нельзя
+        assert eve.delete(f'/api/message/{dm_id}/delete', json=body).status_code == 404
+        assert eve.delete(f'/api/message/{post_id}/delete', json=body).status_code == 403
+    with app.app_context():
+        assert not db.session.get(Message, dm_id).is_deleted
+        assert not db.session.get(Message, post_id).is_deleted
+
+    response = login_client(admin_id).delete(f'/api/message/{post_id}/delete', json={'delete_for_all': True})
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(Message, post_id).deleted_for_all
+
+
+def test_channel_clients_stay_in_sync_without_history_requests():
+    user_ids = setup_users(count=3)
+    channel_id = create_channel(user_ids)
+    clients = [ChannelClient(user_id, channel_id) for user_id in user_ids]
+    author = clients[0]
+
+    for i in range(5):
+        author.send(f'сообщение {i}')
+    for client in clients:
+        client.pump()
+    ids = sorted(author.messages)
+
+    for round_number in range(3):
+        for message_id in ids[:4]:
+            author.http.put(f'/api/message/{message_id}/edit', json={'content': f'правка {round_number}'})
+    author.http.delete(f'/api/message/{ids[4]}/delete', json={'delete_for_all': True})
+    for client in clients:
+        client.pump()
+
+    expected = server_state(channel_id)
+    assert all(client.messages == expected for client in clients)
+    assert all(version == 4 for _, version in expected.values())
+    # Только первая загрузка истории
+    assert [client.history_requests for client in clients] == [1, 1, 1]
+    for client in clients:
+        client.disconnect()
+
+
+def test_gap_in_sequence_falls_back_to_sync():
+    user_ids = setup_users(count=2)
+    channel_id = create_channel(user_ids)
+    author, reader = ChannelClient(user_ids[0], channel_id), ChannelClient(user_ids[1], channel_id)
+    author.send('первое')
+    reader.pump()
+    message_id, = reader.messages
+
+    author.http.put(f'/api/message/{message_id}/edit', json={'content': 'пропущенная правка'})
+    reader.socket.get_received()  # событие потеряно (например, при переподключении)
+    author.http.put(f'/api/message/{message_id}/edit', json={'content': 'последняя правка'})
+    reader.pump()
+
+    assert reader.messages == {message_id: ('последняя правка', 3)}
+    assert reader.history_requests == 2
+    author.disconnect()
+    reader.disconnect()
+
+
+def edit_heavy_session(clients_count=5, messages=20, edits=200):
+    """Запросы к истории за сессию правок: перезагрузка после каждой правки против событий"""
+    user_ids = setup_users(count=clients_count)
+    channel_id = create_channel(user_ids)
+    clients = [ChannelClient(user_id, channel_id) for user_id in user_ids]
+    for i in range(messages):
+        clients[i % clients_count].send(f'сообщение {i}')
+    for client in clients:
+        client.pump()
+    ids = sorted(clients[0].messages)
+
+    for i in range(edits):
+        # Сообщение j отправил клиент j % clients_count - каждый правит свои
+        author = i % clients_count
+        own = ids[author::clients_count]
+        clients[author].http.put(f'/api/message/{own[i % len(own)]}/edit', json={'content': f'правка {i}'})
+        for client in clients:
+            client.pump()
+
+    assert all(client.messages == server_state(channel_id) for client in clients)
+    with_events = sum(client.history_requests for client in clients)
+    for client in clients:
+        client.disconnect()
+    # Прежний клиент перезагружал историю после каждой правки; чтобы правку увидели
+    # все участники, перезагрузка нужна каждому из них
+    return clients_count + edits * clients_count, with_events
+
+
+if __name__ == '__main__':
+    print_title('Запросы к истории канала в сессии с частыми правками')
+    reloads, with_events = edit_heavy_session()
+    print(f"🔁 перезагрузка после правки: {reloads} запросов")
+    print(f"⚡ события message_edited:    {with_events} запросов")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тесты курсорной пагинации истории личных сообщений
+Работают без запущенного сервера: база данных в памяти и тестовый клиент Flask
+"""
+
+from conftest import count_statements, login_client, run_tests, setup_users
+from app import app, db, Message, toggle_reaction
+
+
+def setup_conversation(total=25):
+    """Создает двух пользователей и переписку из total сообщений"""
+    alice_id, bob_id, carol_id = setup_users('alice', 'bob', 'carol')
+    with app.app_context():
+        for i in range(total):
+            sender, receiver = (alice_id, bob_id) if i % 2 == 0 else (bob_id, alice_id)
+            db.session.add(Message(sender_id=sender, receiver_id=receiver,
+                                   content=f'msg {i}', encrypted_content='-'))
+        # Чужая переписка не должна попадать в выдачу
+        db.session.add(Message(sender_id=carol_id, receiver_id=bob_id,
+                               content='foreign', encrypted_content='-'))
+        db.session.commit()
+    return alice_id, bob_id
+
+
+def test_newest_page_first():
+    """Первая страница содержит последние сообщения по возрастанию"""
+    alice_id, bob_id = setup_conversation()
+    client = login_client(alice_id)
+
+    page = client.get(f'/api/messages/{bob_id}?limit=10').get_json()
+    contents = [m['content'] for m in page['messages']]
+
+    assert contents == [f'msg {i}' for i in range(15, 25)]
+    assert page['has_more'] is True
+    assert page['oldest_id'] == page['messages'][0]['id']
+
+
+def test_walk_back_with_before_id():
+    """Прокрутка назад по before_id проходит всю историю без пропусков и повторов"""
+    alice_id, bob_id = setup_conversation()
+    client = login_client(alice_id)
+
+    page = client.get(f'/api/messages/{bob_id}?limit=10').get_json()
+    seen = [m['content'] for m in page['messages']]
+    while page['has_more']:
+        page = client.get(f"/api/messages/{bob_id}?limit=10&before_id={page['oldest_id']}").get_json()
+        seen = [m['content'] for m in page['messages']] + seen
+
+    assert seen == [f'msg {i}' for i in range(25)]
+
+
+def test_after_id_returns_newer_messages():
+    """after_id возвращает только более новые сообщения"""
+    alice_id, bob_id = setup_conversation()
+    client = login_client(bob_id)
+
+    first = client.get(f'/api/messages/{alice_id}?limit=5').get_json()
+    older = client.get(f"/api/messages/{alice_id}?limit=5&before_id={first['oldest_id']}").get_json()
+    newer = client.get(f"/api/messages/{alice_id}?limit=3&after_id={older['newest_id']}").get_json()
+
+    assert [m['content'] for m in newer['messages']] == ['msg 20', 'msg 21', 'msg 22']
+    assert newer['has_more'] is True
+
+
+def test_deleted_messages_are_skipped():
+    """Удаленные сообщения не возвращаются ни на первой странице, ни при прокрутке"""
+    alice_id, bob_id = setup_conversation()
+    client = login_client(alice_id)
+    with app.app_context():
+        for message in Message.query.filter(Message.content.in_(['msg 24', 'msg 3'])):
+            message.is_deleted = True
+        db.session.commit()
+
+    page = client.get(f'/api/messages/{bob_id}?limit=10').get_json()
+    seen = [m['content'] for m in page['messages']]
+    while page['has_more']:
+        page = client.get(f"/api/messages/{bob_id}?limit=10&before_id={page['oldest_id']}").get_json()
+        seen = [m['content'] for m in page['messages']] + seen
+    assert seen == [f'msg {i}' for i in range(24) if i != 3]
+
+    response = client.get(f'/api/messages/{bob_id}?before_id=10&after_id=5')
+    assert response.status_code == 400
+
+
+def test_page_query_count_is_constant():
+    """Число запросов на страницу истории не зависит от числа реакций и ответов"""
+    alice_id, bob_id = setup_conversation()
+    with app.app_context():
+        messages = Message.query.filter(Message.channel_id.is_(None)).order_by(Message.id).all()
+        for i, msg in enumerate(messages[1:], start=1):
+            msg.reply_to_id = messages[i - 1].id
+            toggle_reaction(msg.id, alice_id, '👍')
+            toggle_reaction(msg.id, bob_id, '👍' if i % 2 else '🔥')
+        db.session.commit()
+
+    with count_statements() as statements:
+        page = login_client(alice_id).get(f'/api/messages/{bob_id}?limit=20').get_json()
+
+    # Пользователь сессии + две ветки диалога + реакции + вложения + ответы + отправители
+    assert len(statements) == 7
+    last = page['messages'][-1]
+    assert last['reply_to_content'].startswith('msg 23')
+    assert last['sender_username'] == 'alice'
+    assert {r['emoji']: r['count'] for r in last['reactions']} == {'👍': 1, '🔥': 1}
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Пагинация истории работает")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Тесты полнотекстового поиска по сообщениям (SQLite FTS5)
+"""
+
+from conftest import login_client, run_tests, setup_users
+from app import app, db, Message, Channel, ChannelMember
+
+
+def setup_data():
+    """Создает пользователей, личные сообщения и сообщения каналов"""
+    alice, bob, eve = setup_users('alice', 'bob', 'eve')
+    with app.app_context():
+        private = Channel(name='private', is_public=False, created_by=bob)
+        db.session.add(private)
+        db.session.commit()
+        db.session.add(ChannelMember(channel_id=private.id, user_id=bob))
+
+        def add(sender, receiver, content, channel=None, **flags):
+            db.session.add(Message(sender_id=sender, receiver_id=receiver,
+                                   channel_id=channel.id if channel else None,
+                                   content=content, encrypted_content='-', **flags))
+
+        add(alice, bob, 'Встречаемся завтра у офиса')
+        add(bob, alice, 'Завтра не получится, давай в пятницу')
+        add(bob, eve, 'Секретная встреча завтра')
+        add(alice, bob, 'завтра <script>alert(1)</script>')
+        add(alice, bob, 'Удаленное завтра', is_deleted=True)
+        add(bob, None, 'Завтра релиз в закрытом канале', channel=private)
+        db.session.commit()
+    return alice, bob
+
+
+def search(client, query, **params):
+    params['q'] = query
+    return client.get('/api/search/messages', query_string=params).get_json()
+
+
+def test_search_respects_access_and_deletion():
+    """Поиск видит только свои диалоги и доступные каналы, без удаленных сообщений"""
+    alice_id, bob_id = setup_data()
+
+    alice = search(login_client(alice_id), 'завтра')
+    assert sorted(r['content'] for r in alice['results']) == sorted([
+        'Встречаемся завтра у офиса',
+        'Завтра не получится, давай в пятницу',
+        'завтра <script>alert(1)</script>',
+    ])
+
+    bob = search(login_client(bob_id), 'завтра')
+    assert len(bob['results']) == 5
+
+
+def test_snippet_is_highlighted_and_escaped():
+    """Совпадения подсвечены, HTML из сообщения экранирован"""
+    alice_id, _ = setup_data()
+
+    results = search(login_client(alice_id), 'alert')['results']
+    assert len(results) == 1
+    snippet = results[0]['snippet']
+    assert '<mark>alert</mark>' in snippet
+    assert '<script>' not in snippet and '&lt;script&gt;' in snippet
+
+
+def test_prefix_and_pagination():
+    """Последнее слово ищется по префиксу, страницы не пересекаются"""
+    alice_id, _ = setup_data()
+    client = login_client(alice_id)
+
+    assert [r['content'] for r in search(client, 'пятн')['results']] == ['Завтра не получится, давай в пятницу']
+
+    first = search(client, 'завтра', per_page=2)
+    second = search(client, 'завтра', per_page=2, page=2)
+    assert first['has_more'] is True and second['has_more'] is False
+    ids = [r['id'] for r in first['results'] + second['results']]
+    assert len(ids) == len(set(ids)) == 3
+
+
+def test_index_follows_edits():
+    """Отредактированное сообщение ищется по новому тексту"""
+    alice_id, _ = setup_data()
+    with app.app_context():
+        message = Message.query.filter_by(content='Встречаемся завтра у офиса').first()
+        message.content = 'Встречаемся в понедельник'
+        db.session.commit()
+
+    client = login_client(alice_id)
+    assert [r['content'] for r in search(client, 'понедельник')['results']] == ['Встречаемся в понедельник']
+    assert 'Встречаемся в понедельник' not in [r['content'] for r in search(client, 'офиса')['results']]
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Поиск по сообщениям работает")
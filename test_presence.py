@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тесты реестра присутствия: счетчик вкладок и пакетная запись last_seen
+"""
+
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+from conftest import connect, count_statements, run_tests, setup_users
+from app import app, db, presence, flush_presence, admin_totals, PresenceConnection, User
+from presence import PresenceRegistry
+
+
+def test_tabs_are_refcounted():
+    """Пользователь в сети, пока открыта хотя бы одна вкладка"""
+    user_id, observer_id = setup_users(count=2)
+    observer = connect(observer_id)
+    observer.get_received()
+
+    first, second = connect(user_id), connect(user_id)
+    assert presence.is_online(user_id)
+    statuses = [p['args'][0]['status'] for p in observer.get_received() if p['name'] == 'user_status']
+    assert statuses == ['online']
+
+    first.disconnect()
+    assert presence.is_online(user_id)
+    second.disconnect()
+    assert not presence.is_online(user_id)
+    statuses = [p['args'][0]['status'] for p in observer.get_received() if p['name'] == 'user_status']
+    assert statuses == ['offline']
+    observer.disconnect()
+
+
+def test_connect_does_not_write_to_database():
+    """Подключения не пишут в таблицу user, запись идет одной пачкой"""
+    user_ids = setup_users(count=20)
+    flush_presence()
+
+    with count_statements() as statements:
+        clients = [connect(user_id) for user_id in user_ids]
+        assert not [s for s in statements if s.startswith('UPDATE')]
+
+        before = len(statements)
+        flush_presence()
+        # Пачка: число запросов не зависит от числа пользователей
+        assert 0 < len(statements) - before < len(user_ids) // 2
+
+    with app.app_context():
+        assert User.query.filter_by(is_online=True).count() == 20
+        assert all(user.last_seen for user in User.query.all())
+    for client in clients:
+        client.disconnect()
+
+
+def db_online(user_id):
+    with app.app_context():
+        return db.session.get(User, user_id, populate_existing=True).is_online
+
+
+def test_presence_shared_between_workers():
+    """Пользователь, открытый у другого воркера, в сети и после отключения вкладки у этого"""
+    user_id, observer_id = setup_users(count=2)
+    other = PresenceRegistry(worker_id='other-worker')
+    other.connect(user_id)
+    flush_presence(other)
+    flush_presence()
+    assert presence.is_online(user_id) and db_online(user_id)
+    with app.app_context():
+        assert admin_totals()['online_users'] == 1
+
+    observer = connect(observer_id)
+    observer.get_received()
+    tab = connect(user_id)
+    tab.disconnect()
+    # Этот воркер знает о подключении у другого: статус не меняется и в базе не сбрасывается
+    assert [p for p in observer.get_received() if p['name'] == 'user_status'] == []
+    flush_presence()
+    assert presence.is_online(user_id) and db_online(user_id)
+
+    other.disconnect(user_id)
+    flush_presence(other)
+    flush_presence()
+    assert not presence.is_online(user_id) and not db_online(user_id)
+
+    # Воркер, переставший продлевать пульс, перестает считаться
+    other.connect(user_id)
+    flush_presence(other)
+    with app.app_context():
+        PresenceConnection.query.filter_by(worker='other-worker').update(
+            {'seen_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+    flush_presence()
+    assert not presence.is_online(user_id) and not db_online(user_id)
+    observer.disconnect()
+
+
+def test_import_does_not_flush_on_exit():
+    """Процесс, который только импортирует app (миграции, скрипты), не пишет присутствие при выходе"""
+    result = subprocess.run([sys.executable, '-c', 'import app'], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env={**os.environ, 'DATABASE_URL': 'sqlite://'})
+    assert result.returncode == 0
+    assert 'присутствия' not in result.stdout + result.stderr
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Реестр присутствия работает")
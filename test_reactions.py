@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Тесты реакций: переключение без SELECT, счетчики и событие reaction_update
+"""
+
+from sqlalchemy import text
+
+from conftest import count_statements, create_channel, create_users, login_client, received, run_tests, setup_users
+from app import app, db, socketio, Message, MessageReaction, MessageReactionCount
+from migrations import reaction_counts
+
+
+def setup_data():
+    """Диалог alice-bob, канал alice+bob и посторонняя eve"""
+    user_ids = setup_users('alice', 'bob', 'eve')
+    channel_id = create_channel(user_ids[:2])
+    with app.app_context():
+        dm = Message(sender_id=user_ids[0], receiver_id=user_ids[1], content='привет', encrypted_content='-')
+        post = Message(sender_id=user_ids[0], channel_id=channel_id, content='новости', encrypted_content='-')
+        db.session.add_all([dm, post])
+        db.session.commit()
+        return user_ids, channel_id, dm.id, post.id
+
+
+def connect(client):
+    socket = socketio.test_client(app, flask_test_client=client)
+    socket.get_received()
+    return socket
+
+
+def updates(socket):
+    return received(socket, 'reaction_update')
+
+
+def stored_counts(message_id):
+    with app.app_context():
+        return {row.emoji: row.count for row in MessageReactionCount.query.filter_by(message_id=message_id)}
+
+
+def test_toggle_add_change_remove():
+    (alice_id, bob_id, _), _, dm_id, _ = setup_data()
+    alice, bob = login_client(alice_id), login_client(bob_id)
+
+    assert alice.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'}).get_json()['emoji'] == '👍'
+    data = bob.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'}).get_json()
+    assert data['reactions'] == [{'emoji': '👍', 'count': 2}]
+
+    # Другая реакция заменяет прежнюю, та же - снимает
+    data = bob.post(f'/api/message/{dm_id}/react', json={'emoji': '🔥'}).get_json()
+    assert data['emoji'] == '🔥'
+    assert data['reactions'] == [{'emoji': '👍', 'count': 1}, {'emoji': '🔥', 'count': 1}]
+    data = alice.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'}).get_json()
+    assert data['emoji'] is None
+    assert data['reactions'] == [{'emoji': '🔥', 'count': 1}]
+
+    with app.app_context():
+        assert [(r.user_id, r.emoji) for r in MessageReaction.query.filter_by(message_id=dm_id)] == [(bob_id, '🔥')]
+    assert stored_counts(dm_id) == {'🔥': 1}
+
+
+def test_reaction_update_goes_to_conversation_only():
+    (alice_id, bob_id, eve_id), channel_id, dm_id, post_id = setup_data()
+    alice_client, bob_client = login_client(alice_id), login_client(bob_id)
+    alice, bob, eve = connect(alice_client), connect(bob_client), connect(login_client(eve_id))
+
+    bob_client.post(f'/api/message/{dm_id}/react', json={'emoji': '❤️'})
+    expected = {'message_id': dm_id, 'channel_id': None, 'channel_seq': None, 'user_id': bob_id,
+                'emoji': '❤️', 'reactions': [{'emoji': '❤️', 'count': 1}]}
+    assert updates(alice) == [expected]
+    assert updates(bob) == [expected]
+    assert updates(eve) == []
+
+    alice.emit('join_channel', {'channel_id': channel_id})
+    alice.get_received()
+    bob.get_received()
+    bob_client.post(f'/api/message/{post_id}/react', json={'emoji': '👍'})
+    update, = updates(alice)
+    assert update['channel_id'] == channel_id
+    assert update['channel_seq'] == 1
+    assert updates(bob) == [update]  # участники входят в комнаты своих каналов при подключении
+    assert updates(eve) == []
+
+    for socket in (alice, bob, eve):
+        socket.disconnect()
+
+
+def test_outsiders_cannot_react():
+    (_, _, eve_id), _, dm_id, post_id = setup_data()
+    eve = login_client(eve_id)
+    assert eve.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'}).status_code == 404
+    assert eve.post(f'/api/message/{post_id}/react', json={'emoji': '👍'}).status_code == 404
+    assert eve.post('/api/message/9999/react', json={'emoji': '👍'}).status_code == 404
+    assert stored_counts(dm_id) == {}
+
+
+def test_react_cost_does_not_grow_with_reactions():
+    """Переключение не пересчитывает реакции сообщения"""
+    (alice_id, bob_id, _), _, dm_id, _ = setup_data()
+    alice = login_client(alice_id)
+
+    def statements_per_react():
+        with count_statements() as statements:
+            alice.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'})
+        return len(statements)
+
+    few = statements_per_react()
+    alice.post(f'/api/message/{dm_id}/react', json={'emoji': '👍'})  # снимаем, чтобы снова замерить добавление
+    fans = create_users(*(f'fan{i}' for i in range(50)))
+    with app.app_context():
+        db.session.add_all([MessageReaction(message_id=dm_id, user_id=user_id, emoji='👍') for user_id in fans])
+        db.session.commit()
+    assert statements_per_react() == few
+
+
+def test_migration_backfills_counts():
+    (alice_id, bob_id, _), _, dm_id, post_id = setup_data()
+    with app.app_context():
+        db.session.add_all([MessageReaction(message_id=dm_id, user_id=alice_id, emoji='👍'),
+                            MessageReaction(message_id=dm_id, user_id=bob_id, emoji='👍'),
+                            MessageReaction(message_id=post_id, user_id=bob_id, emoji='🔥')])
+        db.session.commit()
+        with db.engine.begin() as connection:
+            reaction_counts(connection)
+            reaction_counts(connection)
+            rows = connection.execute(text(
+                'SELECT message_id, emoji, count FROM message_reaction_count ORDER BY message_id'
+            )).all()
+    assert [tuple(row) for row in rows] == [(dm_id, '👍', 2), (post_id, '🔥', 1)]
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Тесты реакций пройдены")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест адресной доставки сообщений через комнаты Socket.IO
+Проверяет, что сообщение получают только участники диалога и что стоимость
+отправки не растет вместе с общим числом подключенных пользователей
+"""
+
+from conftest import connect, create_channel, print_title, received, setup_users, stopwatch
+
+
+def measure(total_users, messages=50):
+    """Отправляет messages сообщений между двумя пользователями при total_users подключениях"""
+    user_ids = setup_users(count=total_users)
+    clients = [connect(user_id) for user_id in user_ids]
+    for client in clients:
+        client.get_received()
+
+    sender, receiver = clients[0], clients[1]
+    with stopwatch() as timer:
+        for i in range(messages):
+            sender.emit('send_message', {'receiver_id': user_ids[1], 'content': f'hello {i}'})
+
+    delivered = sum(len(received(client, 'new_message')) for client in clients)
+    for client in clients:
+        client.disconnect()
+    return timer.elapsed / messages, delivered / messages
+
+
+def test_direct_message_reaches_only_participants():
+    """Личное сообщение получают только отправитель и получатель"""
+    user_ids = setup_users()
+    alice, bob, eve = (connect(user_id) for user_id in user_ids)
+    for client in (alice, bob, eve):
+        client.get_received()
+
+    alice.emit('send_message', {'receiver_id': user_ids[1], 'content': 'secret'})
+
+    assert [payload['content'] for payload in received(bob, 'new_message')] == ['secret']
+    assert len(received(alice, 'new_message')) == 1
+    assert received(eve, 'new_message') == []
+
+
+def test_channel_message_reaches_only_members():
+    """Сообщение канала получают только участники канала"""
+    user_ids = setup_users()
+    channel_id = create_channel(user_ids[:2])
+
+    alice, bob, eve = (connect(user_id) for user_id in user_ids)
+    for client in (alice, bob, eve):
+        client.get_received()
+
+    alice.emit('send_message', {'channel_id': channel_id, 'content': 'standup'})
+    eve.emit('send_message', {'channel_id': channel_id, 'content': 'intrusion'})
+
+    assert [payload['content'] for payload in received(bob, 'new_message')] == ['standup']
+    assert received(eve, 'new_message') == []
+
+
+def test_delivery_does_not_grow_with_connections():
+    """Число доставленных пакетов на сообщение не зависит от числа подключений"""
+    _, small = measure(5, messages=10)
+    _, large = measure(100, messages=10)
+    assert small == large == 2
+
+
+if __name__ == '__main__':
+    print_title('Стоимость отправки личного сообщения')
+    for total in (10, 100, 500):
+        per_message, delivered = measure(total)
+        print(f"👥 Подключений: {total:4d} | {per_message * 1000:.2f} мс/сообщение | "
+              f"доставлено пакетов: {delivered:.0f}")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тесты миграций схемы и планов частых запросов (EXPLAIN QUERY PLAN, SQLite)
+Каждый частый запрос должен идти по индексу, а не полным сканированием таблицы
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import conftest
+from app import app, db, User, Message, ChannelMember, MessageReaction, Report, Conversation
+from migrations import MIGRATIONS, run_migrations
+
+
+def reset_database():
+    conftest.reset_database()
+    with app.app_context():
+        # Таблица версий миграций не входит в модели, drop_all ее не удаляет
+        db.session.execute(text('DROP TABLE IF EXISTS schema_version'))
+        db.session.commit()
+
+
+def query_plan(query):
+    """Возвращает план запроса SQLAlchemy одной строкой"""
+    statement = query.statement if hasattr(query, 'statement') else query
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)).all()
+    return ' | '.join(row[-1] for row in rows)
+
+
+def assert_uses_index(query, *index_names):
+    """Проверяет, что план использует один из индексов index_names"""
+    plan = query_plan(query)
+    assert any(name in plan for name in index_names), plan
+
+
+def test_migrations_are_versioned_and_idempotent():
+    """Миграции применяются один раз, повторный запуск ничего не делает"""
+    reset_database()
+    with app.app_context():
+        applied = run_migrations(db.engine, db.metadata, log=lambda message: None)
+        assert applied == sorted(version for version, _, _ in MIGRATIONS)
+        assert run_migrations(db.engine, db.metadata, log=lambda message: None) == []
+
+
+def test_unique_constraints():
+    """Повторное участие в канале и вторая реакция пользователя отклоняются базой"""
+    reset_database()
+    with app.app_context():
+        db.session.add_all([ChannelMember(channel_id=1, user_id=1), ChannelMember(channel_id=1, user_id=1)])
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        else:
+            raise AssertionError('дубликат участника канала сохранен')
+
+        db.session.add_all([MessageReaction(message_id=1, user_id=1, emoji='👍'),
+                            MessageReaction(message_id=1, user_id=1, emoji='❤️')])
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        else:
+            raise AssertionError('вторая реакция пользователя сохранена')
+
+
+def test_hot_queries_use_indexes():
+    """Частые запросы выбирают нужные индексы"""
+    reset_database()
+    now = datetime.utcnow()
+    with app.app_context():
+        # История диалога и входящие
+        assert_uses_index(Message.query.filter(
+            Message.sender_id == 1, Message.receiver_id == 2, Message.id < 100
+        ).order_by(Message.id.desc()).limit(51), 'ix_message_conversation')
+        assert_uses_index(Message.query.filter(Message.receiver_id == 2).order_by(Message.id.desc()).limit(50),
+                          'ix_message_receiver')
+
+        # История и синхронизация канала
+        assert_uses_index(Message.query.filter(Message.channel_id == 1, Message.id < 100)
+                          .order_by(Message.id.desc()).limit(51), 'ix_message_channel')
+        assert_uses_index(Message.query.filter(Message.channel_id == 1, Message.channel_seq > 10)
+                          .order_by(Message.channel_seq), 'ix_message_channel_seq')
+
+        # Статистика по дням
+        day = db.func.date(Message.timestamp)
+        assert_uses_index(db.session.query(day, db.func.count()).filter(
+            Message.timestamp >= now - timedelta(days=30), Message.timestamp < now
+        ).group_by(day), 'ix_message_timestamp')
+        assert_uses_index(User.query.filter(User.created_at >= now - timedelta(days=7)), 'ix_user_created')
+
+        # Участие в каналах и реакции
+        assert_uses_index(ChannelMember.query.filter_by(channel_id=1, user_id=2), 'uq_channel_member')
+        assert_uses_index(ChannelMember.query.filter_by(user_id=2), 'ix_channel_member_user')
+        assert_uses_index(MessageReaction.query.filter_by(message_id=1, user_id=2), 'uq_message_reaction')
+
+        # Очередь жалоб и проверка повторной жалобы
+        assert_uses_index(Report.query.filter_by(status='pending').order_by(Report.created_at.desc()),
+                          'ix_report_status_created')
+        assert_uses_index(Report.query.filter_by(reporter_id=1, reported_user_id=2, status='pending'),
+                          'ix_report_reporter')
+
+        # Недавно заходившие пользователи
+        assert_uses_index(User.query.order_by(User.last_seen.desc()).limit(20), 'ix_user_last_seen')
+
+        # Список разговоров и значки непрочитанных
+        assert_uses_index(Conversation.query.filter(
+            Conversation.user_id == 1, Conversation.last_activity.isnot(None)
+        ).order_by(Conversation.last_activity.desc(), Conversation.id.desc()).limit(31), 'ix_conversation_recent')
+        assert_uses_index(db.session.query(Conversation.kind, Conversation.target_id, Conversation.unread_count)
+                          .filter(Conversation.user_id == 1, Conversation.unread_count > 0),
+                          'uq_conversation', 'ix_conversation_recent')
+
+
+if __name__ == '__main__':
+    conftest.run_tests(globals(), "✅ Миграции и индексы работают")
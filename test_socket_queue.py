@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тесты общей шины Socket.IO: два независимых сервера делят комнаты и события
+Внешние сервисы не нужны - используются шины memory:// и local://
+"""
+
+import socket
+import time
+
+import socketio
+
+from socket_queue import socketio_queue_options, MemoryManager, LocalSocketManager
+
+
+def create_server(url, channel):
+    """Создает сервер Socket.IO на общей шине и записывает отправленные им пакеты
+
+    Тестовый клиент Flask-SocketIO не работает с очередями сообщений,
+    поэтому клиенты подключаются к менеджеру напрямую, как это делает сервер.
+    """
+    manager = socketio_queue_options(url, channel=channel)['client_manager']
+    server = socketio.Server(client_manager=manager, async_mode='threading')
+    server.sent = []
+    server._send_eio_packet = lambda eio_sid, pkt: server.sent.append((eio_sid, pkt.data))
+    manager.initialize()
+    server.manager_initialized = True
+    return server
+
+
+def wait_for(server, timeout=3.0):
+    """Ждет, пока сервер отправит хотя бы один пакет своим клиентам"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and not server.sent:
+        time.sleep(0.02)
+    return server.sent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def check_shared_rooms(url, channel):
+    """Событие, отправленное в комнату сервером B, доходит до клиента сервера A"""
+    server_a = create_server(url, channel)
+    server_b = create_server(url, channel)
+
+    sid = server_a.manager.connect('eio_a', '/')
+    server_a.manager.enter_room(sid, '/', 'user_1')
+    server_b.manager.connect('eio_b', '/')
+    time.sleep(0.1)
+
+    server_b.emit('new_message', {'content': 'via queue'}, to='user_1')
+
+    sent = wait_for(server_a)
+    assert len(sent) == 1
+    assert sent[0][0] == 'eio_a'
+    assert 'via queue' in sent[0][1]
+    # Клиент сервера B не состоит в комнате и ничего не получает
+    assert server_b.sent == []
+
+
+def test_queue_options_select_backend():
+    """Схема адреса выбирает реализацию шины"""
+    assert socketio_queue_options(None) == {}
+    assert isinstance(socketio_queue_options('memory://')['client_manager'], MemoryManager)
+    assert isinstance(socketio_queue_options('local://127.0.0.1:5999')['client_manager'], LocalSocketManager)
+    assert socketio_queue_options('redis://localhost:6379/0')['message_queue'] == 'redis://localhost:6379/0'
+
+
+def test_memory_queue_shares_rooms():
+    check_shared_rooms('memory://', 'test-memory')
+
+
+def test_local_socket_queue_shares_rooms():
+    check_shared_rooms(f'local://127.0.0.1:{free_port()}', 'test-local')
+
+
+def test_publish_survives_broker_outage():
+    """Недоступная шина не роняет emit: событие теряется с записью в лог"""
+    manager = LocalSocketManager(f'local://127.0.0.1:{free_port()}', channel='test-outage')
+    attempts = []
+
+    def refuse():
+        attempts.append(1)
+        raise ConnectionRefusedError('шина перезапускается')
+
+    manager._connect = refuse
+    manager._publish({'method': 'emit', 'event': 'new_message'})
+    assert len(attempts) == 2 and manager.sock is None
+
+
+if __name__ == '__main__':
+    test_queue_options_select_backend()
+    test_memory_queue_shares_rooms()
+    test_local_socket_queue_shares_rooms()
+    test_publish_survives_broker_outage()
+    print("✅ Общая шина Socket.IO работает")
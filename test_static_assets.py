@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Тесты статических файлов: актуальность манифеста, отпечатки в url_for,
+сжатые варианты и заголовки кеширования
+Запуск как скрипта - сколько байт статики передается на загрузку страницы
+"""
+
+import gzip
+import os
+import tempfile
+import time
+
+from flask import url_for
+
+from conftest import app, run_tests
+from app import asset_manifest
+from static_assets import AssetManifest, scan
+
+
+def test_committed_manifest_is_current():
+    # Манифест в репозитории должен совпадать с файлами: python static_assets.py
+    assert AssetManifest(app.static_folder).load() == scan(app.static_folder)
+
+
+def test_stale_manifest_detected_and_rebuilt():
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, 'css'))
+        os.makedirs(os.path.join(folder, 'avatars'))
+        path = os.path.join(folder, 'css', 'site.css')
+        with open(path, 'w') as output:
+            output.write('body { color: red; }\n' * 200)
+        with open(os.path.join(folder, 'avatars', 'a.webp'), 'wb') as output:
+            output.write(b'RIFF')
+
+        manifest = AssetManifest(folder)
+        assert manifest.stale() == ['css/site.css']
+        manifest.build()
+        assert manifest.stale() == []
+        assert list(manifest.hashes) == ['css/site.css']  # пользовательские файлы не входят
+        assert os.path.exists(path + '.gz')
+
+        time.sleep(0.01)
+        with open(path, 'a') as output:
+            output.write('a { color: blue; }\n')
+        try:
+            manifest.check(strict=True)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('устаревший манифест не обнаружен')
+        old_version = manifest.version('css/site.css')
+        assert manifest.check(log=lambda message: None) == ['css/site.css']
+        assert manifest.version('css/site.css') != old_version
+
+
+def test_fingerprinted_url_and_immutable_gzip():
+    version = asset_manifest.version('css/style.css')
+    with app.test_request_context():
+        url = url_for('static', filename='css/style.css')
+    assert url == f'/static/css/style.css?v={version}'
+
+    client = app.test_client()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    with open(os.path.join(app.static_folder, 'css', 'style.css'), 'rb') as source:
+        original = source.read()
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Type'].startswith('text/css')
+    assert gzip.decompress(response.data) == original
+    assert len(response.data) < len(original) / 3
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    # Без хеша или со старым хешем - перепроверка по ETag
+    plain = client.get('/static/css/style.css')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == original
+    assert plain.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/static/css/style.css?v=0', headers={'If-None-Match': plain.headers['ETag']}).status_code == 304
+
+    html = client.get('/login').get_data(as_text=True)
+    assert f'css/style.css?v={version}' in html
+
+
+def test_variant_respects_q_values():
+    """Кодировка с q=0 запрещена клиентом и не выбирается"""
+    assert asset_manifest.variant('css/style.css', 'gzip') == ('css/style.css.gz', 'gzip')
+    assert asset_manifest.variant('css/style.css', 'gzip;q=0') is None
+    assert asset_manifest.variant('css/style.css', 'gzip; q=0.0, identity') is None
+    assert asset_manifest.variant('css/style.css', '*;q=0.5') is not None
+    assert asset_manifest.variant('css/style.css', '*, gzip;q=0, br;q=0') is None
+
+    response = app.test_client().get('/static/css/style.css', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+
+
+def benchmark():
+    """Байты CSS и JS на загрузку страницы чата: первая и повторная загрузка"""
+    names = ['css/style.css', 'js/main.js', 'js/chat.js']
+    client = app.test_client()
+    with app.test_request_context():
+        urls = [url_for('static', filename=name) for name in names]
+    plain = sum(os.path.getsize(os.path.join(app.static_folder, name)) for name in names)
+    compressed = sum(len(client.get(url, headers={'Accept-Encoding': 'gzip'}).data) for url in urls)
+    print(f'CSS и JS страницы чата: {plain / 1024:.1f} КБ без сжатия, {compressed / 1024:.1f} КБ в gzip')
+    print('Повторная загрузка: 0 запросов (immutable), раньше - по запросу на файл для перепроверки')
+
+
+if __name__ == '__main__':
+    run_tests(globals(), '✅ Все тесты статических файлов пройдены')
+    benchmark()
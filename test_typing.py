@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Тесты индикатора печати: адресная доставка, схлопывание повторов,
+истечение на сервере и лимит событий
+Запуск как скрипта - сколько событий печати получают клиенты за сессию набора
+"""
+
+from conftest import connect, create_channel, login_client, print_title, setup_users
+from app import app, db, typing_registry, User
+from typing_state import TypingRegistry
+
+
+def test_registry_transitions_and_expiry():
+    registry = TypingRegistry(ttl=5)
+    target = ('dm', 2)
+    assert registry.start(1, target, now=0) is True
+    assert registry.start(1, target, now=3) is False   # только продление
+    assert registry.expire(now=7) == []
+    assert registry.expire(now=8) == [(1, target)]
+    assert registry.stop(1, target) is False
+    assert registry.start(1, target, now=9) is True
+    assert registry.stop(1, target) is True
+
+    metrics = registry.snapshot()
+    assert (metrics['expired'], metrics['typing_now']) == (1, 0)
+    assert metrics['emitted'] == 4  # два начала, истечение и остановка
+
+
+def test_registry_rate_limit():
+    registry = TypingRegistry(rate_limit=3, rate_window=10)
+    assert [registry.allow(1, now=0) for _ in range(5)] == [True, True, True, False, False]
+    assert registry.allow(2, now=1) is True
+    assert registry.allow(1, now=10) is True
+    assert registry.snapshot()['rate_limited'] == 2
+
+
+def typing_events(socket):
+    return [(packet['name'], packet['args'][0]['user_id']) for packet in socket.get_received()
+            if packet['name'] in ('typing_start', 'typing_stop')]
+
+
+def reset_registry():
+    typing_registry.typing.clear()
+    typing_registry.windows.clear()
+    for name in typing_registry.metrics:
+        typing_registry.metrics[name] = 0
+
+
+def test_dm_typing_goes_to_receiver_once():
+    reset_registry()
+    alice_id, bob_id, eve_id = setup_users()
+    alice, bob, eve = connect(alice_id), connect(bob_id), connect(eve_id)
+    for socket in (alice, bob, eve):
+        socket.get_received()
+
+    for _ in range(5):
+        alice.emit('typing_start', {'receiver_id': bob_id})
+    alice.emit('typing_stop', {'receiver_id': bob_id})
+    alice.emit('typing_stop', {'receiver_id': bob_id})
+
+    assert typing_events(bob) == [('typing_start', alice_id), ('typing_stop', alice_id)]
+    assert typing_events(alice) == []
+    assert typing_events(eve) == []
+    metrics = typing_registry.snapshot()
+    assert (metrics['received'], metrics['emitted'], metrics['coalesced']) == (7, 2, 5)
+    for socket in (alice, bob, eve):
+        socket.disconnect()
+
+
+def test_channel_typing_scoped_to_members():
+    reset_registry()
+    alice_id, bob_id, eve_id = setup_users()
+    channel_id = create_channel([alice_id, bob_id])
+    alice, bob, eve = connect(alice_id), connect(bob_id), connect(eve_id)
+    for socket in (alice, bob, eve):
+        socket.get_received()
+
+    alice.emit('typing_start', {'channel_id': channel_id})
+    eve.emit('typing_start', {'channel_id': channel_id})  # не участник
+    assert typing_events(bob) == [('typing_start', alice_id)]
+    assert typing_events(alice) == []
+    assert typing_events(eve) == []
+
+    # Отключение снимает состояние печати
+    alice.disconnect()
+    assert typing_events(bob) == [('typing_stop', alice_id)]
+    bob.disconnect()
+    eve.disconnect()
+
+
+def test_expired_typing_is_stopped_by_server():
+    reset_registry()
+    alice_id, bob_id, _ = setup_users()
+    alice, bob = connect(alice_id), connect(bob_id)
+    bob.get_received()
+    from app import emit_expired_typing
+
+    alice.emit('typing_start', {'receiver_id': bob_id})
+    for user_id, target in typing_registry.expire(now=float('inf')):
+        emit_expired_typing(user_id, target)
+    assert typing_events(bob) == [('typing_start', alice_id), ('typing_stop', alice_id)]
+    alice.disconnect()
+    bob.disconnect()
+
+
+def test_admin_typing_metrics():
+    reset_registry()
+    admin_id, user_id, _ = setup_users()
+    with app.app_context():
+        db.session.get(User, admin_id).is_admin = True
+        db.session.commit()
+
+    assert login_client(user_id).get('/api/admin/typing').status_code == 403
+    data = login_client(admin_id).get('/api/admin/typing').get_json()
+    assert set(data) == {'received', 'emitted', 'coalesced', 'rate_limited', 'expired', 'typing_now'}
+
+
+if __name__ == '__main__':
+    # Один пользователь набирает 10 сообщений по 40 символов при 50 подключенных
+    users, keystrokes, messages = 50, 40, 10
+    reset_registry()
+    typing_registry.rate_limit = 10 ** 6  # замеряем только адресность и схлопывание
+    user_ids = setup_users(count=users)
+    sockets = [connect(user_id) for user_id in user_ids]
+    for socket in sockets:
+        socket.get_received()
+    for _ in range(messages):
+        # Прежний клиент слал typing_start на каждое нажатие
+        for _ in range(keystrokes):
+            sockets[0].emit('typing_start', {'receiver_id': user_ids[1]})
+        sockets[0].emit('typing_stop', {'receiver_id': user_ids[1]})
+    delivered = sum(len(typing_events(socket)) for socket in sockets)
+    metrics = typing_registry.snapshot()
+    print_title('События печати за сессию набора')
+    print(f"📨 получено сервером: {metrics['received']}, разослано переходов: {metrics['emitted']}")
+    print(f"📢 broadcast на все сокеты: {(keystrokes + 1) * messages * users} доставок")
+    print(f"🎯 только собеседнику со схлопыванием: {delivered} доставок")
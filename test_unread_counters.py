@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Тесты счетчиков непрочитанных сообщений (Conversation)
+"""
+
+from conftest import count_statements, create_channel, login_client, run_tests, setup_users
+from app import app, socketio
+
+
+def setup_channel():
+    """Создает alice, bob, carol и канал team с участниками alice и bob"""
+    user_ids = setup_users('alice', 'bob', 'carol')
+    return create_channel(user_ids[:2]), user_ids
+
+
+def send(client, **message):
+    socket = socketio.test_client(app, flask_test_client=client)
+    socket.emit('send_message', message)
+    socket.disconnect()
+
+
+def test_counters_follow_sends_and_reads():
+    """Отправка увеличивает счетчики получателей, прочтение их сбрасывает"""
+    channel_id, (alice_id, bob_id, carol_id) = setup_channel()
+    alice, bob, carol = (login_client(user_id) for user_id in (alice_id, bob_id, carol_id))
+
+    send(alice, receiver_id=bob_id, content='hi')
+    send(alice, receiver_id=bob_id, content='are you there?')
+    send(carol, receiver_id=bob_id, content='hello')
+    send(alice, channel_id=channel_id, content='standup')
+
+    badges = bob.get('/api/unread').get_json()
+    assert badges['dialogs'] == {str(alice_id): 2, str(carol_id): 1}
+    assert badges['channels'] == {str(channel_id): 1}
+    assert badges['total'] == 4
+    # Собственные сообщения не считаются непрочитанными
+    assert alice.get('/api/unread').get_json()['total'] == 0
+
+    read = bob.post('/api/read', json={'user_id': alice_id}).get_json()
+    assert read['unread_count'] == 0
+    bob.post('/api/read', json={'channel_id': channel_id})
+
+    badges = bob.get('/api/unread').get_json()
+    assert badges['dialogs'] == {str(carol_id): 1}
+    assert badges['channels'] == {}
+
+    # Ответ отправителя отмечает диалог прочитанным
+    send(bob, receiver_id=carol_id, content='hey carol')
+    assert bob.get('/api/unread').get_json()['dialogs'] == {}
+
+
+def test_partial_read_recounts_rest():
+    """Отметка до конкретного сообщения оставляет непрочитанными более новые"""
+    channel_id, (alice_id, bob_id, carol_id) = setup_channel()
+    alice, bob = login_client(alice_id), login_client(bob_id)
+    for i in range(5):
+        send(alice, channel_id=channel_id, content=f'm{i}')
+
+    newest = bob.get(f'/api/channel/{channel_id}/messages').get_json()['messages']
+    read = bob.post('/api/read', json={'channel_id': channel_id, 'message_id': newest[1]['id']}).get_json()
+    assert read['unread_count'] == 3
+    assert read['last_read_message_id'] == newest[1]['id']
+
+    # Отметка не сдвигается назад
+    read = bob.post('/api/read', json={'channel_id': channel_id, 'message_id': newest[0]['id']}).get_json()
+    assert read['last_read_message_id'] == newest[1]['id']
+
+    assert login_client(carol_id).post('/api/read', json={'channel_id': channel_id}).status_code == 403
+
+
+def test_invalid_ids_are_rejected():
+    """Нечисловые идентификаторы дают 400, а не ошибку сервера"""
+    channel_id, (alice_id, bob_id, _) = setup_channel()
+    bob = login_client(bob_id)
+    for payload in ({'channel_id': 'abc'}, {'channel_id': [channel_id]}, {'channel_id': {'id': 1}},
+                    {'user_id': 'abc'}, {'user_id': alice_id, 'message_id': 'last'},
+                    {'channel_id': channel_id, 'message_id': [1]}):
+        assert bob.post('/api/read', json=payload).status_code == 400, payload
+    assert bob.post('/api/read', data='not json', content_type='application/json').status_code == 400
+    assert bob.post('/api/read', json={'channel_id': str(channel_id)}).status_code == 200
+    assert bob.post('/api/read', json={'user_id': 9999}).status_code == 404
+
+
+def test_read_marker_stays_inside_conversation():
+    """Отметку нельзя увести за последнее сообщение или на сообщение другого разговора"""
+    channel_id, (alice_id, bob_id, carol_id) = setup_channel()
+    alice, bob = login_client(alice_id), login_client(bob_id)
+    send(alice, receiver_id=bob_id, content='first')
+    send(login_client(carol_id), receiver_id=bob_id, content='other')
+
+    read = bob.post('/api/read', json={'user_id': alice_id, 'message_id': 10 ** 12}).get_json()
+    newest = read['last_read_message_id']
+    assert read['unread_count'] == 0 and newest < 10 ** 12
+
+    # Новое сообщение после такой отметки снова непрочитанное
+    send(alice, receiver_id=bob_id, content='second')
+    assert bob.get('/api/unread').get_json()['dialogs'][str(alice_id)] == 1
+
+    # id из диалога с carol не сдвигает отметку диалога с alice
+    carol_message = bob.get(f'/api/messages/{carol_id}').get_json()['messages'][-1]['id']
+    read = bob.post('/api/read', json={'user_id': alice_id, 'message_id': carol_message}).get_json()
+    assert read['last_read_message_id'] == newest and read['unread_count'] == 1
+    read = bob.post('/api/read', json={'user_id': alice_id, 'message_id': -5}).get_json()
+    assert read['last_read_message_id'] == newest
+
+
+def test_badges_are_one_query():
+    """Значки всех диалогов читаются одним запросом к conversation"""
+    channel_id, (alice_id, bob_id, carol_id) = setup_channel()
+    bob = login_client(bob_id)
+    send(login_client(alice_id), receiver_id=bob_id, content='hi')
+
+    with count_statements() as statements:
+        bob.get('/api/unread')
+
+    queries = [statement for statement in statements if 'conversation' in statement]
+    assert len(queries) == 1
+    assert 'message' not in queries[0]
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Счетчики непрочитанных работают")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Тесты поиска пользователей по индексу префиксов и триграмм
+"""
+
+from conftest import login_client, run_tests, setup_users
+from app import app, db, User, user_search_index
+from user_index import UserSearchIndex
+
+
+def test_index_ranks_exact_prefix_contains():
+    """Точное совпадение выше префикса, префикс выше вхождения"""
+    index = UserSearchIndex()
+    index.load([
+        (1, 'annabel', 'Anna Bell'),
+        (2, 'ann', 'Ann'),
+        (3, 'joanna', 'Jo'),
+        (4, 'bob', 'Bob'),
+    ])
+
+    assert index.search('ann') == [(2, 'exact'), (1, 'prefix'), (3, 'partial')]
+    assert index.search('ANN', exclude=2) == [(1, 'prefix'), (3, 'partial')]
+    assert index.search('a', limit=10) == [(2, 'prefix'), (1, 'prefix'), (3, 'partial')]
+    assert index.search('xyz') == []
+
+
+def test_short_queries_match_inside_names():
+    """Запросы из одного-двух символов находят вхождения, как ILIKE '%q%'"""
+    index = UserSearchIndex()
+    index.load([(1, 'ivan', 'Иван'), (2, 'anton', 'Антон'), (3, 'bob', 'Bob')])
+
+    assert index.search('an') == [(2, 'prefix'), (1, 'partial')]
+    assert index.search('ан') == [(2, 'prefix'), (1, 'partial')]
+    assert index.search('v') == [(1, 'partial')]
+    assert index.search('o') == [(3, 'partial'), (2, 'partial')]
+    assert index.search('zz') == []
+
+
+def test_index_updates_names():
+    """Смена display_name и удаление пользователя сразу видны в поиске"""
+    index = UserSearchIndex()
+    index.load([(1, 'alice', 'Alice')])
+
+    index.add(1, 'alice', 'Королева')
+    index.add(2, 'bob', 'Bob')
+    assert index.search('корол') == [(1, 'prefix')]
+    assert index.search('rol') == []
+    assert index.search('bo') == [(2, 'prefix')]
+
+    index.remove(2)
+    assert index.search('bob') == []
+
+
+def test_search_endpoint_sees_new_registrations():
+    """Новые пользователи находятся поиском без перезагрузки индекса"""
+    me_id, = setup_users('me')
+    with app.app_context():
+        db.session.add(User(username='sergey', display_name='Сергей', email='s@nexa.com', password_hash='-'))
+        db.session.commit()
+    user_search_index.loaded_at = None
+
+    client = login_client(me_id)
+
+    assert [u['username'] for u in client.get('/search_users?q=серг').get_json()] == ['sergey']
+
+    client.post('/register', data={'username': 'sergio', 'email': 'sergio@nexa.com', 'password': 'pw'})
+    with app.app_context():
+        # Пользователь, созданный в обход этого процесса (другим воркером)
+        db.session.add(User(username='serg', display_name='Serg', email='serg@nexa.com', password_hash='-'))
+        db.session.commit()
+
+    results = client.get('/search_users?q=serg').get_json()
+    assert [(u['username'], u['match_type']) for u in results] == [
+        ('serg', 'exact'), ('sergey', 'prefix'), ('sergio', 'prefix')
+    ]
+
+
+if __name__ == '__main__':
+    run_tests(globals(), "✅ Поиск пользователей работает")
@@ -0,0 +1,107 @@
+"""
+Состояние "печатает..." пользователей Nexa Messenger
+
+Реестр хранит, кто печатает в каком диалоге или канале, и до какого
+момента. Событие уходит собеседникам только при смене состояния:
+повторный typing_start лишь продлевает срок. Если клиент не прислал
+typing_stop (закрыл вкладку, перестал печатать), состояние истекает
+на сервере, и typing_stop рассылается фоновой задачей. Поэтому клиенту
+достаточно сообщать о начале печати (с редким продлением) и о ее конце.
+
+Каждый пользователь может прислать не больше rate_limit событий
+typing_start за rate_window секунд, лишние отбрасываются.
+"""
+
+import os
+import threading
+import time
+
+
+class TypingRegistry:
+    def __init__(self, ttl=6, rate_limit=20, rate_window=10):
+        self.ttl = ttl
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.typing = {}    # (user_id, цель) -> момент истечения; цель - ('dm', id) или ('channel', id)
+        self.windows = {}   # user_id -> [начало окна, число событий]
+        self.expirer_pid = None
+        self.metrics = {'received': 0, 'emitted': 0, 'coalesced': 0, 'rate_limited': 0, 'expired': 0}
+
+    def allow(self, user_id, now=None):
+        """Учитывает событие пользователя; False, если превышен лимит"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.metrics['received'] += 1
+            window = self.windows.get(user_id)
+            if window is None or now - window[0] >= self.rate_window:
+                window = self.windows[user_id] = [now, 0]
+            window[1] += 1
+            if window[1] > self.rate_limit:
+                self.metrics['rate_limited'] += 1
+                return False
+            return True
+
+    def count_received(self):
+        """Учитывает событие, которое не проходит через лимит (typing_stop)"""
+        with self.lock:
+            self.metrics['received'] += 1
+
+    def start(self, user_id, target, now=None):
+        """Отмечает начало печати; True, если собеседникам нужно отправить typing_start"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            started = (user_id, target) not in self.typing
+            self.typing[(user_id, target)] = now + self.ttl
+            self.metrics['emitted' if started else 'coalesced'] += 1
+            return started
+
+    def stop(self, user_id, target):
+        """Отмечает конец печати; True, если собеседникам нужно отправить typing_stop"""
+        with self.lock:
+            stopped = self.typing.pop((user_id, target), None) is not None
+            self.metrics['emitted' if stopped else 'coalesced'] += 1
+            return stopped
+
+    def stop_all(self, user_id):
+        """Снимает все состояния пользователя (отключение); возвращает их цели"""
+        with self.lock:
+            targets = [target for (typing_user, target) in self.typing if typing_user == user_id]
+            for target in targets:
+                del self.typing[(user_id, target)]
+            self.metrics['emitted'] += len(targets)
+            return targets
+
+    def expire(self, now=None):
+        """Снимает истекшие состояния; возвращает [(user_id, цель)] для рассылки typing_stop"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            expired = [key for key, expires_at in self.typing.items() if expires_at <= now]
+            for key in expired:
+                del self.typing[key]
+            self.metrics['expired'] += len(expired)
+            self.metrics['emitted'] += len(expired)
+            # Окна лимита тех, кто давно молчит, больше не нужны
+            for user_id in [user_id for user_id, window in self.windows.items() if now - window[0] >= self.rate_window]:
+                del self.windows[user_id]
+            return expired
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.metrics, typing_now=len(self.typing))
+
+    def start_expirer(self, emit_stop, start_background_task, interval=1):
+        """Запускает периодическое снятие истекших состояний (один раз на процесс)"""
+        with self.lock:
+            # После fork воркера gunicorn поток мастера не существует
+            if self.expirer_pid == os.getpid():
+                return
+            self.expirer_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                for user_id, target in self.expire():
+                    emit_stop(user_id, target)
+
+        start_background_task(run)
@@ -0,0 +1,135 @@
+"""
+Индекс для поиска пользователей по username и display_name
+
+Префиксы ищутся двоичным поиском по отсортированному списку имен,
+вхождения - по триграммам. У запроса короче трех символов триграмм
+нет, и вхождения ищутся перебором всех имен. Ранжирование за один проход:
+точное совпадение > начало имени > вхождение в имя.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_CONTAINS = 2
+
+MATCH_TYPES = {MATCH_EXACT: 'exact', MATCH_PREFIX: 'prefix', MATCH_CONTAINS: 'partial'}
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class UserSearchIndex:
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.users = {}       # user_id -> (username, display_name)
+        self.sorted_names = []  # [(имя в нижнем регистре, user_id)] для поиска по префиксу
+        self.postings = {}    # триграмма -> {user_id}
+        self.max_user_id = 0
+        self.loaded_at = None
+
+    def needs_reload(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.refresh_interval
+
+    def load(self, rows):
+        """Полностью перестраивает индекс из [(user_id, username, display_name)]"""
+        with self.lock:
+            self.users = {}
+            self.sorted_names = []
+            self.postings = {}
+            self.max_user_id = 0
+            for user_id, username, display_name in rows:
+                self.sorted_names.extend(self._add(user_id, username, display_name))
+            self.sorted_names.sort()
+            self.loaded_at = time.time()
+
+    def add(self, user_id, username, display_name):
+        """Добавляет пользователя или обновляет его имена"""
+        with self.lock:
+            self._remove(user_id)
+            for name in self._add(user_id, username, display_name):
+                bisect.insort(self.sorted_names, name)
+
+    def remove(self, user_id):
+        with self.lock:
+            self._remove(user_id)
+
+    def _names(self, username, display_name):
+        return {username.lower(), (display_name or '').lower()} - {''}
+
+    def _add(self, user_id, username, display_name):
+        """Индексирует имена пользователя; возвращает записи для sorted_names"""
+        self.users[user_id] = (username, display_name)
+        self.max_user_id = max(self.max_user_id, user_id)
+        entries = []
+        for name in self._names(username, display_name):
+            entries.append((name, user_id))
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, set()).add(user_id)
+        return entries
+
+    def _remove(self, user_id):
+        names = self.users.pop(user_id, None)
+        if names is None:
+            return
+        for name in self._names(*names):
+            position = bisect.bisect_left(self.sorted_names, (name, user_id))
+            if position < len(self.sorted_names) and self.sorted_names[position] == (name, user_id):
+                del self.sorted_names[position]
+            for gram in trigrams(name):
+                posting = self.postings.get(gram)
+                if posting is not None:
+                    posting.discard(user_id)
+                    if not posting:
+                        del self.postings[gram]
+
+    def _prefix_matches(self, query):
+        position = bisect.bisect_left(self.sorted_names, (query, -1))
+        while position < len(self.sorted_names) and self.sorted_names[position][0].startswith(query):
+            yield self.sorted_names[position][1]
+            position += 1
+
+    def _contains_candidates(self, query):
+        grams = trigrams(query)
+        if not grams:
+            # Короткий запрос: перебор, как прежний ILIKE '%q%'
+            return set(self.users)
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query, limit=20, exclude=None):
+        """Возвращает [(user_id, match_type)] в порядке релевантности"""
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        with self.lock:
+            candidates = set(self._prefix_matches(query)) | self._contains_candidates(query)
+            candidates.discard(exclude)
+
+            scored = []
+            for user_id in candidates:
+                username, display_name = self.users[user_id]
+                names = self._names(username, display_name)
+                if query in names:
+                    match = MATCH_EXACT
+                elif any(name.startswith(query) for name in names):
+                    match = MATCH_PREFIX
+                elif any(query in name for name in names):
+                    match = MATCH_CONTAINS
+                else:
+                    # Триграммы совпали в разных именах или имя не подошло при переборе
+                    continue
+                scored.append((match, len(username), username.lower(), user_id))
+
+        return [(user_id, MATCH_TYPES[match]) for match, _, _, user_id in heapq.nsmallest(limit, scored)]